@@ -1,4 +1,5 @@
 import os
+from contextlib import contextmanager
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 from dotenv import load_dotenv
@@ -76,3 +77,15 @@ def get_db():
         yield db
     finally:
         db.close()
+
+@contextmanager
+def session_scope():
+    """
+    Short-lived session for code that must not hold a pooled connection
+    for the lifetime of a request (e.g. long-running SSE streams).
+    """
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
@@ -4,7 +4,12 @@ from fastapi.middleware.cors import CORSMiddleware
 from .models import kitchen, base, chat as chat_model, meals, workspace
 from .db import engine
 from app.routers import stock, upload, users, chat, meals, kitchens
-from app.migration_utils import check_and_migrate_meals_table
+from app.migration_utils import check_and_migrate_meals_table, check_and_migrate_chat_indexes, check_and_migrate_stock_search, check_and_migrate_stock_quantities, check_and_migrate_stock_version, check_and_migrate_stock_ledger, check_and_migrate_upload_hashes
+from app.services.name_search import setup_name_search
+from app.services.chat_retention import run_archive_loop, ARCHIVE_INTERVAL_HOURS
+from app.services.stock_ledger import run_checkpoint_loop, CHECKPOINT_INTERVAL_HOURS
+from app.services.upload_jobs import UploadWorker, UPLOAD_WORKER_MODE
+import asyncio
 import os
 from dotenv import load_dotenv
 
@@ -39,12 +44,41 @@ async def lifespan(app: FastAPI):
     try:
         base.Base.metadata.create_all(bind=engine)
         print("Table creation completed.", flush=True)
+        check_and_migrate_chat_indexes(engine)
+        check_and_migrate_stock_search(engine)
+        check_and_migrate_stock_quantities(engine)
+        check_and_migrate_stock_version(engine)
+        check_and_migrate_stock_ledger(engine)
+        check_and_migrate_upload_hashes(engine)
+        setup_name_search(engine)
     except Exception as e:
         print(f"Table creation failed: {e}", flush=True)
+
+    archive_task = None
+    if ARCHIVE_INTERVAL_HOURS > 0:
+        print(f"Chat archiving enabled: every {ARCHIVE_INTERVAL_HOURS}h", flush=True)
+        archive_task = asyncio.create_task(run_archive_loop())
+
+    checkpoint_task = None
+    if CHECKPOINT_INTERVAL_HOURS > 0:
+        print(f"Stock ledger checkpoints enabled: every {CHECKPOINT_INTERVAL_HOURS}h", flush=True)
+        checkpoint_task = asyncio.create_task(run_checkpoint_loop())
+
+    # Upload OCR jobs: processed here unless dedicated workers run (upload_worker.py)
+    upload_worker = None
+    if UPLOAD_WORKER_MODE == "inline":
+        upload_worker = UploadWorker()
+        upload_worker.start()
     
     yield
     # Shutdown: Clean up resources if needed (e.g., db connections)
     print("Shutting down...", flush=True)
+    if archive_task:
+        archive_task.cancel()
+    if checkpoint_task:
+        checkpoint_task.cancel()
+    if upload_worker:
+        await asyncio.to_thread(upload_worker.stop)
 
 app = FastAPI(title="Kitchen Buddy API", lifespan=lifespan)
 
@@ -55,6 +89,7 @@ app.include_router(chat.router)
 app.include_router(meals.router)
 app.include_router(kitchens.router)
 
+app.add_middleware(upload.UploadSizeLimit)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -40,3 +40,158 @@ def check_and_migrate_meals_table(engine: Engine):
     except Exception as e:
         print(f"Migration error: {e}")
 
+
+def check_and_migrate_chat_indexes(engine: Engine):
+    """
+    Creates the composite chat history index on existing databases
+    (create_all only adds indexes for new tables).
+    """
+    try:
+        inspector = inspect(engine)
+        if not inspector.has_table("chat_messages"):
+            return
+
+        existing = [idx['name'] for idx in inspector.get_indexes('chat_messages')]
+        if "ix_chat_messages_user_ts_id" in existing:
+            return
+
+        print("Migrating: Adding index 'ix_chat_messages_user_ts_id' to 'chat_messages' table.")
+        with engine.connect() as conn:
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_chat_messages_user_ts_id ON chat_messages (user_id, timestamp, id)"))
+            conn.commit()
+    except Exception as e:
+        print(f"Chat index migration error: {e}")
+
+
+def check_and_migrate_stock_search(engine: Engine):
+    """
+    Adds kitchen_stock.search_name (normalized item name used by name search)
+    and backfills it for existing rows.
+    """
+    from app.services.name_search import normalize_name
+    try:
+        inspector = inspect(engine)
+        if not inspector.has_table("kitchen_stock"):
+            return
+
+        existing_columns = [col['name'] for col in inspector.get_columns('kitchen_stock')]
+        with engine.connect() as conn:
+            if "search_name" not in existing_columns:
+                print("Migrating: Adding column 'search_name' to 'kitchen_stock' table.")
+                conn.execute(text("ALTER TABLE kitchen_stock ADD COLUMN search_name VARCHAR"))
+                conn.commit()
+
+            rows = conn.execute(text(
+                "SELECT stock_id, item_name FROM kitchen_stock WHERE search_name IS NULL AND item_name IS NOT NULL"
+            )).fetchall()
+            if rows:
+                print(f"Migrating: Backfilling search_name for {len(rows)} stock items.")
+                conn.execute(
+                    text("UPDATE kitchen_stock SET search_name = :search_name WHERE stock_id = :stock_id"),
+                    [{"stock_id": row[0], "search_name": normalize_name(row[1])} for row in rows],
+                )
+                conn.commit()
+    except Exception as e:
+        print(f"Stock search migration error: {e}")
+
+
+def check_and_migrate_stock_quantities(engine: Engine):
+    """
+    Adds the numeric quantity columns to kitchen_stock (amount, unit, base_amount,
+    base_unit) and backfills them by parsing the existing quantity strings.
+    """
+    from app.services.inventory import QuantityParser
+    try:
+        inspector = inspect(engine)
+        if not inspector.has_table("kitchen_stock"):
+            return
+
+        existing_columns = [col['name'] for col in inspector.get_columns('kitchen_stock')]
+        new_columns = {
+            "amount": "FLOAT",
+            "unit": "VARCHAR",
+            "base_amount": "FLOAT",
+            "base_unit": "VARCHAR",
+        }
+        with engine.connect() as conn:
+            for col_name, col_type in new_columns.items():
+                if col_name not in existing_columns:
+                    print(f"Migrating: Adding column '{col_name}' to 'kitchen_stock' table.")
+                    conn.execute(text(f"ALTER TABLE kitchen_stock ADD COLUMN {col_name} {col_type}"))
+                    conn.commit()
+
+            rows = conn.execute(text(
+                "SELECT stock_id, quantity FROM kitchen_stock WHERE amount IS NULL AND quantity IS NOT NULL"
+            )).fetchall()
+            updates = []
+            for stock_id, quantity in rows:
+                amount, unit = QuantityParser.parse(quantity)
+                if amount is None:
+                    continue
+                base_unit, factor = QuantityParser.get_base_unit(unit)
+                updates.append({"stock_id": stock_id, "amount": amount, "unit": unit,
+                                "base_amount": amount * factor, "base_unit": base_unit})
+            if updates:
+                print(f"Migrating: Backfilling numeric quantities for {len(updates)} stock items.")
+                conn.execute(text(
+                    "UPDATE kitchen_stock SET amount = :amount, unit = :unit, base_amount = :base_amount, "
+                    "base_unit = :base_unit WHERE stock_id = :stock_id"
+                ), updates)
+                conn.commit()
+    except Exception as e:
+        print(f"Stock quantity migration error: {e}")
+
+
+def check_and_migrate_stock_version(engine: Engine):
+    """Adds kitchen_stock.version (optimistic locking counter) to existing databases."""
+    try:
+        inspector = inspect(engine)
+        if not inspector.has_table("kitchen_stock"):
+            return
+
+        existing_columns = [col['name'] for col in inspector.get_columns('kitchen_stock')]
+        if "version" not in existing_columns:
+            print("Migrating: Adding column 'version' to 'kitchen_stock' table.")
+            with engine.connect() as conn:
+                conn.execute(text("ALTER TABLE kitchen_stock ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+                conn.commit()
+    except Exception as e:
+        print(f"Stock version migration error: {e}")
+
+
+def check_and_migrate_upload_hashes(engine: Engine):
+    """Adds uploads.content_hash / perceptual_hash (upload dedup cache) and their lookup index."""
+    try:
+        inspector = inspect(engine)
+        if not inspector.has_table("uploads"):
+            return
+
+        existing_columns = [col['name'] for col in inspector.get_columns('uploads')]
+        with engine.connect() as conn:
+            for col_name in ("content_hash", "perceptual_hash"):
+                if col_name not in existing_columns:
+                    print(f"Migrating: Adding column '{col_name}' to 'uploads' table.")
+                    conn.execute(text(f"ALTER TABLE uploads ADD COLUMN {col_name} VARCHAR"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_uploads_content_hash ON uploads (content_hash, upload_type)"))
+            conn.commit()
+    except Exception as e:
+        print(f"Upload hash migration error: {e}")
+
+
+def check_and_migrate_stock_ledger(engine: Engine):
+    """
+    Seeds the stock ledger (stock_events, created by create_all) with a "set" checkpoint
+    for every stock row that has no history yet, so existing stock can be replayed.
+    """
+    from sqlalchemy.orm import Session
+    from app.services.stock_ledger import checkpoint_missing
+    try:
+        inspector = inspect(engine)
+        if not inspector.has_table("kitchen_stock") or not inspector.has_table("stock_events"):
+            return
+        with Session(engine) as db:
+            seeded = checkpoint_missing(db)
+        if seeded:
+            print(f"Migrating: Seeded stock ledger with {seeded} checkpoints.")
+    except Exception as e:
+        print(f"Stock ledger migration error: {e}")
@@ -1,4 +1,4 @@
 from .base import Base
-from .kitchen import User, KitchenStock, Uploads
-from .chat import ChatMessage
+from .kitchen import User, KitchenStock, StockEvent, Uploads
+from .chat import ChatMessage, ChatSummary, ChatArchive
 from .meals import Meal
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey, Text
+from sqlalchemy import Column, String, DateTime, ForeignKey, Text, Index, Integer, LargeBinary
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .base import Base
@@ -17,3 +17,39 @@ class ChatMessage(Base):
     timestamp = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="chat_history")
+
+    __table_args__ = (
+        # "Latest messages for a user" and keyset pagination (timestamp, id): seek + ordered scan.
+        # Not covering (role/content are read from the table for the page's rows); content is
+        # unbounded Text, too large to carry in a btree index.
+        Index("ix_chat_messages_user_ts_id", "user_id", "timestamp", "id"),
+    )
+
+class ChatSummary(Base):
+    """Rolling summary of a user's older chat turns (kept out of the prompt verbatim)."""
+    __tablename__ = "chat_summaries"
+
+    user_id = Column(String, ForeignKey("users.user_id"), primary_key=True)
+    summary = Column(Text, nullable=False, default="")
+    summarized_until = Column(DateTime, nullable=True)  # timestamp of the newest message folded in
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ChatArchive(Base):
+    """
+    A block of old chat messages moved out of chat_messages by the retention job.
+    `payload` is zlib-compressed JSON: a list of {id, role, content, timestamp}, oldest first.
+    """
+    __tablename__ = "chat_archives"
+
+    id = Column(String, primary_key=True, default=generate_uuid)
+    user_id = Column(String, ForeignKey("users.user_id"), nullable=False)
+    period_start = Column(DateTime, nullable=False)  # oldest message in the block
+    period_end = Column(DateTime, nullable=False)    # newest message in the block
+    message_count = Column(Integer, nullable=False)
+    raw_bytes = Column(Integer, nullable=False)      # uncompressed JSON size
+    payload = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_chat_archives_user_period", "user_id", "period_end"),
+    )
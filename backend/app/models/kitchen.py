@@ -1,7 +1,7 @@
 import uuid
-from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Text, Date
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Text, Date, Float, Index
 from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, validates
 from datetime import datetime
 from .base import Base
 import uuid
@@ -57,7 +57,13 @@ class KitchenStock(Base):
     stock_id = Column(String, primary_key=True, default=generate_uuid)
     user_id = Column(String, ForeignKey("users.user_id"))
     item_name = Column(String, index=True)
+    search_name = Column(String)  # normalized + stemmed item_name, see services/name_search.py
     quantity = Column(String)  # "500g", "2 pcs"
+    # Parsed from quantity (kept in sync by set_amount / the validator below)
+    amount = Column(Float, nullable=True)       # 500.0
+    unit = Column(String, nullable=True)        # "g"
+    base_amount = Column(Float, nullable=True)  # amount in base_unit, for SQL sums across units
+    base_unit = Column(String, nullable=True)   # "g" | "ml" | "pcs" | ...
     category = Column(String)  # vegetable, spice, dairy
     expiry_date = Column(Date, nullable=True)
     source = Column(String)    # manual | bill | screenshot
@@ -66,9 +72,72 @@ class KitchenStock(Base):
     # Link to Kitchen instead of User directly
     kitchen_id = Column(String, ForeignKey("kitchens.id"), nullable=True) 
 
+    # Optimistic locking: every ORM UPDATE/DELETE checks and bumps this (StaleDataError on conflict)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
+
     user = relationship("User", back_populates="stocks")
     kitchen = relationship("Kitchen", back_populates="stocks")
 
+    @validates("item_name")
+    def _set_search_name(self, key, value):
+        from app.services.name_search import normalize_name
+        self.search_name = normalize_name(value)
+        return value
+
+    @validates("quantity")
+    def _parse_quantity(self, key, value):
+        from app.services.inventory import QuantityParser
+        # set_amount already filled the numbers for this exact string
+        if value and self.amount is not None and value == QuantityParser.format(self.amount, self.unit):
+            return value
+        amount, unit = QuantityParser.parse(value) if value else (None, None)
+        self._set_numbers(amount, unit)
+        return value
+
+    def _set_numbers(self, amount, unit):
+        from app.services.inventory import QuantityParser
+        self.amount, self.unit = amount, unit
+        if amount is None:
+            self.base_amount = self.base_unit = None
+        else:
+            self.base_unit, factor = QuantityParser.get_base_unit(unit)
+            self.base_amount = amount * factor
+
+    def set_amount(self, amount: float, unit: str):
+        """Update the numeric quantity and its display string together (no re-parsing)."""
+        from app.services.inventory import QuantityParser
+        self._set_numbers(amount, unit)
+        self.quantity = QuantityParser.format(amount, unit)
+
+class StockEvent(Base):
+    """
+    Append-only ledger of stock changes. kitchen_stock is the current snapshot; every
+    change to it also appends an event here, so a row can be replayed (latest "set"
+    checkpoint + the changes after it) and a meal's deductions can be given back.
+    """
+    __tablename__ = "stock_events"
+
+    # Integer key so events of one row replay in insertion order
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    stock_id = Column(String, nullable=False)  # no FK: events outlive rows that were used up
+    user_id = Column(String, nullable=True)
+    kitchen_id = Column(String, nullable=True)
+    item_name = Column(String)
+    category = Column(String)
+    event_type = Column(String, nullable=False)  # set | add | use | restore | remove
+    # set: the new amount (checkpoint); add/use/restore: signed change actually applied; both in `unit`
+    amount = Column(Float, nullable=True)
+    unit = Column(String, nullable=True)
+    quantity = Column(String, nullable=True)  # set: quantity string, for rows without a parsed amount
+    meal_id = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_stock_events_stock_id", "stock_id", "id"),
+        Index("ix_stock_events_meal_id", "meal_id"),
+    )
+
 class Uploads(Base):
     __tablename__ = "uploads"
 
@@ -77,6 +146,12 @@ class Uploads(Base):
     file_url = Column(Text)
     upload_type = Column(String) # bill | screenshot
     extracted_json = Column(Text) # Storing JSON as Text for SQLite compatibility
+    content_hash = Column(String, nullable=True) # sha256 of the file: repeat uploads reuse extracted_json
+    perceptual_hash = Column(String, nullable=True) # dHash (hex) for near-duplicates, if enabled
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index("ix_uploads_content_hash", "content_hash", "upload_type"),
+    )
+
     user = relationship("User", back_populates="uploads")
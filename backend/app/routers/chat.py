@@ -1,15 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Query
 from pydantic import BaseModel
+from typing import Optional
 from sqlalchemy.orm import Session
-from app.db import get_db
-from app.models.kitchen import KitchenStock, User
-from app.models.kitchen import KitchenStock, User
-from app.models.chat import ChatMessage
+from sqlalchemy import or_, and_
+from app.db import session_scope
+from app.models.kitchen import KitchenStock, User, UserProfile
+from app.models.chat import ChatMessage, ChatSummary, generate_uuid
 from app.models.meals import Meal
 from app.services.inventory import InventoryManager
+from app.services.cache import TTLCache
+from app.services.chat_context import build_context, summarize_messages, build_stock_context, name_terms
+from app.services.partial_json import PartialJSONParser
+from app.services.chat_retention import load_archived_messages
+from app.services.sse import sse_event, TokenCoalescer, StreamGuard, DISCONNECT_POLL_SECONDS, SSE_FLUSH_BYTES
+from app.services.job_store import job_store
 import os
+import re
 import json
-from openai import OpenAI
+import asyncio
+import hashlib
+import base64
+from datetime import datetime
+from openai import AsyncOpenAI
+from starlette.concurrency import run_in_threadpool
 from youtubesearchpython import VideosSearch
 
 router = APIRouter(
@@ -32,27 +45,26 @@ youtubesearchpython.core.requests.httpx.post = patched_post
 # --- Monkeypatch End ---
 
 # Initialize OpenAI client
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+# Async client so a streaming completion never blocks the event loop
+# (other chats, /health, uploads keep being served while we wait on tokens)
+client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 
 class ChatRequest(BaseModel):
     message: str
     user_id: str
-
-def get_stock_tool(user_id: str, db: Session):
-    """Fetch the user's kitchen stock."""
-    stocks = db.query(KitchenStock).filter(KitchenStock.user_id == user_id).all()
-    if not stocks:
-        return "Kitchen is empty."
-    
-    result = []
-    for stock in stocks:
-        item_str = f"- {stock.item_name}"
-        if stock.quantity:
-            item_str += f" ({stock.quantity})"
-        if stock.expiry_date:
-            item_str += f" [Expires: {stock.expiry_date}]"
-        result.append(item_str)
-    return "\n".join(result)
+    kitchen_id: Optional[str] = None  # active shared kitchen, if any
+
+def get_stock_tool(user_id: str, db: Session, kitchen_id: str = None, message: str = None, budget: int = None):
+    """
+    Fetch the kitchen stock (shared kitchen if kitchen_id is given, else the user's own).
+    Items are ranked by relevance to the message and expiry, and capped to a token budget.
+    """
+    query = db.query(KitchenStock)
+    if kitchen_id:
+        query = query.filter(KitchenStock.kitchen_id == kitchen_id)
+    else:
+        query = query.filter(KitchenStock.user_id == user_id)
+    return build_stock_context(query.all(), message, budget=budget)
 
 def log_meal_tool(user_id: str, meal_name: str, ingredients: list, db: Session, nutrition: dict = None, meal_type: str = "other", deduct_stock: bool = True):
     """Log a meal and optionally deduct stock."""
@@ -104,17 +116,96 @@ def get_recent_meals_tool(user_id: str, days: int, db: Session):
         
     return "\n".join(report)
 
+# Popular dishes get searched over and over, so results are cached by normalized query.
+# The Redis tier (shared with job_store) lets all workers share the same entries.
+youtube_cache = TTLCache(
+    "youtube",
+    max_entries=int(os.getenv("YOUTUBE_CACHE_MAX_ENTRIES", "1000")),
+    ttl_seconds=int(os.getenv("YOUTUBE_CACHE_TTL", "86400")),
+    redis_client=job_store.redis,
+)
+
+def normalize_search_query(query: str):
+    """'  Paneer Butter-Masala Recipe!' -> 'paneer butter masala recipe'"""
+    return " ".join(re.findall(r"\w+", (query or "").lower()))
+
+def fetch_youtube_results(query: str):
+    """Raw VideosSearch results for a query (cached, single-flight). Raises on failure."""
+    key = normalize_search_query(query)
+    return youtube_cache.get_or_compute(key, lambda: VideosSearch(key, limit=3).result()['result'])
+
+# --- Response cache (opt-in) ---
+# Near-identical standalone questions ("recipe for dal tadka") get the same answer.
+# Turns that lean on earlier messages (follow-ups, pronouns) are never cached, so the
+# conversation history doesn't enter the key: it is the normalized message + what stays
+# stable about the user's kitchen (stock item names, no quantities or expiry) and their
+# diet/allergies. Users with the same pantry and diet share entries.
+RESPONSE_CACHE_ENABLED = os.getenv("CHAT_RESPONSE_CACHE", "off") == "on"
+response_cache = TTLCache(
+    "chat_response",
+    max_entries=int(os.getenv("CHAT_RESPONSE_CACHE_MAX_ENTRIES", "500")),
+    ttl_seconds=int(os.getenv("CHAT_RESPONSE_CACHE_TTL", "21600")),
+    redis_client=job_store.redis,
+)
+
+# Filler that doesn't change the answer
+CACHE_STOPWORDS = {"give", "can", "you", "please", "show", "tell", "how", "what", "the", "for", "and",
+                   "want", "would", "like", "recipe", "make", "cook", "prepare", "some", "good", "nice"}
+# Words that point back at earlier turns or the user's own logs -> answer is personal
+PERSONAL_MARKERS = {"it", "that", "this", "those", "them", "again", "same", "another", "instead", "more",
+                    "previous", "earlier", "above", "last", "yesterday", "my", "made", "ate", "cooked",
+                    "bought", "had", "log", "add", "remove", "history"}
+# Follow-ups: replies and fragments that only make sense after the previous answer
+FOLLOWUP_MARKERS = {"they", "one", "ones", "else", "other", "also", "too", "then", "why", "yes", "yeah",
+                    "no", "nope", "ok", "okay", "sure", "thanks", "thank", "both", "either", "which"}
+FOLLOWUP_OPENERS = ("and ", "but ", "or ", "so ", "with ", "without ", "what about ", "how about ")
+
+def wants_response_cache(message: str):
+    """Standalone question worth a cache lookup: no follow-up, no reference to earlier turns or logs."""
+    if not RESPONSE_CACHE_ENABLED:
+        return False
+    text = " ".join(re.findall(r"[a-z']+", message.lower()))
+    words = set(text.split())
+    if words & (PERSONAL_MARKERS | FOLLOWUP_MARKERS) or text.startswith(FOLLOWUP_OPENERS):
+        return False
+    return bool(name_terms(message) - CACHE_STOPWORDS)
+
+def load_cache_context(user_id: str, db: Session, kitchen_id: str = None):
+    """Stock item names (no quantities/expiry) + diet and allergies, as one string."""
+    query = db.query(KitchenStock.item_name)
+    if kitchen_id:
+        query = query.filter(KitchenStock.kitchen_id == kitchen_id)
+    else:
+        query = query.filter(KitchenStock.user_id == user_id)
+    names = sorted({" ".join(name_terms(name)) for (name,) in query.all()} - {""})
+    profile = db.query(UserProfile.dietary_type, UserProfile.allergies).filter(UserProfile.user_id == user_id).first()
+    diet = f"{profile.dietary_type or ''}|{profile.allergies or ''}" if profile else "|"
+    return f"{','.join(names)}|{diet.lower()}"
+
+def response_cache_key(message: str, context: str = ""):
+    """Cache key for a standalone question, or None if the turn shouldn't be cached."""
+    if not wants_response_cache(message):
+        return None
+    terms = sorted(name_terms(message) - CACHE_STOPWORDS)
+    fingerprint = hashlib.sha1(context.encode()).hexdigest()[:16] if context.strip("|") else "-"
+    return f"{' '.join(terms)}|{fingerprint}"
+
+def replay_frames(content: str):
+    """Split a cached reply into token frames, same format as a live stream."""
+    step = max(SSE_FLUSH_BYTES, 64)
+    for i in range(0, len(content), step):
+        yield sse_event({'type': 'token', 'content': content[i:i + step]})
+
 def search_youtube_tool(query: str):
     """Search YouTube for videos."""
     try:
-        videos_search = VideosSearch(query, limit=3)
-        results = videos_search.result()
+        results = fetch_youtube_results(query)
     except Exception as e:
         print(f"YouTube Search Error: {e}")
         return "Could not search for videos at this time."
     
     video_list = []
-    for video in results['result']:
+    for video in results:
         title = video.get('title', 'Video')
         link = video.get('link', '#')
         thumbnails = video.get('thumbnails', [])
@@ -278,51 +369,294 @@ import json
 
 # ... (Previous imports remain, ensure StreamingResponse is imported)
 
-async def generate_chat_stream(request: ChatRequest, db: Session):
+# Max tool calls from a single model turn that run at the same time
+MAX_PARALLEL_TOOLS = int(os.getenv("CHAT_MAX_PARALLEL_TOOLS", "4"))
+
+# Status lines streamed while a tool is running: (started, finished)
+TOOL_STATUS = {
+    "get_kitchen_stock": ("Checking pantry stock...", "Pantry stock checked."),
+    "search_youtube_videos": ("Searching YouTube...", "YouTube search done."),
+    "get_recent_meals": ("Fetching meal history...", "Meal history loaded."),
+}
+
+# Tools that only hand a draft to the client for confirmation
+TOOL_ACTIONS = {
+    "log_meal": "DRAFT_MEAL",
+    "add_to_stock": "DRAFT_STOCK",
+}
+
+def draft_progress(payload):
+    """
+    Coarse progress signature for a partial draft: which fields are present and how many
+    ingredients are complete. A new action_partial is only sent when this changes.
+    """
+    if not isinstance(payload, dict) or not payload:
+        return None
+    ingredients = payload.get("ingredients")
+    done = sum(1 for i in ingredients if isinstance(i, dict) and "item" in i and "qty" in i) if isinstance(ingredients, list) else 0
+    return (tuple(payload.keys()), done)
+
+async def execute_tool(function_name: str, args: dict, request: ChatRequest):
+    """Run a single tool call and return its result for the model."""
+    user_id = request.user_id
+    if function_name == "get_kitchen_stock":
+        return await run_with_session(get_stock_tool, user_id, kitchen_id=request.kitchen_id, message=request.message)
+
+    elif function_name == "search_youtube_videos":
+        return await run_in_threadpool(search_youtube_tool, args.get("query"))
+
+    elif function_name in TOOL_ACTIONS:
+        return "Draft created. Redirecting user to review..."
+
+    elif function_name == "get_recent_meals":
+        return await run_with_session(get_recent_meals_tool, user_id, args.get("days", 7))
+
+    return "Error executing tool"
+
+SYSTEM_PROMPT = "You are a helpful Kitchen Assistant. You help users decide what to cook based on their available stock. \n\nBEHAVIOR RULES:\n1. When asked for a recipe, ALWAYS provide the COMPLETE text recipe first. Include a full list of Ingredients and detailed step-by-step Instructions.\n2. **RECIPE CALL-TO-ACTION**: After providing ANY recipe, you MUST explicitly suggest logging it. End your response with a clear instruction like: **\"Type 'I made {Recipe Name}' to save this meal and update your stock!\"**\n3. Do NOT search for a video unless the user explicitly asks for one (e.g., 'show me a video', 'with video').\n4. If the user did NOT ask for a video, end your response with this EXACT suggested action format: `<<VIDEO_SUGGESTION: Show me a video for {Recipe Name}>>`\n5. If the user DOES ask for a video, call the `search_youtube_videos` tool and display the results including thumbnails.\n6. Need Video? Never say 'I will find a video' without actually calling the tool.\n\n7. MEAL LOGGING & TRACKING:\n   - **MULTI-MEAL LOGGING**: If the user lists multiple meals (e.g. 'Overview: Breakfast eggs, Lunch pasta'), you MUST call `log_meal` multiple times — once for each distinct meal.\n   - **CONTEXT AWARENESS**: If the user confirms a meal (e.g., 'I made it', 'I cooked the pasta'), use the ingredients from the *previously suggested recipe* in the conversation history to populate `log_meal`. Do not ask for ingredients again if they are already in the chat context.\n   - **AMBIGUITY**: If the user says they ate something but didn't say who made it, **YOU MUST ASK**: 'Did you cook this at home using your kitchen stock, or did you eat out?'\n   - **EATING OUT**: If the user says they 'ate out', 'ordered in', 'bought it', or 'restaurant', call `log_meal` with `deduct_stock=False`. Estimate nutrition but do NOT deduct ingredients.\n   - **HOME COOKED**: If the user says they 'cooked it', 'made it', or 'used my ingredients', call `log_meal` with `deduct_stock=True`.\n   - **CRITICAL**: For ALL meals (home or out), you MUST estimate nutrition (calories, protein, carbs, fat) and `meal_type`.\n   - **FEEDBACK**: The `log_meal` tool will start a **Action**, redirecting the user to a confirmation page. Inform the user: \"I've pre-filled the log for you. You can review and save it on the next screen.\"\n\n8. ADDING STOCK:\n   - If the user says 'add 2kg rice', 'I bought milk', etc., use the `add_to_stock` tool.\n   - Confirm the addition to the user with the result returned by the tool.\n\n9. MEAL HISTORY:\n   - If the user asks 'what did I eat last week?' or 'show my nutrition stats', use `get_recent_meals`.\n   - Summarize the returned list for the user."
+
+# Max messages (newer than the rolling summary) considered for the prompt window
+HISTORY_SCAN_LIMIT = int(os.getenv("CHAT_HISTORY_SCAN_LIMIT", "50"))
+
+# Prefetch a compact stock snapshot + goals into the first request:
+# "auto" (only for cooking/pantry questions), "always" or "off"
+PREFETCH_MODE = os.getenv("CHAT_PREFETCH_CONTEXT", "auto")
+PREFETCH_STOCK_TOKENS = int(os.getenv("CHAT_PREFETCH_STOCK_TOKENS", "300"))
+PREFETCH_KEYWORDS = ("cook", "make", "recipe", "dinner", "lunch", "breakfast", "snack", "meal",
+                     "eat", "stock", "pantry", "fridge", "ingredient", "have", "left", "expir", "protein", "calorie")
+
+def query_chat_messages(db: Session, user_id: str, before: tuple = None, after=None, exclude_id: str = None, limit: int = 20):
+    """
+    Newest-first messages for a user. The (user_id, timestamp, id) index finds the start
+    of the page and gives the order; only the `limit` rows returned are read from the table.
+    before: keyset cursor (timestamp, id) - only messages strictly older are returned.
+    after: only messages newer than this timestamp.
+    """
+    query = db.query(ChatMessage).filter(ChatMessage.user_id == user_id)
+    if before:
+        before_ts, before_id = before
+        # The plain range bound lets the planner seek in the index; the OR alone is only a filter
+        query = query.filter(ChatMessage.timestamp <= before_ts, or_(
+            ChatMessage.timestamp < before_ts,
+            and_(ChatMessage.timestamp == before_ts, ChatMessage.id < before_id),
+        ))
+    if after:
+        query = query.filter(ChatMessage.timestamp > after)
+    if exclude_id:
+        query = query.filter(ChatMessage.id != exclude_id)
+    return query.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()).limit(limit).all()
+
+def encode_history_cursor(timestamp: datetime, message_id: str):
+    raw = f"{timestamp.isoformat()}|{message_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_history_cursor(cursor: str):
     try:
-        # Ensure user exists (Same logic as before)
-        user = db.query(User).filter(User.user_id == request.user_id).first()
-        if not user:
-            user = User(user_id=request.user_id, name="Guest User")
-            db.add(user)
-            db.commit()
-
-        # 1. Fetch Chat History
-        history = db.query(ChatMessage).filter(ChatMessage.user_id == request.user_id).order_by(ChatMessage.timestamp.desc()).limit(10).all()
-        history.reverse()
-
-        # 2. Construct Messages
-        conversation_context = [
-             {"role": "system", "content": "You are a helpful Kitchen Assistant. You help users decide what to cook based on their available stock. \n\nBEHAVIOR RULES:\n1. When asked for a recipe, ALWAYS provide the COMPLETE text recipe first. Include a full list of Ingredients and detailed step-by-step Instructions.\n2. **RECIPE CALL-TO-ACTION**: After providing ANY recipe, you MUST explicitly suggest logging it. End your response with a clear instruction like: **\"Type 'I made {Recipe Name}' to save this meal and update your stock!\"**\n3. Do NOT search for a video unless the user explicitly asks for one (e.g., 'show me a video', 'with video').\n4. If the user did NOT ask for a video, end your response with this EXACT suggested action format: `<<VIDEO_SUGGESTION: Show me a video for {Recipe Name}>>`\n5. If the user DOES ask for a video, call the `search_youtube_videos` tool and display the results including thumbnails.\n6. Need Video? Never say 'I will find a video' without actually calling the tool.\n\n7. MEAL LOGGING & TRACKING:\n   - **MULTI-MEAL LOGGING**: If the user lists multiple meals (e.g. 'Overview: Breakfast eggs, Lunch pasta'), you MUST call `log_meal` multiple times — once for each distinct meal.\n   - **CONTEXT AWARENESS**: If the user confirms a meal (e.g., 'I made it', 'I cooked the pasta'), use the ingredients from the *previously suggested recipe* in the conversation history to populate `log_meal`. Do not ask for ingredients again if they are already in the chat context.\n   - **AMBIGUITY**: If the user says they ate something but didn't say who made it, **YOU MUST ASK**: 'Did you cook this at home using your kitchen stock, or did you eat out?'\n   - **EATING OUT**: If the user says they 'ate out', 'ordered in', 'bought it', or 'restaurant', call `log_meal` with `deduct_stock=False`. Estimate nutrition but do NOT deduct ingredients.\n   - **HOME COOKED**: If the user says they 'cooked it', 'made it', or 'used my ingredients', call `log_meal` with `deduct_stock=True`.\n   - **CRITICAL**: For ALL meals (home or out), you MUST estimate nutrition (calories, protein, carbs, fat) and `meal_type`.\n   - **FEEDBACK**: The `log_meal` tool will start a **Action**, redirecting the user to a confirmation page. Inform the user: \"I've pre-filled the log for you. You can review and save it on the next screen.\"\n\n8. ADDING STOCK:\n   - If the user says 'add 2kg rice', 'I bought milk', etc., use the `add_to_stock` tool.\n   - Confirm the addition to the user with the result returned by the tool.\n\n9. MEAL HISTORY:\n   - If the user asks 'what did I eat last week?' or 'show my nutrition stats', use `get_recent_meals`.\n   - Summarize the returned list for the user."},
-        ]
-        for msg in history:
-            conversation_context.append({"role": msg.role, "content": msg.content})
-        
-        conversation_context.append({"role": "user", "content": request.message})
+        timestamp, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(timestamp), message_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def ensure_user_and_save_message(user_id: str, message_id: str, content: str, db: Session):
+    """Create the user on first contact and persist their new message."""
+    user = db.query(User).filter(User.user_id == user_id).first()
+    if not user:
+        user = User(user_id=user_id, name="Guest User")
+        db.add(user)
+        db.flush()
+    db.add(ChatMessage(id=message_id, user_id=user_id, role="user", content=content))
+    db.commit()
+
+def load_chat_history(user_id: str, db: Session, exclude_id: str = None):
+    """
+    Return (summary, summarized_until, history).
+    history holds the messages not yet folded into the summary (oldest first), as
+    plain dicts so the result stays usable after the session is closed.
+    exclude_id skips the current turn's user message if it was already saved.
+    """
+    summary_row = db.query(ChatSummary).filter(ChatSummary.user_id == user_id).first()
+    summary = summary_row.summary if summary_row else ""
+    summarized_until = summary_row.summarized_until if summary_row else None
+
+    history = query_chat_messages(db, user_id, after=summarized_until, exclude_id=exclude_id, limit=HISTORY_SCAN_LIMIT)
+    history.reverse()
+    return summary, summarized_until, [
+        {"role": msg.role, "content": msg.content, "timestamp": msg.timestamp} for msg in history
+    ]
+
+def wants_kitchen_snapshot(message: str):
+    if PREFETCH_MODE == "always":
+        return True
+    if PREFETCH_MODE != "auto":
+        return False
+    text = message.lower()
+    return any(keyword in text for keyword in PREFETCH_KEYWORDS)
+
+def load_kitchen_snapshot(user_id: str, db: Session, kitchen_id: str = None, message: str = None):
+    """Compact stock + nutrition goals, sent with the first request to save a tool round."""
+    stock_text = get_stock_tool(user_id, db, kitchen_id=kitchen_id, message=message, budget=PREFETCH_STOCK_TOKENS)
+    lines = [
+        "KITCHEN SNAPSHOT (fetched just now, most relevant items only; call `get_kitchen_stock` only if you need items not listed):",
+        stock_text,
+    ]
+    profile = db.query(UserProfile).filter(UserProfile.user_id == user_id).first()
+    if profile:
+        lines.append(
+            f"USER GOALS: {profile.daily_calories or 2000} kcal/day, protein {profile.daily_protein or 150}g, "
+            f"carbs {profile.daily_carbs or 250}g, fat {profile.daily_fat or 70}g. Diet: {profile.dietary_type or 'Standard'}."
+        )
+        if profile.allergies:
+            lines.append(f"ALLERGIES: {profile.allergies}")
+    return "\n".join(lines)
+
+def save_chat_summary(user_id: str, summary: str, summarized_until, previous_until, db: Session):
+    """
+    Store the updated rolling summary. Skipped if another turn already moved the
+    summary forward since we read it (previous_until no longer matches).
+    """
+    row = db.query(ChatSummary).filter(ChatSummary.user_id == user_id).first()
+    if row is None:
+        row = ChatSummary(user_id=user_id)
+        db.add(row)
+    elif row.summarized_until != previous_until:
+        return False
+    row.summary = summary
+    row.summarized_until = summarized_until
+    db.commit()
+    return True
+
+def save_chat_message(user_id: str, role: str, content: str, db: Session):
+    """Persist a single chat message."""
+    msg = ChatMessage(user_id=user_id, role=role, content=content)
+    db.add(msg)
+    db.commit()
+    return msg
+
+async def run_with_session(fn, *args, **kwargs):
+    """
+    Run a blocking DB helper in the threadpool with its own short-lived session.
+    The connection goes back to the pool as soon as the helper returns, so an
+    in-flight LLM stream never pins one.
+    """
+    def _call():
+        with session_scope() as db:
+            return fn(*args, db=db, **kwargs)
+    return await run_in_threadpool(_call)
+
+# Keep references to fire-and-forget tasks so they aren't garbage collected mid-run
+_background_tasks = set()
+
+async def compact_chat_history(user_id: str, summary: str, previous_until, overflow: list):
+    """Fold messages that fell out of the prompt window into the user's rolling summary."""
+    try:
+        new_summary = await summarize_messages(client, summary, overflow)
+        await run_with_session(save_chat_summary, user_id, new_summary, overflow[-1]["timestamp"], previous_until)
+        print(f"[Chat] Folded {len(overflow)} messages into summary for {user_id}")
+    except Exception as e:
+        print(f"Summary Error: {e}")
+
+async def finish_reply(user_id: str, content: str, summary: str, summarized_until, overflow: list):
+    """Persist the assistant reply and compact older turns into the rolling summary."""
+    await run_with_session(save_chat_message, user_id, "assistant", content)
+
+    # Compaction runs in the background so it doesn't hold up the response
+    if overflow:
+        task = asyncio.create_task(compact_chat_history(user_id, summary, summarized_until, overflow))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
 
-        # Save User Message immediately
-        user_msg_db = ChatMessage(user_id=request.user_id, role="user", content=request.message)
-        db.add(user_msg_db)
-        db.commit()
+async def close_stream(stream):
+    """Close an upstream OpenAI stream so generation (and billing) stops."""
+    try:
+        await stream.close()
+    except Exception as e:
+        print(f"Stream Close Error: {e}")
+
+async def save_partial_reply(user_id: str, content: str, stream=None):
+    """Used when the response was cut short: stop upstream and keep what we have."""
+    if stream is not None:
+        await close_stream(stream)
+    if content:
+        await run_with_session(save_chat_message, user_id, "assistant", content)
+
+async def generate_chat_stream(request: ChatRequest, guard: StreamGuard = None):
+    guard = guard or StreamGuard()
+    full_content = ""
+    open_stream = None     # upstream stream currently being read
+    reply_saved = False
+    try:
+        # Setup queries run concurrently, each with its own short session:
+        # save the user message (creating the user if needed), load history, and
+        # optionally prefetch a stock/goals snapshot so the first round can answer directly.
+        # DB calls are blocking, so they run in the threadpool instead of on the event loop
+        message_id = generate_uuid()
+        setup = [
+            run_with_session(ensure_user_and_save_message, request.user_id, message_id, request.message),
+            run_with_session(load_chat_history, request.user_id, exclude_id=message_id),
+        ]
+        use_cache = wants_response_cache(request.message)
+        if use_cache:
+            setup.append(run_with_session(load_cache_context, request.user_id, kitchen_id=request.kitchen_id))
+        if wants_kitchen_snapshot(request.message):
+            setup.append(run_with_session(load_kitchen_snapshot, request.user_id, kitchen_id=request.kitchen_id, message=request.message))
+        results = await asyncio.gather(*setup)
+        summary, summarized_until, history = results[1]
+        cache_context = results[2] if use_cache else ""
+        extra_system = results[3:] if use_cache else results[2:]
+
+        # 2. Construct Messages (token-budgeted: summary + newest turns that fit)
+        conversation_context, overflow, context_stats = build_context(SYSTEM_PROMPT, summary, history, request.message, extra_system=extra_system)
+        print(f"[Chat] Prompt for {request.user_id}: ~{context_stats['prompt_tokens']}/{context_stats['budget']} tokens "
+              f"(summary {context_stats['summary_tokens']}, {context_stats['history_messages']} history msgs, "
+              f"{context_stats['overflow_messages']} to fold, snapshot {'yes' if extra_system else 'no'})")
 
         # Tool Choice Logic
         tool_choice = "auto"
         if "video" in request.message.lower() or "youtube" in request.message.lower():
             tool_choice = "required"
 
+        # --- RESPONSE CACHE ---
+        cache_key = None
+        if use_cache and tool_choice == "auto":
+            cache_key = response_cache_key(request.message, cache_context)
+        # Redis round-trips: keep them off the event loop
+        cached_reply = await run_in_threadpool(response_cache.get, cache_key) if cache_key else None
+        if cached_reply is not None:
+            print(f"[Chat] Response cache hit for {request.user_id}: '{cache_key}'")
+            full_content = cached_reply
+            for frame in replay_frames(cached_reply):
+                yield frame
+            reply_saved = True
+            await finish_reply(request.user_id, cached_reply, summary, summarized_until, overflow)
+            yield sse_event({'type': 'done'})
+            return
+
         # --- STREAM LOGIC ---
-        stream = client.chat.completions.create(
+        # Opening the stream and each chunk are bounded by the guard: a stalled upstream
+        # still ends at the deadline / when the client leaves (stream is None if it never opened)
+        stream = await guard.wait(client.chat.completions.create(
             model="gpt-4o",
             messages=conversation_context,
             tools=TOOLS,
             tool_choice=tool_choice,
-            stream=True
-        )
+            stream=True,
+            stream_options={"include_usage": True}
+        ))
+        open_stream = stream
 
-        full_content = ""
         tool_calls_buffer = {} # {index: {id, name, args_str}}
-
-        for chunk in stream:
+        tokens = TokenCoalescer() # merges tiny deltas into fewer SSE frames
+        draft_parsers = {}        # {index: PartialJSONParser} for log_meal / add_to_stock calls
+        draft_progress_sent = {}  # {index: last progress signature sent as action_partial}
+        drafts_sent = set()       # indexes whose final DRAFT_* action already went out
+
+        async for chunk in guard.iterate(stream):
+            if await guard.should_stop():
+                break
+            if chunk.usage:
+                print(f"[Chat] First round usage for {request.user_id}: prompt={chunk.usage.prompt_tokens} completion={chunk.usage.completion_tokens}")
+            if not chunk.choices:
+                continue
             delta = chunk.choices[0].delta
 
             # 1. Handle Tool Calls (Accumulation)
@@ -331,18 +665,51 @@ async def generate_chat_stream(request: ChatRequest, db: Session):
                     idx = tc.index
                     if idx not in tool_calls_buffer:
                         tool_calls_buffer[idx] = {"id": tc.id, "name": tc.function.name, "args": ""}
+                        if tc.function.name in TOOL_ACTIONS:
+                            draft_parsers[idx] = PartialJSONParser()
                     if tc.function.arguments:
                         tool_calls_buffer[idx]["args"] += tc.function.arguments
 
+                        # Drafts: parse arguments as they stream so the client can show them early
+                        parser = draft_parsers.get(idx)
+                        if parser and idx not in drafts_sent:
+                            parser.feed(tc.function.arguments)
+                            action = TOOL_ACTIONS[tool_calls_buffer[idx]["name"]]
+                            if parser.complete and parser.result() is not None:
+                                drafts_sent.add(idx)
+                                event = sse_event({'type': 'action', 'action': action, 'index': idx, 'payload': parser.result()})
+                            else:
+                                payload = parser.snapshot()
+                                progress = draft_progress(payload)
+                                if not progress or progress == draft_progress_sent.get(idx):
+                                    continue
+                                draft_progress_sent[idx] = progress
+                                event = sse_event({'type': 'action_partial', 'action': action, 'index': idx, 'payload': payload})
+                            frame = tokens.flush()
+                            if frame:
+                                yield frame
+                            yield event
+
             # 2. Handle Text Content
             if delta.content:
                 full_content += delta.content
-                yield f"data: {json.dumps({'type': 'token', 'content': delta.content})}\n\n"
+                frame = tokens.push(delta.content)
+                if frame:
+                    yield frame
+
+        if guard.reason and stream is not None:
+            await close_stream(stream)
+        open_stream = None
+
+        frame = tokens.flush()
+        if frame:
+            yield frame
 
         # --- PROCESS TOOLS IF ANY ---
-        if tool_calls_buffer:
+        # (skipped entirely if the client left or we ran out of time)
+        if tool_calls_buffer and not guard.reason:
             # Yield status
-            yield f"data: {json.dumps({'type': 'status', 'content': 'Checking kitchen assistant...'})}\n\n"
+            yield sse_event({'type': 'status', 'content': 'Checking kitchen assistant...'})
             
             # Need to append the "assistant" message with tool_calls to context
             # Reconstruct the tool_calls object for the context
@@ -363,81 +730,166 @@ async def generate_chat_stream(request: ChatRequest, db: Session):
                 "tool_calls": openai_tool_calls_obj
             })
 
-            # Execute Tools
-            for idx, tc_data in tool_calls_buffer.items():
-                function_name = tc_data["name"]
-                args_str = tc_data["args"]
-                tool_call_id = tc_data["id"]
-
+            # Parse all tool calls (in call order)
+            pending_calls = []
+            for idx, tc_data in sorted(tool_calls_buffer.items()):
                 try:
-                    args = json.loads(args_str)
+                    args = json.loads(tc_data["args"])
                 except:
-                    args = {}
-                
-                function_response = "Error executing tool"
+                    # Truncated arguments: keep whatever fields did arrive
+                    args = draft_parsers[idx].snapshot() if idx in draft_parsers else None
+                    args = args if isinstance(args, dict) else {}
+                pending_calls.append((tc_data["id"], tc_data["name"], args))
+
+            # Announce every call up front; drafts don't need to wait for anything
+            for idx, (tool_call_id, function_name, args) in zip(sorted(tool_calls_buffer), pending_calls):
+                if function_name in TOOL_ACTIONS:
+                    if idx in drafts_sent:
+                        continue
+                    yield sse_event({'type': 'action', 'action': TOOL_ACTIONS[function_name], 'index': idx, 'payload': args})
+                elif function_name in TOOL_STATUS:
+                    yield sse_event({'type': 'status', 'content': TOOL_STATUS[function_name][0]})
+
+            # Execute Tools concurrently (bounded), reporting each one as it finishes
+            semaphore = asyncio.Semaphore(MAX_PARALLEL_TOOLS)
+
+            async def run_tool_call(position, function_name, args):
+                async with semaphore:
+                    try:
+                        return position, await execute_tool(function_name, args, request)
+                    except Exception as e:
+                        print(f"Tool Error ({function_name}): {e}")
+                        return position, "Error executing tool"
+
+            tasks = [
+                asyncio.create_task(run_tool_call(position, function_name, args))
+                for position, (_, function_name, args) in enumerate(pending_calls)
+            ]
+            tool_results = [None] * len(pending_calls)
+            try:
+                pending = set(tasks)
+                while pending:
+                    # Wake up regularly so a disconnect/deadline is noticed mid-tool
+                    done, pending = await asyncio.wait(pending, timeout=DISCONNECT_POLL_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+                    for finished in done:
+                        position, function_response = finished.result()
+                        tool_results[position] = function_response
+                        function_name = pending_calls[position][1]
+                        if function_name in TOOL_STATUS:
+                            yield sse_event({'type': 'status', 'content': TOOL_STATUS[function_name][1]})
+                    if pending and await guard.should_stop():
+                        break
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+            if not guard.reason:
+                # Append tool results to context in call order
+                for (tool_call_id, function_name, _), function_response in zip(pending_calls, tool_results):
+                    conversation_context.append({
+                        "tool_call_id": tool_call_id,
+                        "role": "tool",
+                        "name": function_name,
+                        "content": str(function_response)
+                    })
+
+                # Stream the second response
+                second_stream = await guard.wait(client.chat.completions.create(
+                    model="gpt-4o",
+                    messages=conversation_context,
+                    stream=True
+                ))
+                open_stream = second_stream
                 
-                # Execute specific tool logic
-                if function_name == "get_kitchen_stock":
-                     yield f"data: {json.dumps({'type': 'status', 'content': 'Checking pantry stock...'})}\n\n"
-                     function_response = get_stock_tool(request.user_id, db)
-                     
-                elif function_name == "search_youtube_videos":
-                     yield f"data: {json.dumps({'type': 'status', 'content': 'Searching YouTube...'})}\n\n"
-                     function_response = search_youtube_tool(args.get("query"))
-
-                elif function_name == "log_meal":
-                     yield f"data: {json.dumps({'type': 'action', 'action': 'DRAFT_MEAL', 'payload': args})}\n\n"
-                     function_response = "Draft created. Redirecting user to review..."
-                
-                elif function_name == "add_to_stock":
-                     yield f"data: {json.dumps({'type': 'action', 'action': 'DRAFT_STOCK', 'payload': args})}\n\n"
-                     function_response = "Draft created. Redirecting user to review..."
-
-                elif function_name == "get_recent_meals":
-                     yield f"data: {json.dumps({'type': 'status', 'content': 'Fetching meal history...'})}\n\n"
-                     function_response = get_recent_meals_tool(request.user_id, args.get("days", 7), db)
-
-                # Append tool result to context
-                conversation_context.append({
-                    "tool_call_id": tool_call_id,
-                    "role": "tool",
-                    "name": function_name,
-                    "content": str(function_response)
-                })
-
-            # Stream the second response
-            second_stream = client.chat.completions.create(
-                model="gpt-4o",
-                messages=conversation_context,
-                stream=True
-            )
-            
-            for chunk in second_stream:
-                if chunk.choices[0].delta.content:
-                    content_chunk = chunk.choices[0].delta.content
-                    full_content += content_chunk
-                    yield f"data: {json.dumps({'type': 'token', 'content': content_chunk})}\n\n"
+                async for chunk in guard.iterate(second_stream):
+                    if await guard.should_stop():
+                        break
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        content_chunk = chunk.choices[0].delta.content
+                        full_content += content_chunk
+                        frame = tokens.push(content_chunk)
+                        if frame:
+                            yield frame
+
+                if guard.reason and second_stream is not None:
+                    await close_stream(second_stream)
+                open_stream = None
+
+                frame = tokens.flush()
+                if frame:
+                    yield frame
 
         # --- FINALIZATION ---
+        if guard.reason:
+            # Cut short: keep whatever the assistant said so far, skip the extras
+            print(f"[Chat] Stopped early for {request.user_id} ({guard.reason}); saving {len(full_content)} chars")
+            reply_saved = True
+            await save_partial_reply(request.user_id, full_content)
+            if guard.reason == "deadline":
+                yield sse_event({'type': 'status', 'content': 'Response cut short (time limit reached).'})
+                yield sse_event({'type': 'done'})
+            return
+
         # Post-process for video suggestions (Legacy logic)
         final_content = full_content
         if "Would you like to see a YouTube video" in final_content and "<<VIDEO_SUGGESTION:" not in final_content:
              suffix = "\n\n<<VIDEO_SUGGESTION: Show me a video for this recipe>>"
              final_content += suffix
-             yield f"data: {json.dumps({'type': 'token', 'content': suffix})}\n\n"
+             yield sse_event({'type': 'token', 'content': suffix})
 
         # Save Assistant Message
-        assistant_msg_db = ChatMessage(user_id=request.user_id, role="assistant", content=final_content)
-        db.add(assistant_msg_db)
-        db.commit()
+        reply_saved = True
+        await finish_reply(request.user_id, final_content, summary, summarized_until, overflow)
+
+        # Only plain answers are reusable: tool turns depend on live data / trigger actions
+        if cache_key and not tool_calls_buffer and final_content:
+            await run_in_threadpool(response_cache.set, cache_key, final_content)
         
         # Done
-        yield f"data: {json.dumps({'type': 'done'})}\n\n"
+        yield sse_event({'type': 'done'})
 
     except Exception as e:
         print(f"Stream Error: {e}")
-        yield f"data: {json.dumps({'type': 'error', 'content': str(e)})}\n\n"
+        yield sse_event({'type': 'error', 'content': str(e)})
+    finally:
+        # The server cancelled/closed us (client went away mid-yield). We can't await here,
+        # so stopping upstream and saving the partial reply runs as a background task.
+        if not reply_saved and (full_content or open_stream is not None):
+            print(f"[Chat] Stream closed early for {request.user_id}; saving {len(full_content)} chars")
+            task = asyncio.get_running_loop().create_task(save_partial_reply(request.user_id, full_content, open_stream))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+
+@router.get("/history")
+def get_chat_history(user_id: str = Query(...), limit: int = Query(20, ge=1, le=100), cursor: Optional[str] = None):
+    """
+    Chat history, newest first, with keyset pagination: GET /chat/history?user_id=...&cursor=...
+    Pass the returned next_cursor to get the next (older) page; it's null on the last page.
+    Once the hot table is exhausted, paging continues into archived messages.
+    """
+    before = decode_history_cursor(cursor) if cursor else None
+    with session_scope() as db:
+        rows = query_chat_messages(db, user_id, before=before, limit=limit + 1)
+        messages = [
+            {"id": m.id, "role": m.role, "content": m.content, "timestamp": m.timestamp, "archived": False}
+            for m in rows
+        ]
+        if len(messages) <= limit:
+            archive_before = (messages[-1]["timestamp"], messages[-1]["id"]) if messages else before
+            for m in load_archived_messages(db, user_id, before=archive_before, limit=limit + 1 - len(messages)):
+                messages.append({**m, "archived": True})
+
+    page = messages[:limit]
+    next_cursor = encode_history_cursor(page[-1]["timestamp"], page[-1]["id"]) if len(messages) > limit else None
+    return {"messages": page, "next_cursor": next_cursor}
+
+@router.get("/cache/stats")
+def get_cache_stats():
+    """Hit/miss counters for the chat caches (for sizing TTL / max entries)."""
+    return {"youtube": youtube_cache.stats(), "responses": response_cache.stats()}
 
 @router.post("/")
-async def chat_with_chef(request: ChatRequest, db: Session = Depends(get_db)):
-    return StreamingResponse(generate_chat_stream(request, db), media_type="text/event-stream")
+async def chat_with_chef(request: ChatRequest, http_request: Request):
+    # No request-scoped session here: the stream opens short sessions as needed
+    guard = StreamGuard(is_disconnected=http_request.is_disconnected)
+    return StreamingResponse(generate_chat_stream(request, guard), media_type="text/event-stream")
@@ -127,25 +127,27 @@ def get_meal_history(user_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Server Error: {str(e)}")
 
 @router.delete("/{meal_id}")
-def delete_meal(meal_id: str, db: Session = Depends(get_db)):
+def delete_meal(meal_id: str, restore_stock: bool = True, db: Session = Depends(get_db)):
     """
     Delete a meal log.
-    Note: This currently does NOT restore the stock deducted.
+    The stock it deducted is given back (pass restore_stock=false to keep stock as is);
+    items removed from stock since are not brought back.
     """
     from app.models.meals import Meal
     meal = db.query(Meal).filter(Meal.id == meal_id).first()
     if not meal:
         raise HTTPException(status_code=404, detail="Meal not found")
     
-    db.delete(meal)
-    db.commit()
-    return {"message": "Meal deleted successfully"}
+    report = InventoryManager(db).delete_meal(meal, restore_stock=restore_stock)
+    return {"message": "Meal deleted successfully", "restore_report": report}
 
 @router.put("/{meal_id}")
 def update_meal(meal_id: str, request: MealLogRequest, db: Session = Depends(get_db)):
     """
     Update an existing meal log.
-    Does NOT trigger stock re-calculation.
+    If the ingredients (or home/outside) changed, the old deductions are given back
+    and the new ingredients are deducted. Meals logged before stock history was kept
+    aren't re-deducted when edited.
     """
     from app.models.meals import Meal
     meal = db.query(Meal).filter(Meal.id == meal_id).first()
@@ -153,15 +155,16 @@ def update_meal(meal_id: str, request: MealLogRequest, db: Session = Depends(get
         raise HTTPException(status_code=404, detail="Meal not found")
     
     # Update fields
-    meal.name = request.name
-    meal.meal_type = request.meal_type
-    meal.meal_source = request.meal_source
-    meal.ingredients_used = request.ingredients_used
-    meal.calories = request.calories
-    meal.protein_g = request.protein_g
-    meal.carbs_g = request.carbs_g
-    meal.fat_g = request.fat_g
-    
-    db.commit()
+    fields = {
+        "name": request.name,
+        "meal_type": request.meal_type,
+        "source": request.meal_source,
+        "ingredients_used": request.ingredients_used,
+        "calories": request.calories,
+        "protein_g": request.protein_g,
+        "carbs_g": request.carbs_g,
+        "fat_g": request.fat_g,
+    }
+    meal, report = InventoryManager(db).update_meal(meal, fields, deduct_stock=(request.meal_source == "home"))
     db.refresh(meal)
-    return {"message": "Meal updated successfully", "meal": meal}
+    return {"message": "Meal updated successfully", "meal": meal, "deduction_report": report}
@@ -1,6 +1,7 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy import or_, func
 from ..db import get_db
 from ..models.kitchen import KitchenStock, User
 from pydantic import BaseModel
@@ -20,11 +21,25 @@ class StockCreate(BaseModel):
 
 class StockResponse(StockCreate):
     stock_id: str
+    amount: Optional[float] = None
+    unit: Optional[str] = None
+    base_amount: Optional[float] = None
+    base_unit: Optional[str] = None
     
     class Config:
         orm_mode = True
 
 from app.services.inventory import InventoryManager
+from app.services.name_search import find_stock_match
+from app.services.stock_ledger import record_event
+
+def commit_stock_edit(db: Session):
+    """Commit a manual edit; if a meal/stock update changed the row meanwhile, ask the client to reload."""
+    try:
+        db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="This item was changed by someone else. Please refresh and try again.")
 
 @router.post("/", response_model=StockResponse)
 def add_item(item: StockCreate, db: Session = Depends(get_db)):
@@ -40,17 +55,11 @@ def add_item(item: StockCreate, db: Session = Depends(get_db)):
     
     # Manual Add/Update logic here to support kitchen_id without refactoring InventoryManager instantly
     
-    # 1. Check existing item
-    existing_query = db.query(KitchenStock).filter(KitchenStock.item_name.ilike(f"%{item.item_name}%"))
-    
-    if target_kitchen_id:
-        existing_query = existing_query.filter(KitchenStock.kitchen_id == target_kitchen_id)
-    elif target_user_id:
-        existing_query = existing_query.filter(KitchenStock.user_id == target_user_id)
-    else:
+    # 1. Check existing item (best ranked name match within the kitchen / user)
+    if not target_kitchen_id and not target_user_id:
         raise HTTPException(status_code=400, detail="Must provide user_id or kitchen_id")
 
-    db_item = existing_query.first()
+    db_item = find_stock_match(db, item.item_name, user_id=target_user_id, kitchen_id=target_kitchen_id)
 
     if db_item:
         # UPDATE existing
@@ -60,6 +69,7 @@ def add_item(item: StockCreate, db: Session = Depends(get_db)):
         db_item.quantity = item.quantity if item.quantity else db_item.quantity
         if item.expiry_date:
             db_item.expiry_date = item.expiry_date
+        record_event(db, db_item, "set")
     else:
         # CREATE new
         db_item = KitchenStock(
@@ -72,8 +82,9 @@ def add_item(item: StockCreate, db: Session = Depends(get_db)):
             source=item.source
         )
         db.add(db_item)
+        record_event(db, db_item, "set")
 
-    db.commit()
+    commit_stock_edit(db)
     db.refresh(db_item)
 
     return db_item
@@ -83,7 +94,8 @@ def add_item(item: StockCreate, db: Session = Depends(get_db)):
 @router.post("/batch", response_model=List[StockResponse])
 def add_items_batch(items: List[StockCreate], db: Session = Depends(get_db)):
     """
-    Bulk add items to stock.
+    Bulk add items to stock (e.g. a scanned bill). Items are merged into existing stock
+    in memory and written in one transaction; returns the created/updated rows.
     """
     manager = InventoryManager(db)
     
@@ -96,45 +108,81 @@ def add_items_batch(items: List[StockCreate], db: Session = Depends(get_db)):
              db.add(user)
              db.commit()
 
-    processed_items = []
-    
+    rows = []
     for item in items:
-        qty_str = item.quantity if item.quantity else "1 unit"
-        manager.add_stock(item.user_id, item.item_name, qty_str, item.category or "other")
-        
-        # We can't easily return the exact objects without querying again, 
-        # but the frontend might not strictl need the response list for batch ops aside from confirmation.
-        # Let's try to fetch the item we just touched.
-        db_item = db.query(KitchenStock).filter(
-            KitchenStock.user_id == item.user_id,
-            KitchenStock.item_name.ilike(f"%{item.item_name}%")
-        ).first()
-        if db_item:
-            processed_items.append(db_item)
-            
-    return processed_items
+        row = item.dict()
+        row["quantity"] = item.quantity if item.quantity else "1 unit"
+        rows.append(row)
+    return manager.add_stock_batch(rows)
+
+SORT_COLUMNS = {
+    "name": KitchenStock.item_name,
+    "amount": KitchenStock.base_amount,
+    "expiry": KitchenStock.expiry_date,
+    "updated": KitchenStock.updated_at,
+}
 
 @router.get("/{id}", response_model=List[StockResponse])
-def get_stock(id: str, db: Session = Depends(get_db)):
+def get_stock(id: str, sort: Optional[str] = Query(None, pattern="^(name|amount|expiry|updated)$"),
+              order: str = Query("asc", pattern="^(asc|desc)$"),
+              base_unit: Optional[str] = None, min_amount: Optional[float] = None, max_amount: Optional[float] = None,
+              db: Session = Depends(get_db)):
+    """
+    Stock for a user or kitchen. Optional filters/sorting run in SQL on the numeric columns:
+    min_amount / max_amount are in base units (g, ml, pcs), e.g. ?base_unit=g&max_amount=200 for "running low".
+    """
     try:
         # Support fetching by either User ID or Kitchen ID
-        return db.query(KitchenStock).filter(
+        query = db.query(KitchenStock).filter(
             or_(
                 KitchenStock.user_id == id,
                 KitchenStock.kitchen_id == id
             )
-        ).all()
+        )
+        if base_unit:
+            query = query.filter(KitchenStock.base_unit == base_unit)
+        if min_amount is not None:
+            query = query.filter(KitchenStock.base_amount >= min_amount)
+        if max_amount is not None:
+            query = query.filter(KitchenStock.base_amount <= max_amount)
+        if sort:
+            column = SORT_COLUMNS[sort]
+            query = query.order_by(column.desc() if order == "desc" else column.asc())
+        return query.all()
     except Exception as e:
         print(f"ERROR GETTING STOCK: {e}")
         raise HTTPException(status_code=500, detail=f"Stock Error: {str(e)}")
 
+@router.get("/{id}/totals")
+def get_stock_totals(id: str, db: Session = Depends(get_db)):
+    """
+    Total amount per item across all stock rows (e.g. several rice packs), summed in SQL
+    in base units. Rows whose quantity could not be parsed are counted separately.
+    """
+    rows = db.query(
+        KitchenStock.search_name,
+        func.min(KitchenStock.item_name),
+        KitchenStock.base_unit,
+        func.sum(KitchenStock.base_amount),
+        func.count(KitchenStock.stock_id),
+    ).filter(
+        or_(KitchenStock.user_id == id, KitchenStock.kitchen_id == id)
+    ).group_by(KitchenStock.search_name, KitchenStock.base_unit).order_by(KitchenStock.search_name).all()
+
+    return [
+        {"item_name": item_name, "base_unit": unit, "total": total, "entries": entries}
+        for _, item_name, unit, total, entries in rows
+    ]
+
 @router.delete("/{stock_id}")
 def delete_item(stock_id: str, db: Session = Depends(get_db)):
     item = db.query(KitchenStock).filter(KitchenStock.stock_id == stock_id).first()
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
+    record_event(db, item, "remove")
     db.delete(item)
-    db.commit()
+    # Versioned row: a concurrent meal/stock update makes this a 409, not a 500
+    commit_stock_edit(db)
     return {"message": "Item deleted"}
 
 @router.put("/{stock_id}", response_model=StockResponse)
@@ -145,7 +193,8 @@ def update_item(stock_id: str, item: StockCreate, db: Session = Depends(get_db))
     
     for key, value in item.dict().items():
         setattr(db_item, key, value)
+    record_event(db, db_item, "set")
     
-    db.commit()
+    commit_stock_edit(db)
     db.refresh(db_item)
     return db_item
@@ -1,97 +1,112 @@
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Query, BackgroundTasks
-from sqlalchemy.orm import Session
-from ..db import get_db, SessionLocal
-from ..models.kitchen import KitchenStock, User, Uploads
-from ..services.ocr import extract_items_from_image, extract_meal_from_image
-from ..services.job_store import job_store
-import json
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from ..services.job_store import job_store, FINISHED_STATUSES
+from ..services.sse import sse_event, StreamGuard
+from ..services.job_queue import job_queue
+from ..services.upload_spool import spool_multipart, discard, UploadTooLarge, UPLOAD_MAX_BYTES
+import asyncio
+import os
 import uuid
 import time
 
 router = APIRouter(prefix="/upload", tags=["upload"])
 
-def process_upload_background(job_id: str, contents: bytes, user_id: str, upload_type: str, filename: str, content_type: str):
-    print(f"[Job {job_id}] Starting background processing for {user_id}")
-    job_store.update_status(job_id, "processing")
-    
-    # Create a new DB session for this background thread
-    db = SessionLocal()
-    
-    try:
-        # 2. Process with OpenAI Vision
-        print(f"[Job {job_id}] Calling OpenAI Vision...")
-        extracted_data = None
-        
-        if upload_type == "meal":
-            extracted_data = extract_meal_from_image(contents, mime_type=content_type)
-            if not extracted_data:
-                 raise Exception("AI Extraction failed. Could not identify meal.")
-        else:
-            extracted_data = extract_items_from_image(contents, mime_type=content_type)
-            # If "error" key exists in dict, it means OpenAI failed hard
-            if isinstance(extracted_data, dict) and extracted_data.get("error"):
-                 raise Exception(f"AI Error: {extracted_data['error']}")
-            
-        print(f"[Job {job_id}] OpenAI Result: {extracted_data}")
-        
-        # REMOVED: strict empty check. We now allow empty results (0 items found).
+# Longest a long-poll request is held open (stay under proxy/load balancer idle timeouts)
+UPLOAD_STATUS_WAIT_SECONDS = float(os.getenv("UPLOAD_STATUS_WAIT_SECONDS", "25"))
+# Status streams send a keep-alive comment this often, and end after the stream limit
+UPLOAD_STATUS_KEEPALIVE_SECONDS = 15
+UPLOAD_STATUS_STREAM_SECONDS = float(os.getenv("UPLOAD_STATUS_STREAM_SECONDS", "600"))
+
+
+class UploadSizeLimit:
+    """
+    Caps upload request bodies at UPLOAD_MAX_BYTES (plus multipart overhead) with a 413:
+    up front from Content-Length, and for chunked or under-declared bodies by counting the
+    bytes as they are received, so an oversized body is never read to the end.
+    """
+
+    # Multipart boundaries and the other form fields
+    OVERHEAD = 64 * 1024
+
+    def __init__(self, app):
+        self.app = app
+
+    MESSAGE = f"File is larger than {UPLOAD_MAX_BYTES // (1024 * 1024)} MB"
+
+    def _too_large(self):
+        return JSONResponse(status_code=413, content={"detail": self.MESSAGE})
+
+    async def __call__(self, scope, receive, send):
+        if not (scope["type"] == "http" and scope["method"] == "POST" and scope["path"].rstrip("/") == router.prefix):
+            await self.app(scope, receive, send)
+            return
+
+        limit = UPLOAD_MAX_BYTES + self.OVERHEAD
+        length = dict(scope["headers"]).get(b"content-length")
+        if length and length.isdigit() and int(length) > limit:
+            await self._too_large()(scope, receive, send)
+            return
+
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise UploadTooLarge(self.MESSAGE)
+            return message
+
+        async def tracked_send(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
 
-        # 3. Upload to Supabase Storage
-        print(f"[Job {job_id}] Uploading to Supabase Storage...")
-        public_url = f"local://{filename}" # Default fallback
         try:
-             # Lazy import inside try block
-            from ..services.storage import storage_service
-            public_url = storage_service.upload_file(contents, filename, content_type)
-            print(f"[Job {job_id}] File uploaded successfully. URL: {public_url}")
-        except Exception as e:
-            print(f"[Job {job_id}] Failed to upload to Supabase: {e}")
-            public_url = f"local://{filename}" 
-
-        # 4. Save Upload Record
-        print(f"[Job {job_id}] Saving to DB...")
-        user = db.query(User).filter(User.user_id == user_id).first()
-        if not user:
-            user = User(user_id=user_id, name="Default User")
-            db.add(user)
-            db.commit()
-
-        new_upload = Uploads(
-            user_id=user_id,
-            file_url=public_url, 
-            upload_type=f"{upload_type}_ocr",
-            extracted_json=json.dumps(extracted_data)
-        )
-        db.add(new_upload)
-        db.commit() 
-        print(f"[Job {job_id}] Transaction committed.")
-        
-        # Update Job Status
-        job_store.update_status(job_id, "completed", result=extracted_data)
+            await self.app(scope, limited_receive, tracked_send)
+        except UploadTooLarge:
+            if started:
+                raise
+            await self._too_large()(scope, receive, send)
 
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        print(f"[Job {job_id}] Error: {e}")
-        job_store.update_status(job_id, "error", error=str(e))
-    finally:
-        db.close()
 
+# The body is parsed by spool_multipart rather than File(...), so describe it for the docs
+UPLOAD_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "required": ["file"],
+            "properties": {"file": {"type": "string", "format": "binary"}},
+        }}},
+    },
+}
 
-@router.post("/")
+
+@router.post("/", openapi_extra=UPLOAD_REQUEST_BODY)
 async def upload_file(
-    background_tasks: BackgroundTasks,
+    request: Request,
     user_id: str = Query(...), 
     upload_type: str = Query("stock"), # stock | meal
-    file: UploadFile = File(...), 
 ):
     print(f"--- Received Upload Request for User: {user_id} Type: {upload_type} ---")
-    print(f"File: {file.filename}, Content-Type: {file.content_type}")
 
+    path = None
     try:
-        # 1. Read file immediately (before request ends)
-        contents = await file.read()
-        print(f"File read successfully. Size: {len(contents)} bytes")
+        # 1. Stream the file part straight to the spool directory (never held in memory
+        # as a whole, and not buffered to a temp file by the form parser first)
+        try:
+            upload = await spool_multipart(request)
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        path = upload.path
+        print(f"File: {upload.filename}, Content-Type: {upload.content_type}")
+        print(f"File spooled successfully. Size: {upload.size} bytes")
         
         # 2. Assign Job ID
         job_id = str(uuid.uuid4())
@@ -99,18 +114,18 @@ async def upload_file(
             "status": "pending",
             "created_at": time.time()
         }
-        job_store.save_job(job_id, initial_job_state)
+        await asyncio.to_thread(job_store.save_job, job_id, initial_job_state)
         
-        # 3. Queue Background Task
-        background_tasks.add_task(
-            process_upload_background, 
-            job_id, 
-            contents, 
-            user_id, 
-            upload_type, 
-            file.filename, 
-            file.content_type
-        )
+        # 3. Queue the job (durable; picked up by the upload workers, see services/upload_jobs.py)
+        await asyncio.to_thread(job_queue.enqueue, job_id, {
+            "user_id": user_id,
+            "upload_type": upload_type,
+            "filename": upload.filename,
+            "content_type": upload.content_type,
+            "path": upload.path,
+            "size": upload.size,
+            "content_hash": upload.content_hash,
+        })
         
         # 4. Return immediately
         return {
@@ -119,15 +134,70 @@ async def upload_file(
             "status": "pending"
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Unexpected Error: {e}")
+        discard(path)
         raise HTTPException(status_code=500, detail=f"Server Error: {str(e)}")
 
 
 @router.get("/status/{job_id}")
 async def get_upload_status(job_id: str):
-    job = job_store.get_job(job_id)
+    job = await asyncio.to_thread(job_store.get_job, job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
     return job
+
+
+@router.get("/status/{job_id}/wait")
+async def wait_upload_status(job_id: str, revision: int = Query(None), timeout: float = Query(None, ge=0)):
+    """
+    Long-poll: returns the job once it changes after `revision` (the value from the last
+    response; omit it to wait for the next change) or is finished. After `timeout` seconds
+    (max UPLOAD_STATUS_WAIT_SECONDS) the unchanged job is returned; just call again.
+    """
+    if timeout is None or timeout > UPLOAD_STATUS_WAIT_SECONDS:
+        timeout = UPLOAD_STATUS_WAIT_SECONDS
+    job = await job_store.wait_for_update(job_id, revision, timeout)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/status/{job_id}/stream")
+async def stream_upload_status(job_id: str, request: Request):
+    """
+    Server-Sent Events: a {'type': 'status', 'job': ...} frame now and on every change,
+    then {'type': 'done'} once the job is completed or failed.
+    """
+    if not await asyncio.to_thread(job_store.get_job, job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        guard = StreamGuard(is_disconnected=request.is_disconnected, deadline_seconds=UPLOAD_STATUS_STREAM_SECONDS)
+        revision = -1  # send the current state first
+        while not await guard.should_stop():
+            job = await job_store.wait_for_update(job_id, revision,
+                                                  min(UPLOAD_STATUS_KEEPALIVE_SECONDS, guard.remaining()))
+            if job is None:
+                yield sse_event({'type': 'error', 'content': 'Job not found'})
+                return
+            if job.get("revision", 0) == revision:
+                yield ": keep-alive\n\n"
+                continue
+            revision = job.get("revision", 0)
+            yield sse_event({'type': 'status', 'job': job})
+            if job.get("status") in FINISHED_STATUSES:
+                yield sse_event({'type': 'done'})
+                return
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get("/queue/stats")
+def get_queue_stats():
+    """Upload job queue metrics: depth, in-flight/dead jobs, queue wait and processing time (ms)."""
+    return job_queue.stats()
@@ -0,0 +1,159 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class TTLCache:
+    """
+    Small in-process LRU cache with per-entry TTL, an optional Redis tier and
+    single-flight loading (concurrent misses for the same key share one compute).
+
+    Values must be JSON-serializable if a Redis client is given.
+    Thread-safe: callers are usually threadpool workers.
+    """
+
+    def __init__(self, name: str, max_entries: int = 1000, ttl_seconds: int = 3600, redis_client=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.redis = redis_client
+
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}         # key -> Future shared by concurrent callers
+        self._lock = threading.Lock()
+
+        # Counters (see stats())
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def _redis_key(self, key: str):
+        return f"cache:{self.name}:{key}"
+
+    def _get_local(self, key: str):
+        """Returns (found, value). Caller must hold the lock."""
+        entry = self._data.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return False, None
+        self._data.move_to_end(key)
+        return True, value
+
+    def _set_local(self, key: str, value):
+        """Caller must hold the lock."""
+        self._data[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def _get_redis(self, key: str):
+        if not self.redis:
+            return False, None
+        try:
+            data = self.redis.get(self._redis_key(key))
+            if data is not None:
+                return True, json.loads(data)
+        except Exception as e:
+            print(f"Redis Error (Cache Get {self.name}): {e}")
+        return False, None
+
+    def _set_redis(self, key: str, value):
+        if not self.redis:
+            return
+        try:
+            self.redis.setex(self._redis_key(key), self.ttl_seconds, json.dumps(value))
+        except Exception as e:
+            print(f"Redis Error (Cache Set {self.name}): {e}")
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            found, value = self._get_local(key)
+            if found:
+                self.hits += 1
+                return value
+        found, value = self._get_redis(key)
+        with self._lock:
+            if found:
+                self.redis_hits += 1
+                self._set_local(key, value)
+                return value
+            self.misses += 1
+        return default
+
+    def set(self, key: str, value):
+        with self._lock:
+            self._set_local(key, value)
+        self._set_redis(key, value)
+
+    def get_or_compute(self, key: str, compute):
+        """
+        Return the cached value for key, or call compute() once and cache its result.
+        Callers that miss while another caller is computing the same key wait for
+        that result instead of calling compute() themselves.
+        Exceptions from compute() are propagated and never cached.
+        """
+        with self._lock:
+            found, value = self._get_local(key)
+            if found:
+                self.hits += 1
+                return value
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                future = Future()
+                self._inflight[key] = future
+                leader = True
+
+        if not leader:
+            return future.result()
+
+        try:
+            found, value = self._get_redis(key)
+            with self._lock:
+                if found:
+                    self.redis_hits += 1
+                    self._set_local(key, value)
+                else:
+                    self.misses += 1
+            if not found:
+                value = compute()
+                self.set(key, value)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            # Coalesced callers were served without an upstream call, so they count as hits
+            lookups = self.hits + self.redis_hits + self.coalesced + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "redis": self.redis is not None,
+                "hits": self.hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "hit_rate": round(1 - self.misses / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,218 @@
+import os
+import re
+from datetime import date
+
+from app.services.name_search import stem
+
+# Try to use tiktoken for exact counts, but don't crash if it's missing (fallback to estimate)
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _encoding = None
+    print("Warning: 'tiktoken' not available. Token counts will be estimated.")
+
+# Total tokens for the messages we send (system prompt + summary + history + new message)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "4000"))
+# Upper bound for the stored rolling summary
+SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "300"))
+SUMMARY_MODEL = os.getenv("CHAT_SUMMARY_MODEL", "gpt-4o-mini")
+
+# Per-message framing overhead in the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def count_tokens(text: str):
+    if not text:
+        return 0
+    if _encoding:
+        return len(_encoding.encode(text))
+    # ~4 characters per token for English text
+    return len(text) // 4 + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int):
+    """Cut text down to at most max_tokens (keeps the beginning)."""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if _encoding:
+        return _encoding.decode(_encoding.encode(text)[:max_tokens]) + "..."
+    return text[:max_tokens * 4] + "..."
+
+
+def message_tokens(message: dict):
+    return count_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+
+
+def build_context(system_prompt: str, summary: str, history: list, user_message: str, budget: int = None, extra_system: list = None):
+    """
+    Fit the conversation into a token budget.
+    extra_system: additional system messages (e.g. a prefetched stock snapshot) that are always sent.
+
+    history: list of {"role", "content", "timestamp"} dicts, oldest first.
+    The newest history messages are kept verbatim while they fit; the newest one is
+    truncated rather than dropped (it's usually the recipe the user is replying to).
+    Everything older is returned as `overflow` so it can be folded into the summary.
+
+    Returns (messages, overflow, stats).
+    """
+    budget = budget or CONTEXT_TOKEN_BUDGET
+
+    messages = [{"role": "system", "content": system_prompt}]
+    if summary:
+        summary = truncate_to_tokens(summary, SUMMARY_MAX_TOKENS)
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation with this user:\n{summary}"})
+    for content in extra_system or []:
+        if content:
+            messages.append({"role": "system", "content": content})
+    user_msg = {"role": "user", "content": user_message}
+
+    fixed_tokens = sum(message_tokens(m) for m in messages) + message_tokens(user_msg)
+    remaining = budget - fixed_tokens
+
+    kept = []
+    cut = 0  # index in history where the kept window starts
+    for i in range(len(history) - 1, -1, -1):
+        msg = history[i]
+        tokens = message_tokens(msg)
+        if tokens <= remaining:
+            kept.append({"role": msg["role"], "content": msg["content"]})
+            remaining -= tokens
+            cut = i
+            continue
+        if not kept and remaining > MESSAGE_OVERHEAD_TOKENS:
+            content = truncate_to_tokens(msg["content"], remaining - MESSAGE_OVERHEAD_TOKENS)
+            kept.append({"role": msg["role"], "content": content})
+            remaining -= count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+            cut = i
+            continue
+        cut = i + 1
+        break
+    kept.reverse()
+
+    messages.extend(kept)
+    messages.append(user_msg)
+    overflow = history[:cut]
+
+    stats = {
+        "budget": budget,
+        "prompt_tokens": budget - remaining,
+        "summary_tokens": count_tokens(summary) if summary else 0,
+        "history_messages": len(kept),
+        "overflow_messages": len(overflow),
+    }
+    return messages, overflow, stats
+
+
+async def summarize_messages(client, summary: str, messages: list):
+    """
+    Fold older messages into the existing rolling summary with a cheap model.
+    Only the new messages are sent, never the full history.
+    """
+    transcript = "\n".join(
+        f"{m['role'].upper()}: {truncate_to_tokens(m['content'], 400)}" for m in messages
+    )
+    prompt = f"""
+    You maintain a short running summary of a conversation between a user and a kitchen assistant.
+    Update the summary with the new messages below. Keep facts that matter for later turns:
+    dietary preferences, allergies, dishes suggested (name + key ingredients), meals the user
+    said they cooked or ate, and open questions. Drop greetings and full recipe steps.
+    Keep it under {SUMMARY_MAX_TOKENS} tokens. Return ONLY the updated summary text.
+
+    CURRENT SUMMARY:
+    {summary or "(empty)"}
+
+    NEW MESSAGES:
+    {transcript}
+    """
+    response = await client.chat.completions.create(
+        model=SUMMARY_MODEL,
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=SUMMARY_MAX_TOKENS + 100,
+    )
+    return truncate_to_tokens(response.choices[0].message.content.strip(), SUMMARY_MAX_TOKENS)
+
+
+# --- Kitchen stock context ---
+
+# "relevant" ranks and caps the stock list; "full" sends every item (legacy behaviour)
+STOCK_CONTEXT_MODE = os.getenv("CHAT_STOCK_CONTEXT_MODE", "relevant")
+STOCK_TOKEN_BUDGET = int(os.getenv("CHAT_STOCK_TOKEN_BUDGET", "600"))
+
+_WORD_RE = re.compile(r"[a-z]+")
+
+
+def name_terms(text: str):
+    return {stem(w) for w in _WORD_RE.findall((text or "").lower()) if len(w) > 2}
+
+
+def format_stock_item(stock):
+    item_str = f"- {stock.item_name}"
+    if stock.quantity:
+        item_str += f" ({stock.quantity})"
+    if stock.expiry_date:
+        item_str += f" [Expires: {stock.expiry_date}]"
+    return item_str
+
+
+def rank_stock(stocks: list, message: str, today: date = None):
+    """
+    Order stock items by relevance to the user's message, then by how soon they expire
+    (use-it-up-first items are what recipe suggestions should lean on).
+    """
+    today = today or date.today()
+    message_terms = name_terms(message)
+
+    def score(stock):
+        relevance = len(name_terms(stock.item_name) & message_terms)
+        expiry_boost = 0
+        if stock.expiry_date:
+            days_left = (stock.expiry_date - today).days
+            if days_left <= 3:
+                expiry_boost = 2
+            elif days_left <= 7:
+                expiry_boost = 1
+        return (-(relevance * 3 + expiry_boost), stock.expiry_date or date.max, (stock.item_name or "").lower())
+
+    return sorted(stocks, key=score)
+
+
+def build_stock_context(stocks: list, message: str = None, budget: int = None, mode: str = None):
+    """
+    Render the kitchen stock for the prompt.
+    In "relevant" mode the most useful items are kept until the token budget is
+    reached, then listed grouped by category.
+    """
+    if not stocks:
+        return "Kitchen is empty."
+
+    mode = mode or STOCK_CONTEXT_MODE
+    if mode == "full":
+        return "\n".join(format_stock_item(stock) for stock in stocks)
+
+    budget = budget or STOCK_TOKEN_BUDGET
+    chosen = []
+    used = 0
+    for stock in rank_stock(stocks, message):
+        line = format_stock_item(stock)
+        tokens = count_tokens(line) + 1
+        if used + tokens > budget:
+            break
+        chosen.append((stock, line))
+        used += tokens
+
+    by_category = {}
+    for stock, line in chosen:
+        by_category.setdefault((stock.category or "other").lower(), []).append(line)
+
+    result = []
+    for category in sorted(by_category):
+        result.append(f"{category.title()}:")
+        result.extend(by_category[category])
+
+    omitted = len(stocks) - len(chosen)
+    if omitted:
+        result.append(f"(+{omitted} more items not shown; less relevant to this request)")
+    return "\n".join(result)
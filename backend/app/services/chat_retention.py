@@ -0,0 +1,138 @@
+import asyncio
+import json
+import os
+import zlib
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+from app.db import session_scope
+from app.models.chat import ChatMessage, ChatArchive
+
+# Messages older than this are moved out of chat_messages into compressed archive blocks
+CHAT_RETENTION_DAYS = int(os.getenv("CHAT_RETENTION_DAYS", "90"))
+# Messages per archive block (also the size of one archive+delete transaction)
+ARCHIVE_BLOCK_MESSAGES = int(os.getenv("CHAT_ARCHIVE_BLOCK_MESSAGES", "500"))
+# Run the archiver from the API process every N hours (0 = only via archive_chat_messages.py)
+ARCHIVE_INTERVAL_HOURS = float(os.getenv("CHAT_ARCHIVE_INTERVAL_HOURS", "0"))
+
+
+def compress_messages(messages: list):
+    """messages: list of {id, role, content, timestamp} -> (payload bytes, raw size)."""
+    raw = json.dumps([
+        {**m, "timestamp": m["timestamp"].isoformat()} for m in messages
+    ], separators=(",", ":")).encode()
+    return zlib.compress(raw, 6), len(raw)
+
+
+def decompress_messages(payload: bytes):
+    messages = json.loads(zlib.decompress(payload))
+    for m in messages:
+        m["timestamp"] = datetime.fromisoformat(m["timestamp"])
+    return messages
+
+
+def archive_user_messages(db: Session, user_id: str, cutoff: datetime, block_size: int = None):
+    """
+    Move one user's messages older than cutoff into archive blocks.
+    Each block is written and its rows deleted in the same transaction, so a crash
+    never loses or duplicates messages. Returns (messages archived, raw bytes, compressed bytes).
+    """
+    block_size = block_size or ARCHIVE_BLOCK_MESSAGES
+    archived = raw_total = compressed_total = 0
+    while True:
+        rows = (db.query(ChatMessage)
+                .filter(ChatMessage.user_id == user_id, ChatMessage.timestamp < cutoff)
+                .order_by(ChatMessage.timestamp, ChatMessage.id)
+                .limit(block_size).all())
+        if not rows:
+            break
+
+        messages = [{"id": r.id, "role": r.role, "content": r.content, "timestamp": r.timestamp} for r in rows]
+        payload, raw_bytes = compress_messages(messages)
+        db.add(ChatArchive(
+            user_id=user_id,
+            period_start=rows[0].timestamp,
+            period_end=rows[-1].timestamp,
+            message_count=len(rows),
+            raw_bytes=raw_bytes,
+            payload=payload,
+        ))
+        (db.query(ChatMessage)
+           .filter(ChatMessage.id.in_([r.id for r in rows]))
+           .delete(synchronize_session=False))
+        db.commit()
+
+        archived += len(rows)
+        raw_total += raw_bytes
+        compressed_total += len(payload)
+        if len(rows) < block_size:
+            break
+    return archived, raw_total, compressed_total
+
+
+def archive_old_messages(older_than_days: int = None, now: datetime = None, dry_run: bool = False):
+    """Archive every user's messages older than the retention window. Returns stats."""
+    days = CHAT_RETENTION_DAYS if older_than_days is None else older_than_days
+    cutoff = (now or datetime.utcnow()) - timedelta(days=days)
+    stats = {"cutoff": cutoff.isoformat(), "users": 0, "messages": 0, "raw_bytes": 0, "compressed_bytes": 0}
+
+    with session_scope() as db:
+        user_ids = [row[0] for row in (db.query(ChatMessage.user_id)
+                                         .filter(ChatMessage.timestamp < cutoff)
+                                         .distinct().all())]
+        if dry_run:
+            stats["users"] = len(user_ids)
+            stats["messages"] = db.query(ChatMessage).filter(ChatMessage.timestamp < cutoff).count()
+            return stats
+
+        for user_id in user_ids:
+            try:
+                count, raw_bytes, compressed_bytes = archive_user_messages(db, user_id, cutoff)
+            except Exception as e:
+                db.rollback()
+                print(f"Chat archive failed for user {user_id}: {e}")
+                continue
+            stats["users"] += 1
+            stats["messages"] += count
+            stats["raw_bytes"] += raw_bytes
+            stats["compressed_bytes"] += compressed_bytes
+    return stats
+
+
+def load_archived_messages(db: Session, user_id: str, before: tuple = None, limit: int = 20):
+    """
+    Newest-first archived messages for a user, continuing the same (timestamp, id)
+    keyset order as query_chat_messages. Only blocks that can contain matches are
+    decompressed, newest block first.
+    """
+    query = db.query(ChatArchive).filter(ChatArchive.user_id == user_id)
+    if before:
+        query = query.filter(ChatArchive.period_start <= before[0])
+    query = query.order_by(ChatArchive.period_end.desc(), ChatArchive.id.desc())
+
+    result = []
+    for block in query.yield_per(4):
+        # Blocks of one user never overlap (each run archives strictly older messages
+        # than everything still hot), so newest-first blocks give newest-first messages
+        for m in reversed(decompress_messages(block.payload)):
+            if before and (m["timestamp"], m["id"]) >= before:
+                continue
+            result.append(m)
+            if len(result) >= limit:
+                return result
+    return result
+
+
+async def run_archive_loop(interval_hours: float = None):
+    """Periodic archiver for deployments without a separate cron job."""
+    interval = (interval_hours or ARCHIVE_INTERVAL_HOURS) * 3600
+    while True:
+        try:
+            stats = await asyncio.to_thread(archive_old_messages)
+            if stats["messages"]:
+                print(f"Chat archive: moved {stats['messages']} messages for {stats['users']} users "
+                      f"({stats['raw_bytes']} -> {stats['compressed_bytes']} bytes)", flush=True)
+        except Exception as e:
+            print(f"Chat archive run failed: {e}", flush=True)
+        await asyncio.sleep(interval)
@@ -0,0 +1,144 @@
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Try to import Pillow, but don't crash if it's missing (images are then sent as uploaded)
+try:
+    from PIL import Image, ImageOps, ImageStat
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+    print("Warning: 'Pillow' module not found. Upload images will be sent to OCR unprocessed.")
+
+# Longest side sent to Vision. OpenAI scales high-detail images to fit 2048px anyway,
+# so anything above that is only upload time; lower values trade legibility for bytes.
+OCR_IMAGE_MAX_EDGE = int(os.getenv("OCR_IMAGE_MAX_EDGE", "2048"))
+OCR_IMAGE_FORMAT = os.getenv("OCR_IMAGE_FORMAT", "jpeg").lower()  # jpeg | webp
+OCR_IMAGE_QUALITY = int(os.getenv("OCR_IMAGE_QUALITY", "82"))
+# Stock uploads whose colours are this washed out (mean HSV saturation, 0-255) are treated
+# as receipts and sent in grayscale
+OCR_RECEIPT_MAX_SATURATION = int(os.getenv("OCR_RECEIPT_MAX_SATURATION", "30"))
+# Processes for resizing/encoding (CPU-bound; 0 = run in the calling thread)
+OCR_PREP_PROCESSES = int(os.getenv("OCR_PREP_PROCESSES", "2"))
+OCR_PREP_TIMEOUT = float(os.getenv("OCR_PREP_TIMEOUT", "30"))
+
+MIME_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp"}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _open(source):
+    """Open bytes or a spooled file path (Pillow reads the file itself, nothing is copied)."""
+    return Image.open(source if isinstance(source, str) else io.BytesIO(source))
+
+
+def _size(source):
+    return os.path.getsize(source) if isinstance(source, str) else len(source)
+
+
+def looks_like_receipt(image):
+    """Paper receipts are nearly colourless; fridge/ingredient photos are not."""
+    sample = image.convert("RGB")
+    sample.thumbnail((64, 64))
+    saturation = ImageStat.Stat(sample.convert("HSV")).mean[1]
+    return saturation <= OCR_RECEIPT_MAX_SATURATION
+
+
+def prepare_image(source, upload_type: str = "stock", max_edge: int = None, fmt: str = None, quality: int = None):
+    """
+    Orient (EXIF), downscale and re-encode an uploaded photo for the Vision call.
+    source is bytes or a file path. Returns (bytes, mime_type, info).
+    Runs in a worker process, so it only takes plain values.
+    """
+    max_edge = max_edge or OCR_IMAGE_MAX_EDGE
+    fmt = (fmt or OCR_IMAGE_FORMAT).lower()
+    quality = quality or OCR_IMAGE_QUALITY
+
+    image = _open(source)
+    original_size = image.size
+    # Phones store portrait shots sideways plus an orientation tag; re-encoding drops the tag
+    rotated = image.getexif().get(0x0112, 1) != 1
+    image = ImageOps.exif_transpose(image)
+
+    grayscale = upload_type != "meal" and looks_like_receipt(image)
+    image = image.convert("L" if grayscale else "RGB")
+    image.thumbnail((max_edge, max_edge), Image.LANCZOS)  # keeps aspect ratio, never upscales
+
+    out = io.BytesIO()
+    image.save(out, format=fmt.upper(), quality=quality, optimize=fmt == "jpeg")
+    info = {"original_bytes": _size(source), "bytes": out.tell(), "original_size": original_size,
+            "size": image.size, "grayscale": grayscale, "rotated": rotated}
+    return out.getvalue(), MIME_TYPES.get(fmt, f"image/{fmt}"), info
+
+
+def dhash(source, size: int = 8):
+    """
+    Difference hash (hex, size*size bits): survives re-encoding, resizing and EXIF rotation,
+    so a re-saved or re-sent copy of the same photo lands within a few bits of the original.
+    """
+    image = _open(source)
+    image.draft("L", (size * 16, size * 16))  # JPEG: decode at reduced scale, much faster
+    image = ImageOps.exif_transpose(image).convert("L").resize((size + 1, size), Image.LANCZOS)
+    pixels = list(image.getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            bits = (bits << 1) | (left > pixels[row * (size + 1) + col + 1])
+    return f"{bits:0{size * size // 4}x}"
+
+
+def hash_distance(a: str, b: str):
+    """Number of differing bits between two dhash values."""
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+def perceptual_hash(source):
+    """dhash of an upload (bytes or file path), or None if Pillow is missing or the file isn't an image."""
+    if not PIL_AVAILABLE or not source:
+        return None
+    try:
+        if OCR_PREP_PROCESSES > 0:
+            return _get_pool().submit(dhash, source).result(OCR_PREP_TIMEOUT)
+        return dhash(source)
+    except Exception as e:
+        print(f"Perceptual hash failed ({e})")
+        return None
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Never fork: this process runs worker / listener threads, and a forked child
+            # inherits their locks in whatever state they were (deadlock risk)
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(max_workers=OCR_PREP_PROCESSES, mp_context=multiprocessing.get_context(method))
+    return _pool
+
+
+def preprocess_for_ocr(source, mime_type: str, upload_type: str = "stock"):
+    """
+    Shrink an upload (bytes or spooled file path) before it is base64-encoded into the
+    Vision request. Returns (image, mime_type): the prepared bytes, or `source` itself if
+    Pillow is missing, the file can't be decoded, or re-encoding wouldn't make it smaller.
+    """
+    if not PIL_AVAILABLE or not source:
+        return source, mime_type
+    try:
+        if OCR_PREP_PROCESSES > 0:
+            prepared, prepared_type, info = _get_pool().submit(prepare_image, source, upload_type).result(OCR_PREP_TIMEOUT)
+        else:
+            prepared, prepared_type, info = prepare_image(source, upload_type)
+    except Exception as e:
+        print(f"Image preprocessing failed ({e}); sending original")
+        return source, mime_type
+    if info["bytes"] >= info["original_bytes"] and info["size"] == info["original_size"] and not info["rotated"]:
+        # Already small and upright: nothing to gain
+        return source, mime_type
+    print(f"Image prepared for OCR: {info['original_bytes']} -> {info['bytes']} bytes, "
+          f"{info['original_size']} -> {info['size']}{' grayscale' if info['grayscale'] else ''}")
+    return prepared, prepared_type
@@ -1,50 +1,125 @@
+import os
 import re
+import time
+import random
+from functools import lru_cache
+from sqlalchemy import update, delete, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import Session
-from app.models.kitchen import KitchenStock, User
+from sqlalchemy.orm.exc import StaleDataError
+from app.models.kitchen import KitchenStock, User, generate_uuid
 from app.models.meals import Meal
+from app.services.name_search import normalize_name, rank_candidates, find_stock_match
+from app.services.stock_ledger import stock_event, write_events, meal_usage, latest_events, ledger_started_at
 from datetime import datetime
 
+# --- Quantity grammar (compiled once) ---
+# [approx] [<count> x] <number> [unit] [x <count>] [anything else, e.g. "pack", "(approx)"]
+# <number>: 2 | 1.5 | .5 | 1/2 | 1 1/2 | ½
+_UNICODE_FRACTIONS = {"½": " 1/2", "¼": " 1/4", "¾": " 3/4", "⅓": " 1/3", "⅔": " 2/3", "⅛": " 1/8"}
+_NUMBER = r"\d+\s+\d+/\d+|\d+/\d+|\d*\.\d+|\d+\.?"
+_QUANTITY_RE = re.compile(
+    r"^(?:(?:approx\.?|approximately|about|around|~)\s*)?"
+    r"(?:(?P<count>\d+)\s*[x×*]\s*)?"
+    rf"(?P<number>{_NUMBER})\s*"
+    r"(?P<unit>[a-z]+)?\.?"
+    r"(?:\s*[x×*]\s*(?P<count_after>\d+)\b)?"
+)
+
+UNIT_ALIASES = {
+    "gm": "g", "gms": "g", "gram": "g", "grams": "g", "gr": "g", "grm": "g",
+    "kg": "kg", "kgs": "kg", "kilo": "kg", "kilos": "kg", "kilogram": "kg", "kilograms": "kg",
+    "mg": "mg", "milligram": "mg", "milligrams": "mg",
+    "ml": "ml", "mls": "ml", "millilitre": "ml", "milliliter": "ml", "millilitres": "ml", "milliliters": "ml",
+    "l": "l", "ltr": "l", "ltrs": "l", "lt": "l", "liter": "l", "liters": "l", "litre": "l", "litres": "l",
+    "pc": "pcs", "pcs": "pcs", "piece": "pcs", "pieces": "pcs", "no": "pcs", "nos": "pcs",
+    "tbsp": "tbsp", "tbsps": "tbsp", "tablespoon": "tbsp", "tablespoons": "tbsp",
+    "tsp": "tsp", "tsps": "tsp", "teaspoon": "tsp", "teaspoons": "tsp",
+    "cup": "cup", "cups": "cup",
+    "oz": "oz", "ounce": "oz", "ounces": "oz",
+    "lb": "lb", "lbs": "lb", "pound": "lb", "pounds": "lb",
+    "pack": "pack", "packs": "pack", "packet": "pack", "packets": "pack",
+}
+# Units that are really a count
+UNIT_MULTIPLIERS = {"dozen": (12, "pcs"), "dozens": (12, "pcs")}
+
+QUANTITY_CACHE_SIZE = 4096
+
+
+def _parse_number(text: str):
+    parts = text.split()
+    total = 0.0
+    for part in parts:
+        if "/" in part:
+            numerator, denominator = part.split("/")
+            if float(denominator) == 0:
+                return None
+            total += float(numerator) / float(denominator)
+        else:
+            total += float(part)
+    return total
+
+
+@lru_cache(maxsize=QUANTITY_CACHE_SIZE)
+def _parse_quantity(text: str):
+    for symbol, replacement in _UNICODE_FRACTIONS.items():
+        if symbol in text:
+            text = text.replace(symbol, replacement).strip()
+
+    match = _QUANTITY_RE.match(text)
+    if not match:
+        return None, None
+    try:
+        amount = _parse_number(match.group("number"))
+    except ValueError:
+        return None, None
+    if amount is None:
+        return None, None
+
+    for count in (match.group("count"), match.group("count_after")):
+        if count:
+            amount *= int(count)
+
+    unit = match.group("unit") or ""
+    if unit in UNIT_MULTIPLIERS:
+        factor, unit = UNIT_MULTIPLIERS[unit]
+        amount *= factor
+    return amount, UNIT_ALIASES.get(unit, unit)
+
+
 class QuantityParser:
     @staticmethod
     def parse(quantity_str: str):
         """
-        Parses a quantity string like '500g', '2 pcs', '1.5kg' into (amount, unit).
-        Returns (None, None) if parsing fails.
+        Parses a quantity string into (amount, unit):
+        '500g' -> (500.0, 'g'), '1/2 cup' -> (0.5, 'cup'), '2 x 500g' -> (1000.0, 'g'),
+        '1.5 kg pack' -> (1.5, 'kg'), '500 g (approx)' -> (500.0, 'g').
+        Returns (None, None) if parsing fails. Results are memoized per string.
         """
         if not quantity_str:
             return None, None
-            
-        quantity_str = quantity_str.lower().strip()
-        
-        # Match number at start (int or float)
-        match = re.match(r"([\d\.]+)\s*([a-zA-Z]*)", quantity_str)
-        if match:
-            amount = float(match.group(1))
-            unit = match.group(2).strip().lower()
-            
-            # Normalize units
-            unit_map = {
-                "gm": "g", "gms": "g", "gram": "g", "grams": "g",
-                "kg": "kg", "kgs": "kg", "kilogram": "kg",
-                "ml": "ml", "mls": "ml",
-                "l": "l", "liters": "l", "litre": "l",
-                "pc": "pcs", "pcs": "pcs", "piece": "pcs", "pieces": "pcs",
-                "tbsp": "tbsp", "tablespoon": "tbsp",
-                "tsp": "tsp", "teaspoon": "tsp"
-            }
-            unit = unit_map.get(unit, unit)
-
-            return amount, unit
-        
-        return None, None
+        return _parse_quantity(str(quantity_str).lower().strip())
+
+    @staticmethod
+    def parse_many(quantity_strs: list):
+        """Parse a list of quantity strings (e.g. an OCR item list); repeated strings are parsed once."""
+        cached = _parse_quantity
+        return [cached(str(q).lower().strip()) if q else (None, None) for q in quantity_strs]
+
+    @staticmethod
+    def cache_info():
+        return _parse_quantity.cache_info()
 
     @staticmethod
     def get_base_unit(unit: str):
         """Returns (base_unit, factor_to_base)"""
         # Mass (base: g)
-        if unit in ["kg", "g", "mg"]:
+        if unit in ["kg", "g", "mg", "oz", "lb"]:
             if unit == "kg": return "g", 1000.0
             if unit == "mg": return "g", 0.001
+            if unit == "oz": return "g", 28.35
+            if unit == "lb": return "g", 453.6
             return "g", 1.0
         
         # Volume (base: ml)
@@ -89,23 +164,185 @@ class QuantityParser:
     @staticmethod
     def format(amount: float, unit: str):
         """Formats amount and unit back to string."""
-        # Remove .0 for integers
+        # Drop float noise (1.4000000000000001) and .0 for integers
+        amount = round(amount, 3)
         if amount == int(amount):
             amount = int(amount)
         return f"{amount} {unit}".strip()
 
+def stock_quantity(stock: KitchenStock):
+    """(amount, unit) of a stock row from its numeric columns; parses the string only for rows not migrated yet."""
+    if stock.amount is not None:
+        return stock.amount, stock.unit
+    return QuantityParser.parse(stock.quantity)
+
+
+class StockNameIndex:
+    """
+    In-memory lookup over one kitchen's stock, loaded with a single query.
+    Names are compared in normalized form ("Tomatoes" == "tomato") and candidates
+    are ranked by similarity (see services/name_search.py).
+    """
+
+    def __init__(self, stocks: list):
+        self._stocks = [stock for stock in stocks if stock.item_name]
+        self._exact = {}
+        for stock in self._stocks:
+            self._exact.setdefault(stock.search_name or normalize_name(stock.item_name), stock)
+
+    @classmethod
+    def load(cls, db: Session, user_id: str, kitchen_id: str = None):
+        query = db.query(KitchenStock)
+        if kitchen_id:
+            query = query.filter(KitchenStock.kitchen_id == kitchen_id)
+        else:
+            query = query.filter(KitchenStock.user_id == user_id)
+        return cls(query.all())
+
+    def find(self, item_name: str):
+        stock = self._exact.get(normalize_name(item_name))
+        if stock:
+            return stock
+        matches = rank_candidates(item_name, self._stocks)
+        return matches[0][1] if matches else None
+
+    def add(self, stock):
+        """Make a row created in memory (not flushed yet) findable, e.g. a new item in a batch."""
+        self._stocks.append(stock)
+        self._exact.setdefault(stock.search_name or normalize_name(stock.item_name), stock)
+
+    def remove(self, stock):
+        self._stocks = [s for s in self._stocks if s is not stock]
+        self._exact = {name: s for name, s in self._exact.items() if s is not stock}
+        for other in self._stocks:
+            self._exact.setdefault(other.search_name or normalize_name(other.item_name), other)
+
+
+# Attempts for one meal log / stock add when it loses a race with another writer
+STOCK_WRITE_RETRIES = int(os.getenv("STOCK_WRITE_RETRIES", "10"))
+# "optimistic": versioned ORM writes, batched in one flush, retried on conflict.
+# "atomic": `amount = amount + delta` in the database (never retries on contention, 2 writes per row)
+STOCK_WRITE_MODE = os.getenv("STOCK_WRITE_MODE", "optimistic")
+EMPTY_EPSILON = 0.001
+# Rows per INSERT .. ON CONFLICT statement in add_stock_batch (keeps SQLite under its bound-parameter limit)
+UPSERT_CHUNK_SIZE = 500
+_UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+class StockConflict(Exception):
+    """A stock row was deleted or re-united by someone else between reading and writing it."""
+
+
+def _is_retryable(error: Exception):
+    if isinstance(error, (StaleDataError, StockConflict)):
+        return True
+    if isinstance(error, DBAPIError):
+        message = str(error.orig or error).lower()
+        # SQLite writer contention, Postgres deadlock / serialization failure
+        return "locked" in message or "deadlock" in message or "could not serialize" in message
+    return False
+
+
 class InventoryManager:
     def __init__(self, db: Session):
         self.db = db
+        self._events = []  # ledger rows of the current transaction, written by _commit
+
+    def _commit(self):
+        """Commit stock changes together with their ledger events."""
+        write_events(self.db, self._events)
+        self._events = []
+        self.db.commit()
+
+    def _with_retry(self, operation):
+        """Run operation() in a transaction, retrying with backoff if it lost a race."""
+        for attempt in range(STOCK_WRITE_RETRIES):
+            self._events = []
+            try:
+                return operation()
+            except Exception as e:
+                self.db.rollback()
+                if not _is_retryable(e) or attempt == STOCK_WRITE_RETRIES - 1:
+                    raise
+                print(f"Stock write conflict ({type(e).__name__}), retrying ({attempt + 1}/{STOCK_WRITE_RETRIES})")
+                time.sleep(random.uniform(0, min(0.5, 0.01 * 2 ** attempt)))
+
+    def _adjust_stock(self, stock: KitchenStock, delta: float, unit: str, mode: str = None,
+                      event_type: str = None, meal_id: str = None):
+        """
+        Add delta (in `unit`, the row's unit) to a stock row and return the new amount,
+        or None if the row was used up and deleted. The change actually applied is appended
+        to the stock ledger ("add"/"use" by default, or event_type).
+
+        optimistic: the row is changed in the session; the UPDATE/DELETE at flush checks
+        the row's version, so a concurrent change raises StaleDataError (-> retried).
+        atomic: rows with numeric columns get an immediate `amount = amount + delta` UPDATE,
+        so concurrent deductions can't overwrite each other.
+        """
+        mode = mode or STOCK_WRITE_MODE
+        # Built before the write: the atomic path expires `stock`
+        event = stock_event(stock, event_type or ("add" if delta > 0 else "use"), unit=unit, meal_id=meal_id)
+        self._events.append(event)
+        if mode != "atomic" or stock.amount is None or stock.unit != unit:
+            current, _ = stock_quantity(stock)
+            new_amount = current + delta
+            if new_amount <= EMPTY_EPSILON:
+                # Only what was there is recorded as used
+                event["amount"] = delta - new_amount
+                self.db.delete(stock)
+                return None
+            event["amount"] = delta
+            stock.set_amount(new_amount, unit)
+            return new_amount
+
+        stock_id = stock.stock_id
+        _, factor = QuantityParser.get_base_unit(unit)
+        stmt = (update(KitchenStock)
+                .where(KitchenStock.stock_id == stock_id, KitchenStock.unit == unit, KitchenStock.amount.isnot(None))
+                .values(amount=KitchenStock.amount + delta,
+                        base_amount=KitchenStock.base_amount + delta * factor,
+                        version=KitchenStock.version + 1,
+                        updated_at=datetime.utcnow())
+                .execution_options(synchronize_session=False))
+        if self.db.get_bind().dialect.update_returning:
+            new_amount = self.db.execute(stmt.returning(KitchenStock.amount)).scalar()
+        else:
+            result = self.db.execute(stmt)
+            new_amount = None if result.rowcount == 0 else self.db.execute(
+                select(KitchenStock.amount).where(KitchenStock.stock_id == stock_id)).scalar()
+        # Our in-session copy is stale now
+        self.db.expire(stock)
+        if new_amount is None:
+            raise StockConflict(f"Stock row {stock_id} changed concurrently")
+
+        # The row stays locked by our UPDATE until commit, so this follow-up write is safe
+        event["amount"] = delta - new_amount if new_amount <= EMPTY_EPSILON else delta
+        if new_amount <= EMPTY_EPSILON:
+            self.db.execute(delete(KitchenStock).where(KitchenStock.stock_id == stock_id)
+                            .execution_options(synchronize_session=False))
+            return None
+        self.db.execute(update(KitchenStock).where(KitchenStock.stock_id == stock_id)
+                        .values(quantity=QuantityParser.format(new_amount, unit))
+                        .execution_options(synchronize_session=False))
+        return new_amount
 
     def log_meal_and_deduct_stock(self, user_id: str, meal_name: str, ingredients_used: list, confidence: int = 100, 
                                   meal_type: str = "other", calories: int = None, protein_g: int = None, 
                                   carbs_g: int = None, fat_g: int = None, deduct_stock: bool = True, source: str = "manual", kitchen_id: str = None):
         """
         Logs a meal and optionally deducts ingredients from stock.
+        Safe for shared kitchens: deductions are applied in the database and the whole
+        log is retried if it raced with another writer.
         """
-        # 1. Log the Meal
+        return self._with_retry(lambda: self._log_meal_once(
+            user_id, meal_name, ingredients_used, confidence, meal_type, calories, protein_g,
+            carbs_g, fat_g, deduct_stock, source, kitchen_id))
+
+    def _log_meal_once(self, user_id, meal_name, ingredients_used, confidence, meal_type, calories,
+                       protein_g, carbs_g, fat_g, deduct_stock, source, kitchen_id):
+        # 1. Log the Meal (id set up front so its stock events can point at it)
         meal = Meal(
+            id=generate_uuid(),
             user_id=user_id,
             name=meal_name,
             ingredients_used=ingredients_used,
@@ -120,135 +357,385 @@ class InventoryManager:
             kitchen_id=kitchen_id
         )
         self.db.add(meal)
-        
-        deduction_report = []
 
         # 2. Deduct Stock (Only if cooked at home)
         if deduct_stock:
-            for ing in ingredients_used:
-                item_name = ing.get("item")
-                used_qty_raw = ing.get("qty")
-                
-                # Skip if critical data missing
-                if not item_name or not used_qty_raw:
-                    continue
-    
-                # normalize used qty
-                used_amount, used_unit = QuantityParser.parse(str(used_qty_raw))
-                if used_amount is None:
-                    print(f"Skipping deduction for {item_name}: Could not parse quantity {used_qty_raw}")
-                    continue
-    
-                # Find matching stock
-                # Improved fuzzy matching: Check if stock name is inside used name OR used name is inside stock name
-                # This handles "Tomato" vs "Tomatoes" and "Mozzarella Cheese" vs "Cheese"
-                
-                # Find Matching Stock
-                # Priority: search kitchen_id if provided, else user_id
-                query = self.db.query(KitchenStock)
-                if kitchen_id:
-                    query = query.filter(KitchenStock.kitchen_id == kitchen_id)
-                else:
-                    query = query.filter(KitchenStock.user_id == user_id)
+            deduction_report = self._deduct_ingredients(user_id, kitchen_id, ingredients_used, meal.id)
+        else:
+            deduction_report = ["Dining out: No stock deducted."]
 
-                # 1. Direct Partial Match (Stock contains "Tomato")
-                stock_item = query.filter(KitchenStock.item_name.ilike(f"%{item_name}%")).first()
-                
-                # 2. Reverse Partial Match (Used "Tomatoes" contains "Tomato" from stock)
-                if not stock_item:
-                    all_stocks = self.db.query(KitchenStock).filter(KitchenStock.user_id == user_id).all()
-                    for stock in all_stocks:
-                        if stock.item_name.lower() in item_name.lower():
-                            stock_item = stock
-                            break
-    
-                if stock_item:
-                    current_amount, current_unit = QuantityParser.parse(stock_item.quantity)
-                    
-                    if current_amount is not None:
-                        # Attempt conversion: used_unit -> current_unit
-                        converted_used_amount = QuantityParser.convert(used_amount, used_unit, current_unit)
-                        
-                        if converted_used_amount is not None:
-                            new_amount = current_amount - converted_used_amount
-                            
-                            if new_amount <= 0.001: # Epsilon for float compare
-                                # Item used up
-                                self.db.delete(stock_item)
-                                deduction_report.append(f"Used {item_name}: {QuantityParser.format(converted_used_amount, current_unit)} (Original: {used_qty_raw}). Stock depleted.")
-                            else:
-                                # Update quantity
-                                stock_item.quantity = QuantityParser.format(new_amount, current_unit)
-                                deduction_report.append(f"Used {item_name}: {QuantityParser.format(converted_used_amount, current_unit)} (Original: {used_qty_raw}). Remaining: {stock_item.quantity}")
-                        else:
-                            deduction_report.append(f"Unit mismatch for {item_name}: Stock has '{current_unit}', used '{used_unit}'. Cannot convert.")
+        # Meal insert plus all stock updates/deletes are committed together
+        self._commit()
+        return meal, deduction_report
+
+    def _deduct_ingredients(self, user_id, kitchen_id, ingredients_used, meal_id):
+        """Deduct a meal's ingredients from stock (no commit). Returns the deduction report."""
+        deduction_report = []
+        # One query for the whole meal; ingredients are matched in memory
+        stock_index = StockNameIndex.load(self.db, user_id, kitchen_id)
+        planned = []  # (report line, item name, raw qty, stock row, stock_id, amount in stock unit, stock unit)
+        for ing in ingredients_used:
+            item_name = ing.get("item")
+            used_qty_raw = ing.get("qty")
+
+            # Skip if critical data missing
+            if not item_name or not used_qty_raw:
+                continue
+
+            # normalize used qty
+            used_amount, used_unit = QuantityParser.parse(str(used_qty_raw))
+            if used_amount is None:
+                print(f"Skipping deduction for {item_name}: Could not parse quantity {used_qty_raw}")
+                continue
+
+            # Find matching stock ("Tomato" vs "Tomatoes", "Mozzarella Cheese" vs "Cheese")
+            stock_item = stock_index.find(item_name)
+
+            if stock_item:
+                current_amount, current_unit = stock_quantity(stock_item)
+
+                if current_amount is not None:
+                    # Attempt conversion: used_unit -> current_unit
+                    converted_used_amount = QuantityParser.convert(used_amount, used_unit, current_unit)
+
+                    if converted_used_amount is not None:
+                        planned.append((len(deduction_report), item_name, used_qty_raw, stock_item, stock_item.stock_id, converted_used_amount, current_unit))
+                        deduction_report.append(None)  # filled in once the deduction is applied
                     else:
-                        deduction_report.append(f"Could not parse stock quantity for {item_name} ('{stock_item.quantity}'). No deduction made.")
+                        deduction_report.append(f"Unit mismatch for {item_name}: Stock has '{current_unit}', used '{used_unit}'. Cannot convert.")
                 else:
-                    deduction_report.append(f"Item {item_name} not found in stock.")
-        else:
-            deduction_report.append("Dining out: No stock deducted.")
+                    deduction_report.append(f"Could not parse stock quantity for {item_name} ('{stock_item.quantity}'). No deduction made.")
+            else:
+                deduction_report.append(f"Item {item_name} not found in stock.")
 
-        self.db.commit()
-        return meal, deduction_report
+        # One write per stock row, in stock_id order so concurrent meals lock rows in the same order
+        # (the ORM flush also orders UPDATEs by primary key)
+        totals = {}
+        for _, _, _, stock_item, stock_id, used, unit in planned:
+            totals.setdefault(stock_id, [stock_item, unit, 0.0])[2] += used
+        remaining = {}
+        for stock_id in sorted(totals):
+            stock_item, unit, used = totals[stock_id]
+            remaining[stock_id] = self._adjust_stock(stock_item, -used, unit, meal_id=meal_id)
+
+        for line, item_name, used_qty_raw, _, stock_id, used, unit in planned:
+            left = remaining[stock_id]
+            used_str = QuantityParser.format(used, unit)
+            if left is None:
+                deduction_report[line] = f"Used {item_name}: {used_str} (Original: {used_qty_raw}). Stock depleted."
+            else:
+                deduction_report[line] = f"Used {item_name}: {used_str} (Original: {used_qty_raw}). Remaining: {QuantityParser.format(left, unit)}"
+        return deduction_report
+
+    def _restore_meal_stock(self, meal: Meal, usage: dict = None):
+        """
+        Give back what a meal took from stock, from its ledger events (no commit).
+        Rows that were used up since (by deductions) are recreated under their old id; rows
+        the user removed are left gone. Returns report lines.
+        usage: meal_usage(meal.id), if the caller already loaded it.
+        """
+        report = []
+        usage = meal_usage(self.db, meal.id) if usage is None else usage
+        held = {stock_id: entry for stock_id, entry in usage.items() if entry[0] < -EMPTY_EPSILON}
+        if not held:
+            return report
+        existing = {s.stock_id: s for s in self.db.query(KitchenStock).filter(KitchenStock.stock_id.in_(list(held)))}
+        latest = latest_events(self.db, [stock_id for stock_id in held if stock_id not in existing])
+
+        for stock_id in sorted(held):
+            used, unit, last_event = held[stock_id]
+            give_back = -used
+            stock = existing.get(stock_id)
+            if stock is None:
+                # Only a row that ran out through deductions comes back
+                gone = latest.get(stock_id, last_event).event_type
+                if gone != "use":
+                    reason = "item was removed" if gone == "remove" else "item is no longer in stock"
+                    report.append(f"{last_event.item_name}: not restored, {reason}.")
+                    continue
+                stock = KitchenStock(
+                    stock_id=stock_id,
+                    user_id=last_event.user_id,
+                    kitchen_id=last_event.kitchen_id,
+                    item_name=last_event.item_name,
+                    category=last_event.category,
+                    source="manual",
+                )
+                stock.set_amount(give_back, unit)
+                self.db.add(stock)
+                self._events.append(stock_event(stock, "restore", give_back, unit, meal_id=meal.id))
+                report.append(f"Restored {last_event.item_name}: {QuantityParser.format(give_back, unit)}.")
+                continue
+
+            current_amount, current_unit = stock_quantity(stock)
+            converted = QuantityParser.convert(give_back, unit, current_unit) if current_amount is not None else None
+            if converted is None:
+                report.append(f"Could not restore {stock.item_name}: stock is now '{stock.quantity}'.")
+                continue
+            name = stock.item_name
+            total = self._adjust_stock(stock, converted, current_unit, event_type="restore", meal_id=meal.id)
+            report.append(f"Restored {name}: {QuantityParser.format(converted, current_unit)} (Total: {QuantityParser.format(total, current_unit)}).")
+        return report
+
+    def delete_meal(self, meal: Meal, restore_stock: bool = True):
+        """Delete a meal log, giving its ingredients back to stock first. Returns the restore report."""
+        meal_id = meal.id
+
+        def operation():
+            current = self.db.query(Meal).filter(Meal.id == meal_id).first()
+            report = self._restore_meal_stock(current) if restore_stock else []
+            self.db.delete(current)
+            self._commit()
+            return report
+        return self._with_retry(operation)
+
+    def update_meal(self, meal: Meal, fields: dict, deduct_stock: bool = True):
+        """
+        Update a meal log. If its ingredients changed, or whether it should deduct stock, what
+        it still holds from stock is given back and (deduct_stock) the new ingredients are
+        deducted, in one transaction. A meal that holds no stock is deducted whenever
+        deduct_stock is set, except meals logged before the stock ledger started: their
+        deductions can't be given back, so deducting again would count them twice.
+        Returns (meal, report).
+        """
+        meal_id = meal.id
+
+        def operation():
+            current = self.db.query(Meal).filter(Meal.id == meal_id).first()
+            usage = meal_usage(self.db, meal_id)
+            # What the ledger says, not meal.source ("home" / "manual" / "dining_out" ...)
+            deducted = any(used < -EMPTY_EPSILON for used, _, _ in usage.values())
+            changed = (current.ingredients_used != fields.get("ingredients_used", current.ingredients_used)
+                       or deducted != deduct_stock)
+            if not usage and changed:
+                started = ledger_started_at(self.db)
+                changed = started is not None and current.created_at is not None and current.created_at >= started
+            for key, value in fields.items():
+                setattr(current, key, value)
+            report = []
+            if changed:
+                if usage:
+                    report = self._restore_meal_stock(current, usage)
+                if deduct_stock:
+                    report += self._deduct_ingredients(current.user_id, current.kitchen_id, current.ingredients_used, current.id)
+            self._commit()
+            return current, report
+        return self._with_retry(operation)
 
-    def add_stock(self, user_id: str, item_name: str, quantity_str: str, category: str = "other"):
+    def add_stock(self, user_id: str, item_name: str, quantity_str: str, category: str = "other", parsed: tuple = None):
         """
         Adds stock to the user's kitchen. Updates existing item if found (and units compatible),
         otherwise creates a new entry.
+        parsed: (amount, unit) if the caller already parsed quantity_str (e.g. via parse_many).
         """
+        return self._with_retry(lambda: self._add_stock_once(user_id, item_name, quantity_str, category, parsed))
+
+    def _add_stock_once(self, user_id, item_name, quantity_str, category, parsed):
         # 1. Parse quantity
-        add_amount, add_unit = QuantityParser.parse(quantity_str)
+        add_amount, add_unit = parsed or QuantityParser.parse(quantity_str)
         if add_amount is None:
             return f"Could not parse quantity '{quantity_str}' for {item_name}. Please interpret the quantity clearly (e.g. '2 kg', '500 g')."
 
-        # 2. Find existing stock (Fuzzy match similar to deduction)
-        # Check if stock name is inside used name OR used name is inside stock name
-        stock_item = self.db.query(KitchenStock).filter(
-            KitchenStock.user_id == user_id,
-            KitchenStock.item_name.ilike(f"%{item_name}%") 
-        ).first()
-        
-        if not stock_item:
-            all_stocks = self.db.query(KitchenStock).filter(KitchenStock.user_id == user_id).all()
-            for stock in all_stocks:
-                if stock.item_name.lower() in item_name.lower():
-                    stock_item = stock
-                    break
-        
-        action = "Created new"
+        # 2. Find existing stock (best ranked name match, e.g. "Tomatoes" -> "Tomato")
+        stock_item = find_stock_match(self.db, item_name, user_id=user_id)
         
         if stock_item:
             # Try to update existing
-            current_amount, current_unit = QuantityParser.parse(stock_item.quantity)
+            current_amount, current_unit = stock_quantity(stock_item)
             if current_amount is not None:
                 # Convert add_amount (add_unit) -> current_unit
                 converted_add_amount = QuantityParser.convert(add_amount, add_unit, current_unit)
                 
                 if converted_add_amount is not None:
-                    new_total = current_amount + converted_add_amount
-                    stock_item.quantity = QuantityParser.format(new_total, current_unit)
-                    action = "Updated"
-                    # Update name if the new name is more specific? No, keep original name for consistency.
+                    # Keep original name for consistency
+                    name = stock_item.item_name
+                    new_total = self._adjust_stock(stock_item, converted_add_amount, current_unit)
+                    self._commit()
+                    return f"Updated '{name}' (Total: {QuantityParser.format(new_total, current_unit)})."
+                # Incompatible units (e.g. user has '5 eggs', trying to add '200g eggs'): create a new entry
+
+        # Create new
+        stock_item = KitchenStock(
+            user_id=user_id,
+            item_name=item_name,
+            category=category,
+            source="manual_chat"
+        )
+        stock_item.set_amount(add_amount, add_unit)
+        self.db.add(stock_item)
+        self._events.append(stock_event(stock_item, "set"))
+
+        self._commit()
+        return f"Added '{stock_item.item_name}' (Total: {stock_item.quantity})."
+
+    def add_stock_batch(self, items: list):
+        """
+        Add many items (e.g. a scanned grocery bill) in one transaction.
+
+        items: dicts with item_name, quantity, and optionally user_id, kitchen_id, category,
+        expiry_date, source. Quantities are merged into matching stock rows the same way
+        add_stock does, but all matching happens in memory against one stock load per
+        kitchen/user, repeated lines are combined, and every row is written by a single
+        INSERT .. ON CONFLICT DO UPDATE per chunk (Postgres / SQLite).
+        Returns the affected stock rows as returned by the upsert (no re-query), detached
+        from the session.
+        """
+        return self._with_retry(lambda: self._add_stock_batch_once(items))
+
+    def _add_stock_batch_once(self, items):
+        parsed = QuantityParser.parse_many([item.get("quantity") for item in items])
+        indexes = {}
+        updates = {}   # stock_id -> [existing row, new amount in its unit, new expiry, amount before]
+        created = {}   # stock_id -> new KitchenStock, not in the session
+        touched = []   # stock_ids in first-touch order
+
+        for item, (amount, unit) in zip(items, parsed):
+            item_name = item.get("item_name")
+            if not item_name or amount is None:
+                print(f"Skipping batch item {item_name!r}: could not parse quantity {item.get('quantity')!r}")
+                continue
+            user_id, kitchen_id = item.get("user_id"), item.get("kitchen_id")
+            owner = (user_id, kitchen_id)
+            if owner not in indexes:
+                indexes[owner] = StockNameIndex.load(self.db, user_id, kitchen_id)
+            index = indexes[owner]
+
+            # Best match first; for a unit mismatch, a row of the same name created earlier in this batch
+            candidates = [index.find(item_name)]
+            candidates += [s for s in created.values()
+                           if s.search_name == normalize_name(item_name) and (s.user_id, s.kitchen_id) == owner]
+            target = None
+            for stock in candidates:
+                if stock is None:
+                    continue
+                if stock.stock_id in created:
+                    current_amount, current_unit = stock.amount, stock.unit
+                elif stock.stock_id in updates:
+                    current_amount, current_unit = updates[stock.stock_id][1], stock_quantity(stock)[1]
                 else:
-                    # Incompatible units (e.g. user has '5 eggs', trying to add '200g eggs')
-                    # Create new entry or append to name? 
-                    # Let's create a new entry to be safe, maybe refine later
-                    stock_item = None 
+                    current_amount, current_unit = stock_quantity(stock)
+                if current_amount is None:
+                    continue
+                converted = QuantityParser.convert(amount, unit, current_unit)
+                if converted is not None:
+                    target = stock
+                    break
+
+            if target is None:
+                # Incompatible units or a new item: create a new row
+                target = KitchenStock(
+                    stock_id=generate_uuid(),
+                    user_id=user_id,
+                    kitchen_id=kitchen_id,
+                    item_name=item_name,
+                    category=item.get("category") or "other",
+                    expiry_date=item.get("expiry_date"),
+                    source=item.get("source") or "manual",
+                )
+                target.set_amount(amount, unit)
+                created[target.stock_id] = target
+                index.add(target)
+                touched.append(target.stock_id)
+            elif target.stock_id in created:
+                target.set_amount(current_amount + converted, current_unit)
+                target.expiry_date = item.get("expiry_date") or target.expiry_date
             else:
-               stock_item = None
-
-        if not stock_item:
-            # Create new
-            stock_item = KitchenStock(
-                user_id=user_id,
-                item_name=item_name,
-                quantity=QuantityParser.format(add_amount, add_unit),
-                category=category,
-                source="manual_chat"
-            )
-            self.db.add(stock_item)
-            action = "Added"
+                entry = updates.get(target.stock_id)
+                if entry is None:
+                    entry = updates[target.stock_id] = [target, current_amount, target.expiry_date, current_amount]
+                    touched.append(target.stock_id)
+                entry[1] = current_amount + converted
+                entry[2] = item.get("expiry_date") or entry[2]
 
-        self.db.commit()
-        return f"{action} '{stock_item.item_name}' (Total: {stock_item.quantity})."
+        if not touched:
+            return []
+
+        now = datetime.utcnow()
+        rows = []
+        expected_versions = {}
+        for stock_id in touched:
+            if stock_id in created:
+                stock = created[stock_id]
+                amount, unit, expiry_date, version = stock.amount, stock.unit, stock.expiry_date, 1
+            else:
+                stock, amount, expiry_date, _ = updates[stock_id]
+                unit, version = stock_quantity(stock)[1], stock.version
+                expected_versions[stock_id] = version + 1
+            base_unit, factor = QuantityParser.get_base_unit(unit)
+            rows.append({
+                "stock_id": stock_id,
+                "user_id": stock.user_id,
+                "kitchen_id": stock.kitchen_id,
+                "item_name": stock.item_name,
+                "search_name": stock.search_name or normalize_name(stock.item_name),
+                "quantity": QuantityParser.format(amount, unit),
+                "amount": amount,
+                "unit": unit,
+                "base_amount": amount * factor,
+                "base_unit": base_unit,
+                "category": stock.category,
+                "expiry_date": expiry_date,
+                "source": stock.source,
+                "updated_at": now,
+                "version": version,
+            })
+
+        affected = {}
+        make_insert = _UPSERT_INSERTS.get(self.db.get_bind().dialect.name)
+        if make_insert is None:
+            # No native upsert: same merge, written through the ORM (still one transaction)
+            for stock_id in touched:
+                if stock_id in created:
+                    self.db.add(created[stock_id])
+                else:
+                    stock, amount, expiry_date, _ = updates[stock_id]
+                    stock.set_amount(amount, stock_quantity(stock)[1])
+                    stock.expiry_date = expiry_date
+                affected[stock_id] = created.get(stock_id) or updates[stock_id][0]
+        else:
+            for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+                stmt = make_insert(KitchenStock).values(rows[start:start + UPSERT_CHUNK_SIZE])
+                excluded = stmt.excluded
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[KitchenStock.stock_id],
+                    set_={
+                        "quantity": excluded.quantity,
+                        "amount": excluded.amount,
+                        "unit": excluded.unit,
+                        "base_amount": excluded.base_amount,
+                        "base_unit": excluded.base_unit,
+                        "expiry_date": excluded.expiry_date,
+                        "updated_at": excluded.updated_at,
+                        "version": KitchenStock.version + 1,
+                    },
+                    # Same check as a versioned ORM UPDATE: skip rows changed since we read them
+                    where=KitchenStock.version == excluded.version,
+                ).returning(KitchenStock)
+                for stock in self.db.scalars(stmt, execution_options={"populate_existing": True}):
+                    affected[stock.stock_id] = stock
+
+            # A row changed concurrently is skipped by the WHERE; one deleted meanwhile would be re-inserted
+            # with its old version. Either way the merge was based on stale data, so retry the batch.
+            for stock_id, version in expected_versions.items():
+                stock = affected.get(stock_id)
+                if stock is None or stock.version != version:
+                    raise StockConflict(f"Stock row {stock_id} changed during batch add")
+
+        # Ledger: new rows start with a checkpoint, restocks append the amount added
+        events = []
+        for row in rows:
+            stock_id = row["stock_id"]
+            if stock_id in created:
+                events.append(stock_event(created[stock_id], "set"))
+            else:
+                stock, amount, _, before = updates[stock_id]
+                events.append(stock_event(stock, "add", amount - before, row["unit"]))
+        self._events.extend(events)
+
+        # Hand the rows back fully loaded: detached, so the commit doesn't expire them
+        self.db.flush()
+        result = [affected[stock_id] for stock_id in touched]
+        for stock in result:
+            self.db.expunge(stock)
+        self._commit()
+        return result
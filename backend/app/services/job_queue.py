@@ -0,0 +1,306 @@
+import base64
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+# Durable queue for upload OCR jobs: Redis when REDIS_URL is set (the JobStore connection),
+# a local SQLite file otherwise. A reserved job stays invisible to other workers for the
+# visibility timeout; if its worker dies before ack/retry/fail, it becomes visible again
+# and is picked up by another worker (at-least-once delivery).
+UPLOAD_QUEUE_DB = os.getenv("UPLOAD_QUEUE_DB", "./upload_queue.db")
+VISIBILITY_TIMEOUT = int(os.getenv("UPLOAD_JOB_VISIBILITY_TIMEOUT", "300"))
+MAX_ATTEMPTS = int(os.getenv("UPLOAD_JOB_MAX_ATTEMPTS", "3"))
+RETRY_BASE_SECONDS = float(os.getenv("UPLOAD_JOB_RETRY_BASE_SECONDS", "5"))
+# Finished jobs kept for latency metrics
+LATENCY_SAMPLES = 500
+
+
+class QueuedJob:
+    """A job reserved by a worker. `token` identifies this reservation for ack/retry/fail."""
+
+    def __init__(self, job_id: str, payload: dict, data: bytes, attempts: int, enqueued_at: float,
+                 started_at: float, token: str):
+        self.job_id = job_id
+        self.payload = payload
+        self.data = data
+        self.attempts = attempts
+        self.enqueued_at = enqueued_at
+        self.started_at = started_at
+        self.token = token
+
+
+def retry_delay(attempts: int):
+    """Exponential backoff with jitter: ~base, 2*base, 4*base, ..."""
+    return RETRY_BASE_SECONDS * 2 ** (attempts - 1) + random.uniform(0, RETRY_BASE_SECONDS)
+
+
+def _percentiles(values: list):
+    if not values:
+        return {"p50": None, "p95": None, "max": None}
+    values = sorted(values)
+    return {
+        "p50": round(values[len(values) // 2], 1),
+        "p95": round(values[min(len(values) - 1, int(len(values) * 0.95))], 1),
+        "max": round(values[-1], 1),
+    }
+
+
+class SQLiteJobQueue:
+    backend = "sqlite"
+
+    def __init__(self, path: str = UPLOAD_QUEUE_DB):
+        self.path = path
+        self._local = threading.local()
+        self._created = False
+        self._create_lock = threading.Lock()
+        self.wakeup = threading.Event()  # set on enqueue so in-process workers don't wait for the next poll
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit; reserve() opens its own write transaction
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        if not self._created:
+            with self._create_lock:
+                if not self._created:
+                    conn.executescript("""
+                        CREATE TABLE IF NOT EXISTS upload_jobs (
+                            job_id TEXT PRIMARY KEY,
+                            payload TEXT NOT NULL,
+                            data BLOB,
+                            state TEXT NOT NULL,           -- ready | reserved | done | dead
+                            attempts INTEGER NOT NULL DEFAULT 0,
+                            token TEXT,
+                            enqueued_at REAL NOT NULL,
+                            available_at REAL NOT NULL,    -- ready: run at; reserved: visibility deadline
+                            started_at REAL,
+                            finished_at REAL,
+                            error TEXT
+                        );
+                        CREATE INDEX IF NOT EXISTS ix_upload_jobs_state_available ON upload_jobs (state, available_at);
+                        CREATE INDEX IF NOT EXISTS ix_upload_jobs_finished ON upload_jobs (finished_at);
+                    """)
+                    self._created = True
+        return conn
+
+    def enqueue(self, job_id: str, payload: dict, data: bytes = None):
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO upload_jobs (job_id, payload, data, state, enqueued_at, available_at) VALUES (?, ?, ?, 'ready', ?, ?)",
+            (job_id, json.dumps(payload), data, now, now),
+        )
+        self.wakeup.set()
+
+    def reserve(self, visibility_timeout: int = None):
+        """Claim the oldest runnable job (or one whose reservation expired). None if the queue is empty."""
+        conn = self._conn()
+        now = time.time()
+        token = uuid.uuid4().hex
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT job_id, payload, data, attempts, enqueued_at FROM upload_jobs "
+                "WHERE state IN ('ready', 'reserved') AND available_at <= ? ORDER BY available_at LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE upload_jobs SET state = 'reserved', attempts = attempts + 1, token = ?, "
+                "available_at = ?, started_at = ? WHERE job_id = ?",
+                (token, now + (visibility_timeout or VISIBILITY_TIMEOUT), now, row[0]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        job_id, payload, data, attempts, enqueued_at = row
+        return QueuedJob(job_id, json.loads(payload), data, attempts + 1, enqueued_at, now, token)
+
+    def _finish(self, job: QueuedJob, sql: str, params: tuple):
+        """Apply a state change if this worker still holds the reservation."""
+        cursor = self._conn().execute(sql + " WHERE job_id = ? AND token = ?", params + (job.job_id, job.token))
+        return cursor.rowcount == 1
+
+    def ack(self, job: QueuedJob):
+        now = time.time()
+        done = self._finish(job, "UPDATE upload_jobs SET state = 'done', data = NULL, token = NULL, finished_at = ?", (now,))
+        # Keep only recent finished jobs (metrics window)
+        self._conn().execute("DELETE FROM upload_jobs WHERE state = 'done' AND finished_at < ?", (now - 86400,))
+        return done
+
+    def retry(self, job: QueuedJob, delay: float, error: str = None):
+        return self._finish(job, "UPDATE upload_jobs SET state = 'ready', token = NULL, available_at = ?, error = ?",
+                            (time.time() + delay, error))
+
+    def fail(self, job: QueuedJob, error: str = None):
+        return self._finish(job, "UPDATE upload_jobs SET state = 'dead', data = NULL, token = NULL, finished_at = ?, error = ?",
+                            (time.time(), error))
+
+    def stats(self):
+        conn = self._conn()
+        now = time.time()
+        counts = dict(conn.execute(
+            "SELECT CASE WHEN state = 'ready' AND available_at > ? THEN 'delayed' ELSE state END, COUNT(*) "
+            "FROM upload_jobs GROUP BY 1", (now,)).fetchall())
+        oldest = conn.execute(
+            "SELECT MIN(available_at) FROM upload_jobs WHERE state = 'ready' AND available_at <= ?", (now,)).fetchone()[0]
+        samples = conn.execute(
+            "SELECT started_at - enqueued_at, finished_at - started_at FROM upload_jobs "
+            "WHERE state = 'done' ORDER BY finished_at DESC LIMIT ?", (LATENCY_SAMPLES,)).fetchall()
+        return {
+            "backend": self.backend,
+            "depth": counts.get("ready", 0),
+            "delayed": counts.get("delayed", 0),
+            "in_flight": counts.get("reserved", 0),
+            "dead": counts.get("dead", 0),
+            "oldest_ready_age_s": round(now - oldest, 1) if oldest else 0.0,
+            "wait_ms": _percentiles([wait * 1000 for wait, _ in samples]),
+            "run_ms": _percentiles([run * 1000 for _, run in samples]),
+        }
+
+
+class RedisJobQueue:
+    """
+    Keys (prefix queue:uploads):
+      :ready      ZSET job_id -> run-at time (delayed retries sit here with a future score)
+      :inflight   ZSET job_id -> visibility deadline
+      :job:<id>   HASH payload, data (base64), attempts, enqueued_at, token
+      :dead       LIST of failed jobs (JSON), :latency LIST of recent [wait_ms, run_ms]
+    """
+    backend = "redis"
+    prefix = "queue:uploads"
+
+    # Requeue expired reservations, then move the oldest runnable job to inflight
+    RESERVE_SCRIPT = """
+    local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, 100)
+    for _, id in ipairs(expired) do
+        redis.call('ZREM', KEYS[2], id)
+        redis.call('ZADD', KEYS[1], ARGV[1], id)
+    end
+    local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 1)
+    if #ids == 0 then return false end
+    local id = ids[1]
+    local key = KEYS[3] .. id
+    redis.call('ZREM', KEYS[1], id)
+    if redis.call('EXISTS', key) == 0 then return false end
+    redis.call('ZADD', KEYS[2], ARGV[2], id)
+    redis.call('HSET', key, 'token', ARGV[3])
+    redis.call('HINCRBY', key, 'attempts', 1)
+    return {id, unpack(redis.call('HMGET', key, 'payload', 'data', 'attempts', 'enqueued_at'))}
+    """
+
+    # ARGV: job_id, token, action (ack | retry | dead), run_at, error, latency sample, dead entry
+    FINISH_SCRIPT = """
+    if redis.call('HGET', KEYS[1], 'token') ~= ARGV[2] then return 0 end
+    redis.call('ZREM', KEYS[2], ARGV[1])
+    if ARGV[3] == 'retry' then
+        redis.call('HSET', KEYS[1], 'token', '', 'error', ARGV[5])
+        redis.call('ZADD', KEYS[3], ARGV[4], ARGV[1])
+        return 1
+    end
+    if ARGV[3] == 'dead' then
+        redis.call('LPUSH', KEYS[4], ARGV[7])
+        redis.call('LTRIM', KEYS[4], 0, 999)
+    else
+        redis.call('LPUSH', KEYS[5], ARGV[6])
+        redis.call('LTRIM', KEYS[5], 0, tonumber(ARGV[8]) - 1)
+    end
+    redis.call('DEL', KEYS[1])
+    return 1
+    """
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self.wakeup = threading.Event()
+        self._reserve = redis_client.register_script(self.RESERVE_SCRIPT)
+        self._finish_script = redis_client.register_script(self.FINISH_SCRIPT)
+
+    def _key(self, name: str):
+        return f"{self.prefix}:{name}"
+
+    def enqueue(self, job_id: str, payload: dict, data: bytes = None):
+        now = time.time()
+        pipe = self.redis.pipeline()
+        pipe.hset(self._key(f"job:{job_id}"), mapping={
+            "payload": json.dumps(payload),
+            "data": base64.b64encode(data).decode() if data is not None else "",
+            "attempts": 0,
+            "enqueued_at": now,
+        })
+        pipe.expire(self._key(f"job:{job_id}"), 86400)
+        pipe.zadd(self._key("ready"), {job_id: now})
+        pipe.execute()
+        self.wakeup.set()
+
+    def reserve(self, visibility_timeout: int = None):
+        now = time.time()
+        token = uuid.uuid4().hex
+        row = self._reserve(
+            keys=[self._key("ready"), self._key("inflight"), self._key("job:")],
+            args=[now, now + (visibility_timeout or VISIBILITY_TIMEOUT), token],
+        )
+        if not row:
+            return None
+        job_id, payload, data, attempts, enqueued_at = row
+        return QueuedJob(job_id, json.loads(payload), base64.b64decode(data) if data else None,
+                         int(attempts), float(enqueued_at), now, token)
+
+    def _finish(self, job: QueuedJob, action: str, run_at: float = 0, error: str = None):
+        now = time.time()
+        sample = json.dumps([round((job.started_at - job.enqueued_at) * 1000, 1), round((now - job.started_at) * 1000, 1)])
+        dead_entry = json.dumps({"job_id": job.job_id, "payload": job.payload, "error": error, "failed_at": now})
+        return bool(self._finish_script(
+            keys=[self._key(f"job:{job.job_id}"), self._key("inflight"), self._key("ready"),
+                  self._key("dead"), self._key("latency")],
+            args=[job.job_id, job.token, action, run_at, error or "", sample, dead_entry, LATENCY_SAMPLES],
+        ))
+
+    def ack(self, job: QueuedJob):
+        return self._finish(job, "ack")
+
+    def retry(self, job: QueuedJob, delay: float, error: str = None):
+        return self._finish(job, "retry", run_at=time.time() + delay, error=error)
+
+    def fail(self, job: QueuedJob, error: str = None):
+        return self._finish(job, "dead", error=error)
+
+    def stats(self):
+        now = time.time()
+        pipe = self.redis.pipeline()
+        pipe.zcount(self._key("ready"), "-inf", now)
+        pipe.zcount(self._key("ready"), f"({now}", "+inf")
+        pipe.zcard(self._key("inflight"))
+        pipe.llen(self._key("dead"))
+        pipe.zrangebyscore(self._key("ready"), "-inf", now, start=0, num=1, withscores=True)
+        pipe.lrange(self._key("latency"), 0, -1)
+        depth, delayed, in_flight, dead, oldest, samples = pipe.execute()
+        samples = [json.loads(sample) for sample in samples]
+        return {
+            "backend": self.backend,
+            "depth": depth,
+            "delayed": delayed,
+            "in_flight": in_flight,
+            "dead": dead,
+            "oldest_ready_age_s": round(now - oldest[0][1], 1) if oldest else 0.0,
+            "wait_ms": _percentiles([wait for wait, _ in samples]),
+            "run_ms": _percentiles([run for _, run in samples]),
+        }
+
+
+def create_job_queue():
+    from app.services.job_store import job_store
+    if job_store.redis:
+        return RedisJobQueue(job_store.redis)
+    return SQLiteJobQueue(UPLOAD_QUEUE_DB)
+
+
+# Singleton instance
+job_queue = create_job_queue()
@@ -1,10 +1,34 @@
 import os
 import json
+import asyncio
+import threading
 import redis
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Job updates are published here (Redis mode) so API processes can wake waiting clients
+STATUS_CHANNEL_PREFIX = "job-status:"
+FINISHED_STATUSES = ("completed", "error")
+
+
+class _Watcher:
+    """A client waiting (in an event loop) for the next update of one job."""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+        self.job = None
+
+    def notify(self, job):
+        # Called from worker / pub-sub threads
+        self.job = job
+        try:
+            self.loop.call_soon_threadsafe(self.event.set)
+        except RuntimeError:
+            pass  # loop already closed
+
+
 class JobStore:
     def __init__(self):
         self.redis_url = os.getenv("REDIS_URL")
@@ -25,6 +49,11 @@ class JobStore:
         # Fallback for local development if Redis fails or isn't set
         self._memory_store = {}
 
+        # Clients waiting for job updates: job_id -> set of _Watcher
+        self._watchers = {}
+        self._watchers_lock = threading.Lock()
+        self._listener = None
+
     def save_job(self, job_id, data):
         """
         Saves or updates a job. Data should be a dictionary.
@@ -32,12 +61,17 @@ class JobStore:
         """
         if self.redis:
             try:
+                payload = json.dumps(data)
+                pipe = self.redis.pipeline(transaction=False)
                 # Expiry: 1 hour (3600 seconds) to keep things clean
-                self.redis.setex(f"job:{job_id}", 3600, json.dumps(data))
+                pipe.setex(f"job:{job_id}", 3600, payload)
+                pipe.publish(f"{STATUS_CHANNEL_PREFIX}{job_id}", payload)
+                pipe.execute()
             except Exception as e:
                 print(f"Redis Error (Save): {e}")
         else:
             self._memory_store[job_id] = data
+            self._notify(job_id, dict(data))
 
     def get_job(self, job_id):
         """
@@ -55,9 +89,10 @@ class JobStore:
         else:
             return self._memory_store.get(job_id)
 
-    def update_status(self, job_id, status, result=None, error=None):
+    def update_status(self, job_id, status, result=None, error=None, **fields):
         """
         Helper to fetch, update status/data, and save back.
+        Extra keyword fields (e.g. attempt, retry_in) are stored on the job as well.
         """
         job = self.get_job(job_id)
         if not job:
@@ -65,12 +100,86 @@ class JobStore:
             job = {"created_at": 0} 
         
         job["status"] = status
+        # Bumped on every update; long-poll clients send the last revision they saw
+        job["revision"] = job.get("revision", 0) + 1
         if result is not None:
             job["data"] = result
         if error is not None:
             job["error"] = error
+        job.update(fields)
             
         self.save_job(job_id, job)
 
+    def _notify(self, job_id, job):
+        with self._watchers_lock:
+            watchers = list(self._watchers.get(job_id, ()))
+        for watcher in watchers:
+            watcher.notify(job)
+
+    def _on_message(self, message):
+        job_id = message["channel"][len(STATUS_CHANNEL_PREFIX):]
+        try:
+            self._notify(job_id, json.loads(message["data"]))
+        except ValueError:
+            pass
+
+    def _on_listener_error(self, e, pubsub, thread):
+        # Waiters fall back to re-reading the job when their timeout passes; the next
+        # waiter starts a new listener
+        print(f"Redis Error (Job status listener): {e}")
+        thread.stop()
+
+    def _ensure_listener(self):
+        """One pattern subscription per process (started on first use) serves every waiting client."""
+        if self._listener and self._listener.is_alive():
+            return
+        with self._watchers_lock:
+            if self._listener and self._listener.is_alive():
+                return
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.psubscribe(**{f"{STATUS_CHANNEL_PREFIX}*": self._on_message})
+            self._listener = pubsub.run_in_thread(sleep_time=1, daemon=True,
+                                                  exception_handler=self._on_listener_error)
+
+    async def wait_for_update(self, job_id, revision=None, timeout=25.0):
+        """
+        Waits until the job's revision is past `revision` (None: past the current one) or it
+        is finished, at most `timeout` seconds. Returns the job as then (None if unknown).
+        Updates are pushed by save_job: in-process in memory mode, Redis pub/sub otherwise.
+        The Redis calls run in a thread, so a slow Redis doesn't stall the event loop.
+        """
+        watcher = _Watcher()
+        with self._watchers_lock:
+            self._watchers.setdefault(job_id, set()).add(watcher)
+        try:
+            if self.redis:
+                try:
+                    await asyncio.to_thread(self._ensure_listener)
+                except Exception as e:
+                    print(f"Redis Error (Subscribe): {e}")
+            # Read after registering, so an update in between isn't missed
+            job = await asyncio.to_thread(self.get_job, job_id)
+            if job is None or job.get("status") in FINISHED_STATUSES:
+                return job
+            if revision is None:
+                revision = job.get("revision", 0)
+            deadline = watcher.loop.time() + timeout
+            while job.get("revision", 0) <= revision:
+                try:
+                    await asyncio.wait_for(watcher.event.wait(), max(0.0, deadline - watcher.loop.time()))
+                except asyncio.TimeoutError:
+                    return await asyncio.to_thread(self.get_job, job_id)
+                watcher.event.clear()
+                job = watcher.job
+                if job is None or job.get("status") in FINISHED_STATUSES:
+                    return job
+            return job
+        finally:
+            with self._watchers_lock:
+                watchers = self._watchers.get(job_id)
+                watchers.discard(watcher)
+                if not watchers:
+                    del self._watchers[job_id]
+
 # Singleton instance
 job_store = JobStore()
@@ -0,0 +1,210 @@
+import os
+import re
+from functools import lru_cache
+
+from sqlalchemy import text, func, or_
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.models.kitchen import KitchenStock
+
+# auto | trigram (Postgres pg_trgm) | fts (SQLite FTS5) | python (scan the kitchen in memory)
+NAME_SEARCH_BACKEND = os.getenv("STOCK_NAME_SEARCH", "auto")
+# Candidates below this score are not considered a match
+MIN_MATCH_SCORE = float(os.getenv("STOCK_NAME_MIN_SCORE", "0.45"))
+# Rows fetched from the index before ranking
+CANDIDATE_LIMIT = 50
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def stem(word: str):
+    """Very small plural stemmer: tomatoes -> tomato, onions -> onion, berries -> berry."""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith("oes"):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def normalize_name(name: str):
+    """'Fresh Tomatoes!' -> 'fresh tomato'. Stored in KitchenStock.search_name."""
+    return " ".join(stem(w) for w in _WORD_RE.findall((name or "").lower()))
+
+
+@lru_cache(maxsize=8192)
+def _trigrams(value: str):
+    grams = set()
+    for word in value.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+def similarity(a: str, b: str):
+    """Trigram similarity of two normalized names (same definition as pg_trgm)."""
+    ga, gb = _trigrams(a), _trigrams(b)
+    if not ga or not gb:
+        return 0.0
+    return len(ga & gb) / len(ga | gb)
+
+
+def match_score(query: str, candidate: str):
+    """
+    Score a normalized candidate name against a normalized query.
+    Exact names win, then whole-word containment either way ("tomato" vs "cherry tomato",
+    "mozzarella cheese" vs "cheese"), then plain trigram similarity.
+    """
+    if not query or not candidate:
+        return 0.0
+    if query == candidate:
+        return 2.0
+    score = similarity(query, candidate)
+    q_words, c_words = set(query.split()), set(candidate.split())
+    if q_words <= c_words or c_words <= q_words:
+        score += 0.5
+    return score
+
+
+def rank_candidates(name: str, stocks: list, min_score: float = None):
+    """[(score, stock)] best first, dropping anything below min_score."""
+    min_score = MIN_MATCH_SCORE if min_score is None else min_score
+    query = normalize_name(name)
+    scored = []
+    for stock in stocks:
+        score = match_score(query, stock.search_name or normalize_name(stock.item_name))
+        if score >= min_score:
+            scored.append((score, stock))
+    scored.sort(key=lambda pair: -pair[0])
+    return scored
+
+
+def _scoped(db: Session, user_id: str = None, kitchen_id: str = None):
+    query = db.query(KitchenStock)
+    if kitchen_id:
+        return query.filter(KitchenStock.kitchen_id == kitchen_id)
+    return query.filter(KitchenStock.user_id == user_id)
+
+
+class PythonNameSearch:
+    """Loads the kitchen's stock and ranks it in memory. Works on any database."""
+    name = "python"
+
+    def setup(self, engine: Engine):
+        return True
+
+    def candidates(self, db: Session, normalized: str, user_id: str = None, kitchen_id: str = None):
+        return _scoped(db, user_id, kitchen_id).all()
+
+
+class TrigramNameSearch:
+    """Postgres: GIN pg_trgm index on search_name, queried with the % and %> operators."""
+    name = "trigram"
+
+    def setup(self, engine: Engine):
+        with engine.connect() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_kitchen_stock_search_name_trgm "
+                "ON kitchen_stock USING gin (search_name gin_trgm_ops)"
+            ))
+            conn.commit()
+        return True
+
+    def candidates(self, db: Session, normalized: str, user_id: str = None, kitchen_id: str = None):
+        return (_scoped(db, user_id, kitchen_id)
+                .filter(or_(
+                    KitchenStock.search_name.op("%")(normalized),   # similar names
+                    KitchenStock.search_name.op("%>")(normalized),  # query matches a word run inside the name
+                ))
+                .order_by(func.similarity(KitchenStock.search_name, normalized).desc())
+                .limit(CANDIDATE_LIMIT).all())
+
+
+class FTSNameSearch:
+    """SQLite: FTS5 table over search_name, kept in sync with kitchen_stock by triggers."""
+    name = "fts"
+
+    def setup(self, engine: Engine):
+        statements = [
+            "CREATE VIRTUAL TABLE IF NOT EXISTS kitchen_stock_fts USING fts5(search_name, stock_id UNINDEXED)",
+            """CREATE TRIGGER IF NOT EXISTS kitchen_stock_fts_ai AFTER INSERT ON kitchen_stock BEGIN
+                 INSERT INTO kitchen_stock_fts (search_name, stock_id) VALUES (new.search_name, new.stock_id);
+               END""",
+            """CREATE TRIGGER IF NOT EXISTS kitchen_stock_fts_ad AFTER DELETE ON kitchen_stock BEGIN
+                 DELETE FROM kitchen_stock_fts WHERE stock_id = old.stock_id;
+               END""",
+            """CREATE TRIGGER IF NOT EXISTS kitchen_stock_fts_au AFTER UPDATE OF search_name ON kitchen_stock BEGIN
+                 DELETE FROM kitchen_stock_fts WHERE stock_id = old.stock_id;
+                 INSERT INTO kitchen_stock_fts (search_name, stock_id) VALUES (new.search_name, new.stock_id);
+               END""",
+        ]
+        try:
+            with engine.connect() as conn:
+                for statement in statements:
+                    conn.execute(text(statement))
+                # Rebuild if rows were written before the triggers existed
+                indexed = conn.execute(text("SELECT count(*) FROM kitchen_stock_fts")).scalar()
+                total = conn.execute(text("SELECT count(*) FROM kitchen_stock")).scalar()
+                if indexed != total:
+                    conn.execute(text("DELETE FROM kitchen_stock_fts"))
+                    conn.execute(text("INSERT INTO kitchen_stock_fts (search_name, stock_id) "
+                                      "SELECT search_name, stock_id FROM kitchen_stock"))
+                conn.commit()
+            return True
+        except Exception as e:
+            print(f"FTS5 name search unavailable: {e}")
+            return False
+
+    def candidates(self, db: Session, normalized: str, user_id: str = None, kitchen_id: str = None):
+        words = normalized.split()
+        if not words:
+            return []
+        # Any word as a prefix: "tomato" finds "cherry tomato", "cherry tomato" finds "tomato"
+        match = " OR ".join(f'"{w}"*' for w in words)
+        scope = "s.kitchen_id = :scope" if kitchen_id else "s.user_id = :scope"
+        ids = db.execute(
+            text("SELECT f.stock_id FROM kitchen_stock_fts f JOIN kitchen_stock s ON s.stock_id = f.stock_id "
+                 f"WHERE kitchen_stock_fts MATCH :match AND {scope} ORDER BY f.rank LIMIT :limit"),
+            {"match": match, "scope": kitchen_id or user_id, "limit": CANDIDATE_LIMIT},
+        ).scalars().all()
+        if not ids:
+            return []
+        return db.query(KitchenStock).filter(KitchenStock.stock_id.in_(ids)).all()
+
+
+_backend = PythonNameSearch()
+
+
+def setup_name_search(engine: Engine):
+    """Pick and prepare the search backend for this database. Call once at startup."""
+    global _backend
+    choice = NAME_SEARCH_BACKEND
+    if choice == "auto":
+        choice = {"postgresql": "trigram", "sqlite": "fts"}.get(engine.dialect.name, "python")
+
+    backend = {"trigram": TrigramNameSearch, "fts": FTSNameSearch}.get(choice, PythonNameSearch)()
+    try:
+        ready = backend.setup(engine)
+    except Exception as e:
+        print(f"Name search setup failed for '{backend.name}': {e}")
+        ready = False
+    _backend = backend if ready else PythonNameSearch()
+    print(f"Stock name search: {_backend.name}", flush=True)
+    return _backend
+
+
+def search_stock(db: Session, name: str, user_id: str = None, kitchen_id: str = None, limit: int = 5):
+    """Ranked [(score, stock)] matches for a name within a user's or kitchen's stock."""
+    normalized = normalize_name(name)
+    if not normalized or not (user_id or kitchen_id):
+        return []
+    return rank_candidates(name, _backend.candidates(db, normalized, user_id, kitchen_id))[:limit]
+
+
+def find_stock_match(db: Session, name: str, user_id: str = None, kitchen_id: str = None):
+    """Best matching stock item, or None."""
+    matches = search_stock(db, name, user_id, kitchen_id, limit=1)
+    return matches[0][1] if matches else None
@@ -1,11 +1,33 @@
 import base64
 import json
 import os
+import threading
+import openai
 from openai import OpenAI
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Max Vision calls in flight per process (upload workers share it)
+OCR_MAX_CONCURRENCY = int(os.getenv("OCR_MAX_CONCURRENCY", "4"))
+_vision_slots = threading.BoundedSemaphore(OCR_MAX_CONCURRENCY)
+
+# Errors worth retrying later (rate limits, timeouts, OpenAI outages)
+TRANSIENT_OPENAI_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+                           openai.InternalServerError)
+
+
+class TransientOCRError(Exception):
+    """The Vision call failed in a way that may succeed on retry."""
+
+
+def _vision_completion(client, **kwargs):
+    """chat.completions.create, limited to OCR_MAX_CONCURRENCY concurrent calls."""
+    with _vision_slots:
+        try:
+            return client.chat.completions.create(**kwargs)
+        except TRANSIENT_OPENAI_ERRORS as e:
+            raise TransientOCRError(str(e)) from e
 
 
 def encode_image(image_file):
@@ -14,6 +36,7 @@ def encode_image(image_file):
 def extract_items_from_image(image_bytes, mime_type="image/jpeg"):
     """
     Sends image to OpenAI Vision API and returns extracted items with confidence.
+    Raises TransientOCRError for rate limits / timeouts so the caller can retry.
     """
     base64_image = encode_image(image_bytes)
     
@@ -50,7 +73,8 @@ def extract_items_from_image(image_bytes, mime_type="image/jpeg"):
             return {"items": [], "confidence": 0, "error": "OPENAI_API_KEY not configured"}
 
         client = OpenAI(api_key=api_key)
-        response = client.chat.completions.create(
+        response = _vision_completion(
+            client,
             model="gpt-4o",
             messages=[
                 {
@@ -80,6 +104,8 @@ def extract_items_from_image(image_bytes, mime_type="image/jpeg"):
             
         return data
         
+    except TransientOCRError:
+        raise
     except Exception as e:
         print(f"Error in OpenAI Vision call: {e}")
         return {"items": [], "confidence": 0, "error": str(e)}
@@ -87,6 +113,7 @@ def extract_items_from_image(image_bytes, mime_type="image/jpeg"):
 def extract_meal_from_image(image_bytes, mime_type="image/jpeg"):
     """
     Analyzes a photo of a cooked meal to estimate name, ingredients, and nutrition.
+    Raises TransientOCRError for rate limits / timeouts so the caller can retry.
     """
     base64_image = encode_image(image_bytes)
     
@@ -123,7 +150,8 @@ def extract_meal_from_image(image_bytes, mime_type="image/jpeg"):
             return None
 
         client = OpenAI(api_key=api_key)
-        response = client.chat.completions.create(
+        response = _vision_completion(
+            client,
             model="gpt-4o",
             messages=[
                 {
@@ -145,6 +173,8 @@ def extract_meal_from_image(image_bytes, mime_type="image/jpeg"):
         content = response.choices[0].message.content
         content = content.replace("```json", "").replace("```", "").strip()
         return json.loads(content)
+    except TransientOCRError:
+        raise
     except Exception as e:
         print(f"Error in OpenAI Vision Meal Analysis: {e}")
         return None
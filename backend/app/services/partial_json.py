@@ -0,0 +1,100 @@
+import json
+
+
+class PartialJSONParser:
+    """
+    Incremental parser for a JSON object that arrives in fragments
+    (e.g. streamed tool-call arguments).
+
+    feed() scans only the new text and remembers the last "safe cut" - a prefix that
+    becomes valid JSON once the open containers are closed. snapshot() returns that
+    best-effort value, so complete fields show up as soon as they've streamed in:
+
+        '{"name": "Dal", "ingredients": [{"item": "Lentils", "qty"'
+        -> {"name": "Dal", "ingredients": [{"item": "Lentils"}]}
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.complete = False   # top-level value closed
+        self._pos = 0
+        self._stack = []        # open containers: "{" or "["
+        self._expect_key = []   # per open object: True while the next string is a key
+        self._in_string = False
+        self._escape = False
+        self._string_is_key = False
+        self._safe_end = 0      # buffer[:_safe_end] + _safe_closers parses
+        self._safe_closers = ""
+        self._cached = None
+        self._cached_at = None
+
+    def _mark_safe(self, end: int):
+        self._safe_end = end
+        self._safe_closers = "".join("}" if c == "{" else "]" for c in reversed(self._stack))
+
+    def feed(self, fragment: str):
+        if not fragment or self.complete:
+            return
+        self.buffer += fragment
+        buf = self.buffer
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if not self._string_is_key:
+                        self._mark_safe(i + 1)
+            elif ch == '"':
+                self._in_string = True
+                self._string_is_key = bool(self._stack) and self._stack[-1] == "{" and self._expect_key[-1]
+            elif ch in "{[":
+                self._stack.append(ch)
+                if ch == "{":
+                    self._expect_key.append(True)
+                self._mark_safe(i + 1)
+            elif ch in "}]":
+                if self._stack:
+                    if self._stack.pop() == "{":
+                        self._expect_key.pop()
+                self._mark_safe(i + 1)
+                if not self._stack:
+                    self.complete = True
+                    self._pos = i + 1
+                    return
+            elif ch == ",":
+                # Whatever came before the comma (numbers, literals) is complete
+                self._mark_safe(i)
+                if self._stack and self._stack[-1] == "{":
+                    self._expect_key[-1] = True
+            elif ch == ":":
+                if self._stack and self._stack[-1] == "{":
+                    self._expect_key[-1] = False
+            i += 1
+        self._pos = i
+
+    def snapshot(self):
+        """Best-effort value for what has streamed so far (None if nothing usable yet)."""
+        if self._cached_at == self._safe_end:
+            return self._cached
+        if self._safe_end == 0:
+            return None
+        try:
+            value = json.loads(self.buffer[:self._safe_end] + self._safe_closers)
+        except ValueError:
+            value = None
+        self._cached, self._cached_at = value, self._safe_end
+        return value
+
+    def result(self):
+        """Full parsed value once complete, else None."""
+        if not self.complete:
+            return None
+        try:
+            return json.loads(self.buffer)
+        except ValueError:
+            return None
@@ -0,0 +1,141 @@
+import asyncio
+import json
+import os
+import time
+
+# Try to use orjson for faster event encoding, but don't crash if it's missing (fallback to json)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Token frames are flushed when this much time has passed since the last flush...
+SSE_FLUSH_MS = int(os.getenv("CHAT_SSE_FLUSH_MS", "75"))
+# ...or when this many bytes of text are buffered. Set both to 0 for one frame per delta.
+SSE_FLUSH_BYTES = int(os.getenv("CHAT_SSE_FLUSH_BYTES", "256"))
+
+
+def sse_event(payload: dict):
+    """Encode one Server-Sent Event frame."""
+    if orjson:
+        return "data: " + orjson.dumps(payload).decode() + "\n\n"
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+class TokenCoalescer:
+    """
+    Merges streamed text deltas into fewer 'token' frames.
+
+    The first delta is always sent straight away (keeps time-to-first-token low);
+    after that text is buffered until flush_ms have passed or flush_bytes are buffered.
+    Callers must flush() before emitting any other event and at the end of the stream,
+    so ordering with status/action events is preserved.
+    """
+
+    def __init__(self, flush_ms: int = None, flush_bytes: int = None, clock=time.monotonic):
+        self.flush_ms = SSE_FLUSH_MS if flush_ms is None else flush_ms
+        self.flush_bytes = SSE_FLUSH_BYTES if flush_bytes is None else flush_bytes
+        self.clock = clock
+        self._parts = []
+        self._size = 0
+        self._last_flush = None
+
+    def push(self, text: str):
+        """Buffer a delta. Returns an encoded frame if it's time to flush, else None."""
+        if not text:
+            return None
+        self._parts.append(text)
+        self._size += len(text.encode())
+
+        now = self.clock()
+        if self._last_flush is None:
+            return self.flush(now)
+        if self.flush_ms <= 0 and self.flush_bytes <= 0:
+            return self.flush(now)
+        if self.flush_bytes > 0 and self._size >= self.flush_bytes:
+            return self.flush(now)
+        if self.flush_ms > 0 and (now - self._last_flush) * 1000 >= self.flush_ms:
+            return self.flush(now)
+        return None
+
+    def flush(self, now: float = None):
+        """Returns a frame with everything buffered, or None if the buffer is empty."""
+        if not self._parts:
+            return None
+        content = "".join(self._parts)
+        self._parts = []
+        self._size = 0
+        self._last_flush = self.clock() if now is None else now
+        return sse_event({'type': 'token', 'content': content})
+
+
+# Hard wall-clock limit for one chat response (both completion rounds + tools)
+CHAT_DEADLINE_SECONDS = float(os.getenv("CHAT_DEADLINE_SECONDS", "90"))
+# How often the client connection is checked while streaming
+DISCONNECT_POLL_SECONDS = 0.25
+
+
+class StreamGuard:
+    """
+    Tells a long-running stream when to stop early: the client disconnected or the
+    per-request deadline passed. `reason` is set to "disconnected" or "deadline".
+    """
+
+    def __init__(self, is_disconnected=None, deadline_seconds: float = None, clock=time.monotonic):
+        self._is_disconnected = is_disconnected  # e.g. starlette Request.is_disconnected
+        self.clock = clock
+        self.deadline = clock() + (CHAT_DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds)
+        self._last_poll = None
+        self.reason = None
+
+    def remaining(self):
+        return max(0.0, self.deadline - self.clock())
+
+    async def should_stop(self):
+        if self.reason:
+            return True
+        now = self.clock()
+        if now >= self.deadline:
+            self.reason = "deadline"
+            return True
+        if self._is_disconnected and (self._last_poll is None or now - self._last_poll >= DISCONNECT_POLL_SECONDS):
+            self._last_poll = now
+            if await self._is_disconnected():
+                self.reason = "disconnected"
+                return True
+        return False
+
+    async def wait(self, awaitable):
+        """
+        Await upstream work (e.g. opening a completion stream), waking every
+        DISCONNECT_POLL_SECONDS so a stalled call can't outlive the deadline or a gone client.
+        Returns None if the guard stopped first (the work is cancelled).
+        """
+        task = asyncio.ensure_future(awaitable)
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=min(DISCONNECT_POLL_SECONDS, self.remaining()))
+                if done:
+                    return task.result()
+                if await self.should_stop():
+                    return None
+        finally:
+            if not task.done():
+                task.cancel()
+
+    async def iterate(self, stream):
+        """
+        Chunks of an upstream stream, ending early when the guard stops, including while
+        the upstream stalls between chunks. stream may be None (wait() stopped before it opened).
+        """
+        if stream is None:
+            return
+        iterator = stream.__aiter__()
+        while True:
+            try:
+                chunk = await self.wait(iterator.__anext__())
+            except StopAsyncIteration:
+                return
+            if chunk is None:
+                return
+            yield chunk
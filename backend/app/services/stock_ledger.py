@@ -0,0 +1,198 @@
+import asyncio
+import os
+
+from sqlalchemy import select, func, and_
+from sqlalchemy.orm import Session
+
+from app.db import session_scope
+from app.models.kitchen import KitchenStock, StockEvent, generate_uuid
+
+# kitchen_stock is the snapshot every read uses; stock_events is the append-only history
+# behind it. Each change to a stock row appends one event in the same transaction:
+#   set      checkpoint: the row's whole quantity (created, edited by hand, periodic checkpoint)
+#   add      amount added (restock, bill)
+#   use      amount a meal took (meal_id set)
+#   restore  amount given back when a meal is deleted or edited (meal_id set)
+#   remove   row deleted by hand
+# Replaying a row = its latest set/remove event plus the changes after it.
+CHECKPOINT_TYPES = ("set", "remove")
+# Write a fresh checkpoint for rows with at least this many events since their last one
+STOCK_CHECKPOINT_EVERY = int(os.getenv("STOCK_CHECKPOINT_EVERY", "50"))
+# Run checkpointing from the API process every N hours (0 = only via checkpoint_stock_ledger.py)
+CHECKPOINT_INTERVAL_HOURS = float(os.getenv("STOCK_CHECKPOINT_INTERVAL_HOURS", "0"))
+
+
+def stock_event(stock: KitchenStock, event_type: str, amount: float = None, unit: str = None, meal_id: str = None):
+    """
+    Ledger row (dict of stock_events columns) for a change to a stock row, written later by
+    write_events. A "set" event records the row's current quantity.
+    """
+    if stock.stock_id is None:
+        # Rows get their id at flush; the event needs it now
+        stock.stock_id = generate_uuid()
+    if event_type == "set":
+        amount, unit = stock.amount, stock.unit
+    elif event_type == "remove":
+        unit = stock.unit
+    return {
+        "stock_id": stock.stock_id,
+        "user_id": stock.user_id,
+        "kitchen_id": stock.kitchen_id,
+        "item_name": stock.item_name,
+        "category": stock.category,
+        "event_type": event_type,
+        "amount": amount,
+        "unit": unit,
+        "quantity": stock.quantity if event_type == "set" else None,
+        "meal_id": meal_id,
+    }
+
+
+def write_events(db: Session, events: list):
+    """Append ledger rows in one executemany INSERT (table-level: no RETURNING, no per-row split)."""
+    if events:
+        db.execute(StockEvent.__table__.insert(), events)
+
+
+def record_event(db: Session, stock: KitchenStock, event_type: str, amount: float = None, unit: str = None,
+                 meal_id: str = None):
+    write_events(db, [stock_event(stock, event_type, amount, unit, meal_id)])
+
+
+def _convert(amount, from_unit, to_unit):
+    from app.services.inventory import QuantityParser
+    return QuantityParser.convert(amount, from_unit, to_unit)
+
+
+def replay(db: Session, stock_ids: list = None):
+    """
+    Rebuild quantities from the ledger: {stock_id: (amount, unit)}, starting at each row's
+    latest checkpoint. amount is 0 for rows used up or removed, None if never parsed.
+    Rows without a checkpoint (no history) are left out.
+    """
+    checkpoints = (select(StockEvent.stock_id, func.max(StockEvent.id).label("since"))
+                   .where(StockEvent.event_type.in_(CHECKPOINT_TYPES))
+                   .group_by(StockEvent.stock_id))
+    if stock_ids is not None:
+        checkpoints = checkpoints.where(StockEvent.stock_id.in_(stock_ids))
+    checkpoints = checkpoints.subquery()
+    events = (select(StockEvent.stock_id, StockEvent.event_type, StockEvent.amount, StockEvent.unit)
+              .join(checkpoints, and_(StockEvent.stock_id == checkpoints.c.stock_id,
+                                      StockEvent.id >= checkpoints.c.since))
+              .order_by(StockEvent.stock_id, StockEvent.id))
+
+    state = {}
+    for stock_id, event_type, amount, unit in db.execute(events).yield_per(1000):
+        if event_type == "set":
+            state[stock_id] = (amount, unit)
+        elif event_type == "remove":
+            state[stock_id] = (0.0, unit)
+        else:
+            current, current_unit = state[stock_id]
+            converted = _convert(amount, unit, current_unit) if current is not None else None
+            if converted is not None:
+                state[stock_id] = (current + converted, current_unit)
+    return state
+
+
+def meal_usage(db: Session, meal_id: str):
+    """
+    What a meal still holds from stock: {stock_id: (amount, unit, last event)} where amount
+    is the net of its "use" and "restore" events (negative = not given back yet).
+    """
+    usage = {}
+    events = (db.query(StockEvent)
+              .filter(StockEvent.meal_id == meal_id, StockEvent.event_type.in_(("use", "restore")))
+              .order_by(StockEvent.id))
+    for event in events:
+        amount, unit, _ = usage.get(event.stock_id, (0.0, event.unit, None))
+        converted = _convert(event.amount or 0.0, event.unit, unit)
+        usage[event.stock_id] = (amount + (converted or 0.0), unit, event)
+    return usage
+
+
+def latest_events(db: Session, stock_ids: list):
+    """Each row's most recent ledger event: {stock_id: StockEvent}."""
+    if not stock_ids:
+        return {}
+    latest = (select(func.max(StockEvent.id))
+              .where(StockEvent.stock_id.in_(stock_ids))
+              .group_by(StockEvent.stock_id))
+    return {event.stock_id: event for event in db.query(StockEvent).filter(StockEvent.id.in_(latest))}
+
+
+def ledger_started_at(db: Session):
+    """When the first ledger event was written (None if there is none): older meals have no history."""
+    return db.query(StockEvent.created_at).order_by(StockEvent.id).limit(1).scalar()
+
+
+def verify_ledger(db: Session, epsilon: float = 0.001):
+    """Compare every stock row with its replayed quantity. Returns a list of mismatches."""
+    replayed = replay(db)
+    mismatches = []
+    for stock in db.query(KitchenStock).yield_per(1000):
+        expected = replayed.pop(stock.stock_id, None)
+        if expected is None:
+            mismatches.append({"stock_id": stock.stock_id, "item_name": stock.item_name,
+                               "snapshot": stock.quantity, "ledger": None})
+            continue
+        amount, unit = expected
+        if amount is None and stock.amount is None:
+            continue
+        converted = _convert(amount, unit, stock.unit) if amount is not None and stock.amount is not None else None
+        if converted is None or abs(converted - stock.amount) > epsilon:
+            mismatches.append({"stock_id": stock.stock_id, "item_name": stock.item_name,
+                               "snapshot": stock.quantity, "ledger": (amount, unit)})
+    # Rows the ledger still holds but the snapshot lost (used up rows are deleted at ~0)
+    for stock_id, (amount, unit) in replayed.items():
+        if amount is not None and amount > epsilon:
+            mismatches.append({"stock_id": stock_id, "item_name": None, "snapshot": None, "ledger": (amount, unit)})
+    return mismatches
+
+
+def checkpoint_ledger(db: Session, min_events: int = None):
+    """
+    Append a "set" checkpoint for rows with min_events or more events since their last one,
+    so replays only read recent history. Returns the number of checkpoints written.
+    """
+    min_events = STOCK_CHECKPOINT_EVERY if min_events is None else min_events
+    last = (select(StockEvent.stock_id, func.max(StockEvent.id).label("since"))
+            .where(StockEvent.event_type.in_(CHECKPOINT_TYPES))
+            .group_by(StockEvent.stock_id).subquery())
+    busy = (select(StockEvent.stock_id)
+            .outerjoin(last, StockEvent.stock_id == last.c.stock_id)
+            .where((last.c.since.is_(None)) | (StockEvent.id > last.c.since))
+            .group_by(StockEvent.stock_id)
+            .having(func.count(StockEvent.id) >= min_events))
+    # Row locks keep a concurrent deduction from landing between reading and checkpointing (Postgres)
+    stocks = db.query(KitchenStock).filter(KitchenStock.stock_id.in_(busy)).with_for_update().all()
+    write_events(db, [stock_event(stock, "set") for stock in stocks])
+    db.commit()
+    return len(stocks)
+
+
+def checkpoint_missing(db: Session):
+    """Checkpoint rows that have no ledger history yet (rows created before the ledger existed)."""
+    has_events = select(StockEvent.stock_id).where(StockEvent.event_type.in_(CHECKPOINT_TYPES))
+    stocks = db.query(KitchenStock).filter(KitchenStock.stock_id.not_in(has_events)).with_for_update().all()
+    write_events(db, [stock_event(stock, "set") for stock in stocks])
+    db.commit()
+    return len(stocks)
+
+
+def _checkpoint_once():
+    with session_scope() as db:
+        return checkpoint_ledger(db)
+
+
+async def run_checkpoint_loop(interval_hours: float = None):
+    """Periodic ledger checkpoints for deployments without a separate cron job."""
+    interval = (interval_hours or CHECKPOINT_INTERVAL_HOURS) * 3600
+    while True:
+        try:
+            written = await asyncio.to_thread(_checkpoint_once)
+            if written:
+                print(f"Stock ledger: wrote {written} checkpoints", flush=True)
+        except Exception as e:
+            print(f"Stock ledger checkpoint failed: {e}", flush=True)
+        await asyncio.sleep(interval)
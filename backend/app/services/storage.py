@@ -25,9 +25,10 @@ class StorageService:
              self.supabase = None
              print("StorageService initialized in OFFLINE mode (Supabase unavailable).")
 
-    def upload_file(self, file_content: bytes, filename: str, content_type: str):
+    def upload_file(self, file_content, filename: str, content_type: str):
         """
-        Uploads a file to Supabase Storage and returns the public URL.
+        Uploads a file (bytes, or the path of a local file, which the client streams)
+        to Supabase Storage and returns the public URL.
         """
         if not self.supabase:
             raise ImportError("Supabase client is not available.")
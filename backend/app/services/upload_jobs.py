@@ -0,0 +1,250 @@
+import json
+import os
+import threading
+import traceback
+
+from sqlalchemy.exc import OperationalError
+
+from app.db import SessionLocal
+from app.models.kitchen import User, Uploads
+from app.services.inventory import QuantityParser
+from app.services.job_queue import job_queue, retry_delay, MAX_ATTEMPTS
+from app.services.job_store import job_store
+from app.services.image_prep import preprocess_for_ocr, perceptual_hash, hash_distance
+from app.services.ocr import extract_items_from_image, extract_meal_from_image, TransientOCRError
+from app.services.upload_spool import hash_upload, read_upload, discard, sweep_spool
+
+# "inline": the API process runs the workers (threads, separate from the request threadpool)
+# "external": the API only enqueues; run `python upload_worker.py` (job status must be shared, i.e. REDIS_URL)
+UPLOAD_WORKER_MODE = os.getenv("UPLOAD_WORKER_MODE", "inline")
+# Jobs processed at the same time per worker process (Vision calls are further capped by OCR_MAX_CONCURRENCY)
+UPLOAD_WORKER_CONCURRENCY = int(os.getenv("UPLOAD_WORKER_CONCURRENCY", "4"))
+UPLOAD_WORKER_POLL_SECONDS = float(os.getenv("UPLOAD_WORKER_POLL_SECONDS", "1"))
+
+# Uploads of a file already processed (same sha256 and upload type) reuse its extraction:
+# no Vision call, no second copy in storage
+UPLOAD_DEDUP = os.getenv("UPLOAD_DEDUP", "1") == "1"
+# Also match re-encoded/resized copies of the user's recent uploads by perceptual hash
+UPLOAD_DEDUP_PERCEPTUAL = os.getenv("UPLOAD_DEDUP_PERCEPTUAL", "0") == "1"
+UPLOAD_DEDUP_MAX_DISTANCE = int(os.getenv("UPLOAD_DEDUP_MAX_DISTANCE", "4"))  # bits out of 64
+UPLOAD_DEDUP_CANDIDATES = 200
+
+# Failures worth another attempt; anything else fails the job right away
+RETRYABLE_ERRORS = (TransientOCRError, OperationalError)
+
+
+def _reusable(extracted_data, upload_type: str):
+    """Only reuse extractions that found something; an empty result is worth a fresh try."""
+    if upload_type == "meal":
+        return bool(extracted_data)
+    return isinstance(extracted_data, dict) and bool(extracted_data.get("items"))
+
+
+def find_cached_upload(db, user_id: str, upload_type: str, content_hash: str, perceptual_hash: str = None):
+    """
+    Earlier upload of the same image whose extraction can be reused, or None.
+    Exact matches (same bytes) come from any user, the user's own first (only the extracted
+    JSON is shared across users, never the stored file); perceptual matches only from the
+    same user's recent uploads, since "looks alike" isn't "is the same receipt".
+    """
+    uploads = db.query(Uploads).filter(Uploads.upload_type == f"{upload_type}_ocr",
+                                       Uploads.extracted_json.isnot(None))
+    exact = (uploads.filter(Uploads.content_hash == content_hash)
+             .order_by((Uploads.user_id == user_id).desc(), Uploads.created_at.desc()).first())
+    if exact and _reusable(json.loads(exact.extracted_json), upload_type):
+        return exact
+    if not perceptual_hash:
+        return None
+
+    candidates = (uploads.filter(Uploads.user_id == user_id, Uploads.perceptual_hash.isnot(None))
+                  .order_by(Uploads.created_at.desc()).limit(UPLOAD_DEDUP_CANDIDATES).all())
+    best, best_distance = None, UPLOAD_DEDUP_MAX_DISTANCE + 1
+    for upload in candidates:
+        distance = hash_distance(perceptual_hash, upload.perceptual_hash)
+        if distance < best_distance and _reusable(json.loads(upload.extracted_json), upload_type):
+            best, best_distance = upload, distance
+    return best
+
+
+def _save_upload(db, user_id: str, upload_type: str, file_url: str, extracted_json: str,
+                 content_hash: str, perceptual_hash: str):
+    user = db.query(User).filter(User.user_id == user_id).first()
+    if not user:
+        user = User(user_id=user_id, name="Default User")
+        db.add(user)
+        db.commit()
+
+    new_upload = Uploads(
+        user_id=user_id,
+        file_url=file_url,
+        upload_type=f"{upload_type}_ocr",
+        extracted_json=extracted_json,
+        content_hash=content_hash,
+        perceptual_hash=perceptual_hash,
+    )
+    db.add(new_upload)
+    db.commit()
+
+
+def _extract(job_id: str, source, upload_type: str, content_type: str):
+    """Vision extraction for an upload (raises if the model call fails)."""
+    print(f"[Job {job_id}] Calling OpenAI Vision...")
+    extracted_data = None
+    # Vision gets a downscaled/re-encoded copy; storage keeps the original
+    image, image_type = preprocess_for_ocr(source, content_type, upload_type)
+
+    if upload_type == "meal":
+        with read_upload(image) as image_data:
+            extracted_data = extract_meal_from_image(image_data, mime_type=image_type)
+        if not extracted_data:
+             raise Exception("AI Extraction failed. Could not identify meal.")
+    else:
+        with read_upload(image) as image_data:
+            extracted_data = extract_items_from_image(image_data, mime_type=image_type)
+        # If "error" key exists in dict, it means OpenAI failed hard
+        if isinstance(extracted_data, dict) and extracted_data.get("error"):
+             raise Exception(f"AI Error: {extracted_data['error']}")
+        # Attach parsed amounts so the review screen / batch add don't have to re-parse
+        items = (extracted_data.get("items") or []) if isinstance(extracted_data, dict) else []
+        parsed = QuantityParser.parse_many([item.get("quantity") for item in items])
+        for item, (amount, unit) in zip(items, parsed):
+            item["amount"], item["unit"] = amount, unit
+
+    print(f"[Job {job_id}] OpenAI Result: {extracted_data}")
+    return extracted_data
+
+
+def process_upload(job_id: str, source, user_id: str, upload_type: str, filename: str, content_type: str,
+                   content_hash: str = None):
+    """
+    Run OCR on an uploaded image, store the file and the Uploads record. Returns the extracted data.
+    source is the spooled file's path (or the bytes, for jobs queued before spooling).
+    """
+    db = SessionLocal()
+    try:
+        # 1. Same image seen before? Reuse its extraction (and the file, if it's this user's)
+        content_hash = content_hash or hash_upload(source)
+        phash = perceptual_hash(source) if UPLOAD_DEDUP_PERCEPTUAL else None
+        cached = find_cached_upload(db, user_id, upload_type, content_hash, phash) if UPLOAD_DEDUP else None
+
+        # 2. Process with OpenAI Vision
+        if cached:
+            print(f"[Job {job_id}] Duplicate of upload {cached.upload_id}, reusing its extraction")
+            extracted_data = json.loads(cached.extracted_json)
+        else:
+            extracted_data = _extract(job_id, source, upload_type, content_type)
+
+        # REMOVED: strict empty check. We now allow empty results (0 items found).
+
+        # 3. Upload to Supabase Storage
+        if cached and cached.user_id == user_id:
+            public_url = cached.file_url
+        else:
+            # Another user's stored object stays theirs (their record, their deletion)
+            print(f"[Job {job_id}] Uploading to Supabase Storage...")
+            public_url = f"local://{filename}" # Default fallback
+            try:
+                 # Lazy import inside try block
+                from app.services.storage import storage_service
+                public_url = storage_service.upload_file(source, filename, content_type)
+                print(f"[Job {job_id}] File uploaded successfully. URL: {public_url}")
+            except Exception as e:
+                print(f"[Job {job_id}] Failed to upload to Supabase: {e}")
+                public_url = f"local://{filename}"
+
+        # 4. Save Upload Record
+        print(f"[Job {job_id}] Saving to DB...")
+        _save_upload(db, user_id, upload_type, public_url, json.dumps(extracted_data), content_hash, phash)
+        print(f"[Job {job_id}] Transaction committed.")
+        return extracted_data
+    finally:
+        db.close()
+
+
+def handle_job(job, queue=None):
+    """Process one reserved job: ack on success, retry with backoff on transient errors, else fail."""
+    queue = queue or job_queue
+    p = job.payload
+
+    def fail(error: str, message: str = None):
+        if queue.fail(job, error):
+            discard(p.get("path"))
+        job_store.update_status(job.job_id, "error", error=message or error)
+
+    if job.attempts > MAX_ATTEMPTS:
+        # Its worker kept dying (reservation expired each time)
+        fail("Too many attempts", "Processing failed repeatedly. Please try again.")
+        return
+
+    print(f"[Job {job.job_id}] Starting processing for {p['user_id']} (attempt {job.attempts}/{MAX_ATTEMPTS})")
+    job_store.update_status(job.job_id, "processing", attempt=job.attempts)
+    try:
+        result = process_upload(job.job_id, p.get("path") or job.data, p["user_id"], p["upload_type"],
+                                p["filename"], p["content_type"], p.get("content_hash"))
+    except RETRYABLE_ERRORS as e:
+        if job.attempts < MAX_ATTEMPTS:
+            delay = retry_delay(job.attempts)
+            print(f"[Job {job.job_id}] Transient error ({e}), retrying in {delay:.0f}s")
+            queue.retry(job, delay, str(e))
+            job_store.update_status(job.job_id, "pending", attempt=job.attempts, retry_in=round(delay))
+            return
+        print(f"[Job {job.job_id}] Error after {job.attempts} attempts: {e}")
+        fail(str(e))
+        return
+    except Exception as e:
+        traceback.print_exc()
+        print(f"[Job {job.job_id}] Error: {e}")
+        fail(str(e))
+        return
+
+    # Update Job Status
+    job_store.update_status(job.job_id, "completed", result=result)
+    if queue.ack(job):
+        discard(p.get("path"))
+    else:
+        # Another worker holds the job now and still needs the file
+        print(f"[Job {job.job_id}] Reservation expired before ack; the job may run again")
+
+
+class UploadWorker:
+    """Pulls upload jobs from the queue with a fixed number of threads."""
+
+    def __init__(self, concurrency: int = None, queue=None):
+        self.concurrency = concurrency or UPLOAD_WORKER_CONCURRENCY
+        self.queue = queue or job_queue
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        removed = sweep_spool()
+        if removed:
+            print(f"Upload spool: removed {removed} stale files", flush=True)
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self._run, name=f"upload-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"Upload worker started: {self.concurrency} threads, {self.queue.backend} queue", flush=True)
+
+    def stop(self, timeout: float = 30):
+        """Stop taking jobs and wait for the running ones to finish."""
+        self._stop.set()
+        self.queue.wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self.queue.reserve()
+            except Exception as e:
+                print(f"Upload queue error: {e}", flush=True)
+                job = None
+            if job is None:
+                # Idle: wait for the next poll, or an enqueue from this process
+                self.queue.wakeup.wait(UPLOAD_WORKER_POLL_SECONDS)
+                self.queue.wakeup.clear()
+                continue
+            try:
+                handle_job(job, self.queue)
+            except Exception as e:
+                print(f"[Job {job.job_id}] Worker error: {e}", flush=True)
@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+import mmap
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+# python-multipart is imported as `python_multipart` since 0.0.13 (`multipart` before)
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# Uploaded files wait here for their OCR job, which gets the path instead of the bytes.
+# Workers in other processes need the same directory (same host or a shared volume).
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", "./upload_spool")
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(15 * 1024 * 1024)))
+# Leftovers (jobs lost with their queue entry) are removed after this long
+UPLOAD_SPOOL_MAX_AGE_HOURS = float(os.getenv("UPLOAD_SPOOL_MAX_AGE_HOURS", "24"))
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class SpooledUpload:
+    """A multipart file part written to the spool directory."""
+
+    def __init__(self, path: str, size: int, content_hash: str, filename: str, content_type: str):
+        self.path = path
+        self.size = size
+        self.content_hash = content_hash
+        self.filename = filename
+        self.content_type = content_type
+
+
+async def spool_multipart(request, field: str = "file", max_bytes: int = None):
+    """
+    Stream a multipart/form-data request body and write the `field` file part straight to
+    the spool directory, hashing on the way; other parts are skipped. Only the chunk being
+    parsed is held in memory and the file is written once. Raises UploadTooLarge past
+    max_bytes and ValueError for a malformed body or a missing file (nothing is kept).
+    """
+    max_bytes = max_bytes or UPLOAD_MAX_BYTES
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise ValueError("Expected a multipart/form-data upload")
+
+    part = {"headers": {}, "field": b"", "value": b"", "file": False}
+    found = {}
+    pending = []
+
+    def on_part_begin():
+        part.update(headers={}, field=b"", value=b"", file=False)
+
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part["field"], part["value"] = b"", b""
+
+    def on_headers_finished():
+        _, options = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        if options.get(b"name", b"").decode() == field and b"filename" in options and not found:
+            part["file"] = True
+            found["filename"] = options[b"filename"].decode("utf-8", "replace")
+            found["content_type"] = part["headers"].get(b"content-type", b"application/octet-stream").decode("latin-1")
+
+    def on_part_data(data, start, end):
+        if part["file"]:
+            pending.append(data[start:end])
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+    })
+
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    path = os.path.join(UPLOAD_SPOOL_DIR, uuid.uuid4().hex)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(path, "wb") as out:
+            async for chunk in request.stream():
+                parser.write(chunk)
+                if not pending:
+                    continue
+                data = b"".join(pending)
+                pending.clear()
+                size += len(data)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"File is larger than {max_bytes // (1024 * 1024)} MB")
+                digest.update(data)
+                await asyncio.to_thread(out.write, data)
+            parser.finalize()
+        if not found:
+            raise ValueError(f"No '{field}' file in the upload")
+    except BaseException:
+        discard(path)
+        raise
+    return SpooledUpload(path, size, digest.hexdigest(), found["filename"], found["content_type"])
+
+
+@contextmanager
+def read_upload(source):
+    """
+    Contents of an upload: bytes are used as is, a spooled file is memory-mapped (read
+    lazily from the page cache instead of copied onto the heap) and unmapped on exit.
+    """
+    if not isinstance(source, str):
+        yield source
+        return
+    with open(source, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            yield view
+
+
+def hash_upload(source):
+    """sha256 hex of bytes or a spooled file (read in chunks)."""
+    if not isinstance(source, str):
+        return hashlib.sha256(source).hexdigest()
+    digest = hashlib.sha256()
+    with open(source, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def discard(path: str):
+    if path:
+        try:
+            os.remove(path)
+        except OSError as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"Upload spool: could not remove {path}: {e}")
+
+
+def sweep_spool(max_age_hours: float = None):
+    """Remove spooled files older than max_age_hours. Returns how many were removed."""
+    if not os.path.isdir(UPLOAD_SPOOL_DIR):
+        return 0
+    cutoff = time.time() - (max_age_hours or UPLOAD_SPOOL_MAX_AGE_HOURS) * 3600
+    removed = 0
+    for entry in os.scandir(UPLOAD_SPOOL_DIR):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            discard(entry.path)
+            removed += 1
+    return removed
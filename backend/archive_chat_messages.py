@@ -0,0 +1,43 @@
+"""
+Move chat messages older than the retention window into compressed archive blocks
+(chat_archives). Archived conversations stay readable through GET /chat/history.
+
+Usage:
+    python archive_chat_messages.py              # uses CHAT_RETENTION_DAYS (default 90)
+    python archive_chat_messages.py --days 30
+    python archive_chat_messages.py --dry-run    # only count what would be moved
+
+Run it from cron (or set CHAT_ARCHIVE_INTERVAL_HOURS to let the API do it).
+On SQLite the file only shrinks after VACUUM; pass --vacuum to run it afterwards.
+"""
+import argparse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from sqlalchemy import text
+from app.db import engine
+from app.models.base import Base
+from app.models import kitchen, chat as chat_model, meals, workspace  # noqa: F401 - register tables
+from app.services.chat_retention import archive_old_messages, CHAT_RETENTION_DAYS
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--days", type=int, default=CHAT_RETENTION_DAYS)
+parser.add_argument("--dry-run", action="store_true")
+parser.add_argument("--vacuum", action="store_true")
+args = parser.parse_args()
+
+Base.metadata.create_all(bind=engine)  # make sure chat_archives exists
+
+stats = archive_old_messages(older_than_days=args.days, dry_run=args.dry_run)
+if args.dry_run:
+    print(f"Would archive {stats['messages']} messages for {stats['users']} users (older than {stats['cutoff']})")
+else:
+    ratio = stats["raw_bytes"] / stats["compressed_bytes"] if stats["compressed_bytes"] else 0
+    print(f"Archived {stats['messages']} messages for {stats['users']} users (older than {stats['cutoff']})")
+    print(f"Payload: {stats['raw_bytes']} bytes -> {stats['compressed_bytes']} bytes compressed ({ratio:.1f}x)")
+
+if args.vacuum and engine.dialect.name == "sqlite" and not args.dry_run:
+    with engine.connect() as conn:
+        conn.execute(text("VACUUM"))
+    print("VACUUM done.")
@@ -0,0 +1,169 @@
+"""
+Benchmark: chat history lookups on a large chat_messages table.
+
+Fills a throwaway SQLite database with --rows messages (default 10M, spread over
+--users users), then times:
+  * the chat context load (latest messages for a user) without / with the
+    (user_id, timestamp, id) index
+  * deep pagination for one heavy user (--heavy messages): OFFSET paging vs
+    keyset (cursor) paging, fetching a single page at increasing depths
+
+Usage:
+    python bench_chat_history.py                 # 10M rows (~1 GB, takes a few minutes to build)
+    python bench_chat_history.py --rows 1000000  # quicker run
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--rows", type=int, default=10_000_000)
+parser.add_argument("--users", type=int, default=100_000)
+parser.add_argument("--queries", type=int, default=200)
+parser.add_argument("--heavy", type=int, default=100_000, help="messages owned by one heavy user")
+args = parser.parse_args()
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), "chat_history_bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_FILE}"
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+from sqlalchemy import text
+from app.db import engine, SessionLocal
+from app.models.base import Base
+from app.models import kitchen, chat as chat_model, meals, workspace  # noqa: F401 - register tables
+from app.routers.chat import query_chat_messages
+
+INDEX_NAME = "ix_chat_messages_user_ts_id"
+BATCH = 200_000
+
+
+def build_table():
+    Base.metadata.create_all(bind=engine)
+    with engine.connect() as conn:
+        conn.execute(text(f"DROP INDEX IF EXISTS {INDEX_NAME}"))
+        conn.commit()
+
+    raw = sqlite3.connect(DB_FILE)
+    raw.execute("PRAGMA journal_mode=OFF")
+    raw.execute("PRAGMA synchronous=OFF")
+    rng = random.Random(7)
+    start_time = datetime(2025, 1, 1)
+    started = time.perf_counter()
+    for offset in range(0, args.rows, BATCH):
+        rows = []
+        for i in range(offset, min(offset + BATCH, args.rows)):
+            user = "user-heavy" if i < args.heavy else f"user-{rng.randrange(args.users)}"
+            # Same text format SQLAlchemy stores DateTime columns in on SQLite
+            ts = (start_time + timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S.%f")
+            rows.append((str(uuid.uuid4()), user, "user" if i % 2 else "assistant", "message body " * 8, ts))
+        raw.executemany("INSERT INTO chat_messages (id, user_id, role, content, timestamp) VALUES (?, ?, ?, ?, ?)", rows)
+        raw.commit()
+        print(f"  inserted {min(offset + BATCH, args.rows):,} rows", end="\r", flush=True)
+    raw.close()
+    print(f"\nBuilt {args.rows:,} rows in {time.perf_counter() - started:.0f}s")
+
+
+def set_index(enabled: bool):
+    with engine.connect() as conn:
+        if enabled:
+            started = time.perf_counter()
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON chat_messages (user_id, timestamp, id)"))
+            print(f"Index built in {time.perf_counter() - started:.1f}s")
+        else:
+            conn.execute(text(f"DROP INDEX IF EXISTS {INDEX_NAME}"))
+        conn.commit()
+
+
+def time_queries(label, fn, queries):
+    users = [f"user-{random.randrange(args.users)}" for _ in range(queries)]
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        for user in users:
+            fn(db, user)
+        elapsed = time.perf_counter() - started
+    finally:
+        db.close()
+    print(f"{label:>44}: {elapsed / queries * 1000:>9.2f} ms/query")
+
+
+def context_load(db, user):
+    query_chat_messages(db, user, limit=50)
+
+
+PAGE_SIZE = 20
+
+
+def time_page(label, fetch, repeats=20):
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        for _ in range(repeats):
+            rows = fetch(db)
+        elapsed = time.perf_counter() - started
+    finally:
+        db.close()
+    assert len(rows) == PAGE_SIZE
+    print(f"{label:>44}: {elapsed / repeats * 1000:>9.2f} ms/page")
+
+
+def deep_pages():
+    from app.models.chat import ChatMessage
+    db = SessionLocal()
+    try:
+        for depth in (1, 100, 1000, args.heavy // PAGE_SIZE - 2):
+            if depth * PAGE_SIZE >= args.heavy:
+                continue
+            offset = depth * PAGE_SIZE
+            # The cursor a client would hold after reading `depth` pages
+            last = (db.query(ChatMessage).filter(ChatMessage.user_id == "user-heavy")
+                    .order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+                    .offset(offset - 1).limit(1).one())
+            before = (last.timestamp, last.id)
+
+            def by_offset(db, offset=offset):
+                return (db.query(ChatMessage).filter(ChatMessage.user_id == "user-heavy")
+                        .order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+                        .offset(offset).limit(PAGE_SIZE).all())
+
+            def by_keyset(db, before=before):
+                return query_chat_messages(db, "user-heavy", before=before, limit=PAGE_SIZE)
+
+            assert [m.id for m in by_offset(db)] == [m.id for m in by_keyset(db)]
+            time_page(f"page {depth + 1} via OFFSET", by_offset)
+            time_page(f"page {depth + 1} via keyset cursor", by_keyset)
+    finally:
+        db.close()
+
+
+def main():
+    print(f"Building chat_messages with {args.rows:,} rows for {args.users:,} users ({DB_FILE})")
+    build_table()
+
+    print("\nWithout index:")
+    # Full scans are slow at this size; a handful of queries is enough
+    time_queries("context load (latest 50)", context_load, max(3, args.queries // 50))
+
+    print("\nWith (user_id, timestamp, id) index:")
+    set_index(True)
+    time_queries("context load (latest 50)", context_load, args.queries)
+
+    print(f"\nDeep pages for a user with {args.heavy:,} messages:")
+    deep_pages()
+
+    with engine.connect() as conn:
+        plan = conn.execute(text(
+            "EXPLAIN QUERY PLAN SELECT * FROM chat_messages WHERE user_id = 'user-1' "
+            "AND timestamp <= '2025-06-01' AND (timestamp < '2025-06-01' OR (timestamp = '2025-06-01' AND id < 'x')) "
+            "ORDER BY timestamp DESC, id DESC LIMIT 20"
+        )).fetchall()
+    print("\nKeyset query plan:", " / ".join(row[-1] for row in plan))
+
+
+if __name__ == "__main__":
+    main()
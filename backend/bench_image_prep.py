@@ -0,0 +1,102 @@
+"""
+Benchmark: upload image preprocessing before the Vision call (app/services/image_prep.py).
+
+Builds two phone-sized (4032x3024) test images, a receipt shot stored sideways with an EXIF
+orientation tag and a noisy colour fridge photo, and reports for each:
+  - bytes and base64 request payload, original vs prepared
+  - preprocessing time
+  - simulated job latency: prep + sending the payload at --mbps + a fixed --model-seconds.
+    No real Vision call is made; the model time is the same either way because OpenAI
+    already scales high-detail images to fit 2048px, which is the default OCR_IMAGE_MAX_EDGE.
+
+Usage:
+    python bench_image_prep.py [--mbps 10] [--model-seconds 4] [--runs 5]
+"""
+import argparse
+import base64
+import io
+import random
+import statistics
+import time
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from app.services import image_prep
+
+WIDTH, HEIGHT = 4032, 3024
+
+
+def receipt_image():
+    """Warm-white paper with rows of dark text, saved rotated with Orientation=6 like a portrait phone shot."""
+    rnd = random.Random(1)
+    image = Image.new("RGB", (HEIGHT, WIDTH), (236, 232, 222))
+    draw = ImageDraw.Draw(image)
+    y = 200
+    while y < WIDTH - 200:
+        x = 180
+        while x < HEIGHT - 300:
+            w = rnd.randint(40, 260)
+            draw.rectangle([x, y, x + w, y + 38], fill=(40, 38, 36))
+            x += w + rnd.randint(30, 90)
+        y += 90
+    # Camera noise, so it compresses like a photo rather than a drawing
+    noise = Image.effect_noise((HEIGHT, WIDTH), 18).convert("RGB")
+    image = Image.blend(image, noise, 0.08).filter(ImageFilter.GaussianBlur(1))
+    image = image.transpose(Image.ROTATE_90)  # stored sideways...
+    exif = Image.Exif()
+    exif[0x0112] = 6  # ...and tagged "rotate 90 CW to display"
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=95, exif=exif)
+    return out.getvalue()
+
+
+def fridge_image():
+    """Large coloured blobs plus noise: a stand-in for a shelf of produce."""
+    rnd = random.Random(2)
+    image = Image.new("RGB", (WIDTH, HEIGHT), (200, 205, 210))
+    draw = ImageDraw.Draw(image)
+    for _ in range(120):
+        x, y = rnd.randint(0, WIDTH), rnd.randint(0, HEIGHT)
+        r = rnd.randint(60, 300)
+        draw.ellipse([x - r, y - r, x + r, y + r],
+                     fill=(rnd.randint(0, 255), rnd.randint(0, 255), rnd.randint(0, 255)))
+    noise = Image.effect_noise((WIDTH, HEIGHT), 40).convert("RGB")
+    image = Image.blend(image, noise, 0.15)
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=95)
+    return out.getvalue()
+
+
+def simulated_latency(payload_bytes, prep_seconds, mbps, model_seconds):
+    return prep_seconds + payload_bytes * 8 / (mbps * 1_000_000) + model_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mbps", type=float, default=10, help="upload bandwidth to the Vision API")
+    parser.add_argument("--model-seconds", type=float, default=4, help="fixed model time per call")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    for name, upload_type, data in (("receipt", "stock", receipt_image()), ("fridge photo", "stock", fridge_image()),
+                                    ("meal photo", "meal", fridge_image())):
+        timings = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            prepared, mime, info = image_prep.prepare_image(data, upload_type)
+            timings.append(time.perf_counter() - start)
+        prep = statistics.median(timings)
+        before = len(base64.b64encode(data))
+        after = len(base64.b64encode(prepared))
+        print(f"\n{name} ({upload_type}): {info['original_size']} -> {info['size']}, {mime}"
+              f"{', grayscale' if info['grayscale'] else ''}{', EXIF rotated' if info['rotated'] else ''}")
+        print(f"  bytes    {len(data) / 1024:8.0f} KB -> {len(prepared) / 1024:6.0f} KB ({len(prepared) / len(data):.0%})")
+        print(f"  base64   {before / 1024:8.0f} KB -> {after / 1024:6.0f} KB")
+        print(f"  prep     {prep * 1000:8.0f} ms (median of {args.runs})")
+        print(f"  latency  {simulated_latency(before, 0, args.mbps, args.model_seconds):8.2f} s  -> "
+              f"{simulated_latency(after, prep, args.mbps, args.model_seconds):6.2f} s "
+              f"(simulated: {args.mbps:g} Mbps, {args.model_seconds:g} s model)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Benchmark: database round trips per logged meal in InventoryManager.log_meal_and_deduct_stock.
+
+Compares the previous per-ingredient lookup (one ILIKE query per ingredient, plus a
+full stock scan on every miss) with the single-load StockNameIndex, on a throwaway
+SQLite database. Reports SELECTs, total statements and time per meal.
+
+Usage:
+    python bench_meal_deduction.py
+"""
+import os
+import random
+import tempfile
+import time
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), "meal_bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_FILE}"
+
+from sqlalchemy import event
+from app.db import engine, SessionLocal
+from app.models.base import Base
+from app.models import kitchen, chat as chat_model, meals, workspace  # noqa: F401 - register tables
+from app.models.kitchen import KitchenStock, User
+from app.services.inventory import InventoryManager, StockNameIndex
+
+STOCK_ITEMS = 200
+MEALS = 30
+PANTRY = ["Tomato", "Onion", "Garlic", "Ginger", "Rice", "Toor Dal", "Milk", "Paneer", "Butter",
+          "Cumin Seeds", "Turmeric", "Green Chilli", "Potato", "Spinach", "Curd", "Atta", "Sugar", "Salt"]
+
+
+class StatementCounter:
+    def __init__(self):
+        self.selects = 0
+        self.total = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.total += 1
+        if statement.lstrip().upper().startswith("SELECT"):
+            self.selects += 1
+
+    def reset(self):
+        self.selects = self.total = 0
+
+
+def legacy_find(db, user_id, kitchen_id, item_name):
+    """The lookup log_meal_and_deduct_stock used to run for every ingredient."""
+    query = db.query(KitchenStock)
+    if kitchen_id:
+        query = query.filter(KitchenStock.kitchen_id == kitchen_id)
+    else:
+        query = query.filter(KitchenStock.user_id == user_id)
+    stock_item = query.filter(KitchenStock.item_name.ilike(f"%{item_name}%")).first()
+    if not stock_item:
+        for stock in db.query(KitchenStock).filter(KitchenStock.user_id == user_id).all():
+            if stock.item_name.lower() in item_name.lower():
+                return stock
+    return stock_item
+
+
+def seed():
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    db.add(User(user_id="bench-user"))
+    for i in range(STOCK_ITEMS):
+        name = PANTRY[i] if i < len(PANTRY) else f"Pantry Item {i}"
+        db.add(KitchenStock(user_id="bench-user", item_name=name, quantity="100 kg", category="other"))
+    db.commit()
+    db.close()
+
+
+def make_meal(rng, ingredients):
+    # Mix of exact hits, plural forms (reverse matches) and items not in stock (misses)
+    names = PANTRY + [p + "es" if p.endswith("o") else p + "s" for p in PANTRY] + ["Saffron", "Basil", "Tofu", "Quinoa"]
+    return [{"item": rng.choice(names), "qty": f"{rng.randint(1, 5)}0 g"} for _ in range(ingredients)]
+
+
+def run(label, counter, meals_per_size, deduct):
+    print(f"\n{label}")
+    print(f"{'ingredients':>11} | {'SELECTs/meal':>12} | {'statements/meal':>15} | {'ms/meal':>8}")
+    for ingredients in (5, 10, 20, 40):
+        rng = random.Random(ingredients)
+        selects = total = 0
+        elapsed = 0.0
+        for _ in range(meals_per_size):
+            meal = make_meal(rng, ingredients)
+            db = SessionLocal()
+            counter.reset()
+            started = time.perf_counter()
+            deduct(db, meal)
+            elapsed += time.perf_counter() - started
+            selects += counter.selects
+            total += counter.total
+            db.rollback()  # keep stock identical between runs
+            db.close()
+        print(f"{ingredients:>11} | {selects / meals_per_size:>12.1f} | {total / meals_per_size:>15.1f} | {elapsed / meals_per_size * 1000:>8.2f}")
+
+
+def legacy_deduct(db, meal):
+    for ing in meal:
+        legacy_find(db, "bench-user", None, ing["item"])
+
+
+def indexed_deduct(db, meal):
+    index = StockNameIndex.load(db, "bench-user")
+    for ing in meal:
+        index.find(ing["item"])
+
+
+def full_log_meal(db, meal):
+    # Real code path; the commit is swapped for a flush so the run can be rolled back
+    db.commit = db.flush
+    InventoryManager(db).log_meal_and_deduct_stock("bench-user", "Bench Meal", meal)
+
+
+def main():
+    seed()
+    counter = StatementCounter()
+    print(f"{STOCK_ITEMS} stock items, {MEALS} meals per size")
+    run("Lookups only - legacy per-ingredient queries", counter, MEALS, legacy_deduct)
+    run("Lookups only - StockNameIndex (one load per meal)", counter, MEALS, indexed_deduct)
+    run("Full log_meal_and_deduct_stock (lookups + meal insert + stock writes)", counter, MEALS, full_log_meal)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Microbenchmarks for QuantityParser.
+
+Corpus: quantity strings as they come back from bill OCR, the chat tools and manual
+entry, drawn with a skewed (Zipf-like) distribution since a few strings ("1 kg",
+"500 g", "1 pc") dominate real traffic.
+
+Cases:
+  legacy          previous parser (regex + unit_map rebuilt on every call)
+  uncached        new grammar, memoization bypassed
+  parse           new grammar with the LRU cache (steady state)
+  parse_many      bulk API over OCR-sized lists (~25 items)
+
+Also reports how many corpus strings each parser understands.
+
+Usage:
+    python bench_quantity_parser.py [--calls 200000]
+"""
+import argparse
+import random
+import re
+import time
+
+from app.services.inventory import QuantityParser, _parse_quantity
+
+CORPUS = [
+    # common
+    "1 kg", "500 g", "1 pc", "2 pcs", "1 l", "500 ml", "250g", "1kg", "200 gm", "100g",
+    "1 pack", "2 packs", "6 pcs", "12 pcs", "1 dozen", "1 ltr", "5 kg", "2 kg", "50 g", "1.5 kg",
+    # OCR output
+    "2 x 500g", "1 x 1kg", "3 x 200 ml", "500g x 2", "1.5 kg pack", "500 g (approx)", "approx 250 g",
+    "1 Ltr", "1 LTR", "200 GMS", "100 Gms", "3 Nos", "1 No", "1kg pouch", "400g tin", "2 x 1 l",
+    "0.5 kg", ".5 kg", "750 ML", "1.2 kg (approx)", "2×200 g", "180 g pack", "5 Kgs", "1 packet",
+    # recipe / chat quantities
+    "1/2 cup", "1 1/2 cups", "2 tbsp", "1 tsp", "1/4 tsp", "3 tablespoons", "½ cup", "¼ tsp",
+    "2 cups", "100 ml", "1 cup", "2 large onions", "3 cloves", "1 bunch", "2 medium tomatoes",
+    # unparseable
+    "some", "a pinch", "to taste", "", "few",
+]
+
+
+def legacy_parse(quantity_str: str):
+    if not quantity_str:
+        return None, None
+    quantity_str = quantity_str.lower().strip()
+    match = re.match(r"([\d\.]+)\s*([a-zA-Z]*)", quantity_str)
+    if match:
+        try:
+            amount = float(match.group(1))
+        except ValueError:
+            return None, None
+        unit = match.group(2).strip().lower()
+        unit_map = {
+            "gm": "g", "gms": "g", "gram": "g", "grams": "g",
+            "kg": "kg", "kgs": "kg", "kilogram": "kg",
+            "ml": "ml", "mls": "ml",
+            "l": "l", "liters": "l", "litre": "l",
+            "pc": "pcs", "pcs": "pcs", "piece": "pcs", "pieces": "pcs",
+            "tbsp": "tbsp", "tablespoon": "tbsp",
+            "tsp": "tsp", "teaspoon": "tsp"
+        }
+        return amount, unit_map.get(unit, unit)
+    return None, None
+
+
+KNOWN_UNITS = {"g", "kg", "mg", "ml", "l", "pcs", "tbsp", "tsp", "cup", "oz", "lb"}
+
+
+def understood(result, text):
+    """Parsed to a known unit, and multiplied/fraction forms got the right amount."""
+    amount, unit = result
+    if amount is None or unit not in KNOWN_UNITS:
+        return False
+    expected = {"2 x 500g": 1000, "500g x 2": 1000, "1/2 cup": 0.5, "1 1/2 cups": 1.5, "½ cup": 0.5,
+                "1/4 tsp": 0.25, "¼ tsp": 0.25, "2×200 g": 400, "3 x 200 ml": 600, "2 x 1 l": 2}
+    return text not in expected or abs(amount - expected[text]) < 1e-9
+
+
+def make_stream(calls: int):
+    rng = random.Random(1)
+    weights = [1 / (rank + 1) for rank in range(len(CORPUS))]
+    return rng.choices(CORPUS, weights=weights, k=calls)
+
+
+def bench(label, fn, stream):
+    start = time.perf_counter()
+    fn(stream)
+    elapsed = time.perf_counter() - start
+    print(f"{label:>12}: {len(stream) / elapsed:>12,.0f} parses/s   ({elapsed * 1e9 / len(stream):>7.0f} ns/parse)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200_000)
+    args = parser.parse_args()
+    stream = make_stream(args.calls)
+
+    legacy_ok = sum(understood(legacy_parse(q), q) for q in CORPUS)
+    new_ok = sum(understood(QuantityParser.parse(q), q) for q in CORPUS)
+    print(f"Corpus: {len(CORPUS)} distinct strings; understood by legacy {legacy_ok}, new {new_ok}")
+    for q in CORPUS:
+        old, new = legacy_parse(q), QuantityParser.parse(q)
+        if old != new:
+            print(f"    {q!r:>22}: {old} -> {new}")
+    print(f"\n{args.calls:,} parses, skewed distribution:")
+
+    uncached = _parse_quantity.__wrapped__
+    bench("legacy", lambda s: [legacy_parse(q) for q in s], stream)
+    bench("uncached", lambda s: [uncached(q.lower().strip()) for q in s if q], stream)
+    _parse_quantity.cache_clear()
+    bench("parse", lambda s: [QuantityParser.parse(q) for q in s], stream)
+
+    # OCR bills: lists of ~25 items
+    batches = [stream[i:i + 25] for i in range(0, len(stream), 25)]
+    bench("parse_many", lambda s: [QuantityParser.parse_many(batch) for batch in batches], stream)
+
+    info = QuantityParser.cache_info()
+    print(f"\nCache: {info.hits:,} hits, {info.misses:,} misses, {info.currsize}/{info.maxsize} entries")
+
+
+if __name__ == "__main__":
+    main()
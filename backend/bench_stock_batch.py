@@ -0,0 +1,121 @@
+"""
+Benchmark: POST /stock/batch on a grocery-bill-sized payload.
+
+Compares the previous per-item path (InventoryManager.add_stock + a lookup to return the
+row, one commit per item) with InventoryManager.add_stock_batch (one stock load, merge in
+memory, one INSERT .. ON CONFLICT per chunk, one commit). Reports statements, commits and
+time per batch on a throwaway SQLite database.
+
+Usage:
+    python bench_stock_batch.py [--runs 20]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), "batch_bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_FILE}"
+
+from sqlalchemy import event
+from app.db import engine, SessionLocal
+from app.models.base import Base
+from app.models import kitchen, chat as chat_model, meals, workspace  # noqa: F401 - register tables
+from app.models.kitchen import KitchenStock, User
+from app.services.inventory import InventoryManager
+from app.services.name_search import find_stock_match
+
+STOCK_ITEMS = 200
+PANTRY = ["Tomato", "Onion", "Garlic", "Ginger", "Rice", "Toor Dal", "Milk", "Paneer", "Butter",
+          "Cumin Seeds", "Turmeric", "Green Chilli", "Potato", "Spinach", "Curd", "Atta", "Sugar", "Salt"]
+NEW_ITEMS = ["Basmati Rice", "Olive Oil", "Oats", "Bread", "Eggs", "Cheese Slices", "Coffee", "Tea",
+             "Biscuits", "Cornflakes", "Honey", "Jam", "Peanut Butter", "Soy Sauce", "Vinegar", "Noodles"]
+
+
+class Counter:
+    def __init__(self):
+        self.statements = 0
+        self.commits = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+        event.listen(engine, "commit", self._on_commit)
+
+    def _on_execute(self, *args):
+        self.statements += 1
+
+    def _on_commit(self, conn):
+        self.commits += 1
+
+    def reset(self):
+        self.statements = self.commits = 0
+
+
+def seed():
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    db.query(KitchenStock).delete()
+    if not db.query(User).filter(User.user_id == "bench-user").first():
+        db.add(User(user_id="bench-user"))
+    for i in range(STOCK_ITEMS):
+        name = PANTRY[i] if i < len(PANTRY) else f"Pantry Item {i}"
+        db.add(KitchenStock(user_id="bench-user", item_name=name, quantity="1 kg", category="other"))
+    db.commit()
+    db.close()
+
+
+def make_bill(rng, lines):
+    # Restocks of existing items (some plural / repeated), plus new items
+    names = PANTRY + [p + "es" if p.endswith("o") else p + "s" for p in PANTRY] + NEW_ITEMS
+    return [{"user_id": "bench-user", "item_name": rng.choice(names), "quantity": rng.choice(["500 g", "1 kg", "2 x 200g", "1 l"]),
+             "category": "other", "source": "bill"} for _ in range(lines)]
+
+
+def legacy_batch(db, bill):
+    manager = InventoryManager(db)
+    processed = []
+    for item in bill:
+        manager.add_stock(item["user_id"], item["item_name"], item["quantity"], item["category"])
+        db_item = find_stock_match(db, item["item_name"], user_id=item["user_id"])
+        if db_item:
+            processed.append(db_item.quantity)
+    return processed
+
+
+def bulk_batch(db, bill):
+    return [stock.quantity for stock in InventoryManager(db).add_stock_batch(bill)]
+
+
+def run(label, counter, runs, fn):
+    print(f"\n{label}")
+    print(f"{'lines':>5} | {'statements':>10} | {'commits':>7} | {'ms/batch':>8}")
+    for lines in (10, 40, 100):
+        rng = random.Random(lines)
+        statements = commits = 0
+        elapsed = 0.0
+        for _ in range(runs):
+            seed()  # every batch starts from the same stock
+            bill = make_bill(rng, lines)
+            db = SessionLocal()
+            counter.reset()
+            started = time.perf_counter()
+            fn(db, bill)
+            elapsed += time.perf_counter() - started
+            statements += counter.statements
+            commits += counter.commits
+            db.close()
+        print(f"{lines:>5} | {statements / runs:>10.1f} | {commits / runs:>7.1f} | {elapsed / runs * 1000:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+    seed()
+    counter = Counter()
+    print(f"{STOCK_ITEMS} stock items, {args.runs} batches per size")
+    run("Per-item add_stock + lookup (previous /stock/batch)", counter, args.runs, legacy_batch)
+    run("add_stock_batch (one load, one upsert, one commit)", counter, args.runs, bulk_batch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Benchmark: API memory while ingesting concurrent uploads.
+
+Starts the upload endpoint in a separate uvicorn process, sends N concurrent multipart
+uploads of an M MB file (default 50 x 10 MB) and reports the server's resident memory
+(VmRSS before, VmHWM peak after; Linux /proc). Two server variants:
+  - buffered:  the previous handler, `await file.read()` and the bytes put on the queue
+  - streaming: the current handler (routers/upload.py), the request body is parsed as it
+               arrives, the file part written straight to UPLOAD_SPOOL_DIR and the job
+               only carries its path
+Jobs are only enqueued (UPLOAD_WORKER_MODE=external), no OCR runs. Uses a throwaway
+SQLite queue and spool directory.
+
+Usage:
+    python bench_upload_memory.py [--uploads 50] [--size-mb 10]
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+
+def serve(mode: str, port: int):
+    import uuid
+    import uvicorn
+    from fastapi import FastAPI, UploadFile, File, Query
+    from app.routers import upload
+    from app.services.job_queue import job_queue
+    from app.services.job_store import job_store
+
+    app = FastAPI()
+    if mode == "streaming":
+        app.include_router(upload.router)
+        app.add_middleware(upload.UploadSizeLimit)
+    else:
+        @app.post("/upload/")
+        async def upload_buffered(user_id: str = Query(...), upload_type: str = Query("stock"),
+                                  file: UploadFile = File(...)):
+            contents = await file.read()
+            job_id = str(uuid.uuid4())
+            job_store.save_job(job_id, {"status": "pending", "created_at": time.time()})
+            await asyncio.to_thread(job_queue.enqueue, job_id, {
+                "user_id": user_id, "upload_type": upload_type,
+                "filename": file.filename, "content_type": file.content_type,
+            }, contents)
+            return {"job_id": job_id, "status": "pending"}
+
+    @app.get("/health")
+    def health():
+        return {"status": "ok"}
+
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def memory_kb(pid: int):
+    values = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                values[key] = int(value.split()[0])
+    return values
+
+
+async def send_uploads(port: int, path: str, uploads: int):
+    async with httpx.AsyncClient(timeout=600) as client:
+        async def one(i):
+            with open(path, "rb") as f:
+                response = await client.post(f"http://127.0.0.1:{port}/upload/",
+                                             params={"user_id": f"bench-{i}", "upload_type": "stock"},
+                                             files={"file": ("receipt.jpg", f, "image/jpeg")})
+            return response.status_code
+        return await asyncio.gather(*(one(i) for i in range(uploads)))
+
+
+def run(mode: str, port: int, path: str, uploads: int, size_mb: int):
+    workdir = tempfile.mkdtemp()
+    env = dict(os.environ,
+               DATABASE_URL=f"sqlite:///{workdir}/bench.db",
+               UPLOAD_QUEUE_DB=f"{workdir}/queue.db",
+               UPLOAD_SPOOL_DIR=f"{workdir}/spool",
+               UPLOAD_MAX_BYTES=str((size_mb + 1) * 1024 * 1024),
+               UPLOAD_WORKER_MODE="external",
+               OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "bench"),
+               PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    env.pop("REDIS_URL", None)
+    server = subprocess.Popen([sys.executable, __file__, "--serve", mode, "--port", str(port)],
+                              env=env, stdout=subprocess.DEVNULL)
+    try:
+        for _ in range(100):
+            try:
+                httpx.get(f"http://127.0.0.1:{port}/health")
+                break
+            except httpx.TransportError:
+                time.sleep(0.2)
+        before = memory_kb(server.pid)
+        start = time.perf_counter()
+        statuses = asyncio.run(send_uploads(port, path, uploads))
+        elapsed = time.perf_counter() - start
+        after = memory_kb(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+
+    ok = sum(1 for status in statuses if status == 200)
+    print(f"{mode:>9}: {ok}/{uploads} accepted in {elapsed:5.1f}s | RSS idle {before['VmRSS'] / 1024:6.0f} MB, "
+          f"peak {after['VmHWM'] / 1024:6.0f} MB (+{(after['VmHWM'] - before['VmRSS']) / 1024:.0f} MB), "
+          f"after {after['VmRSS'] / 1024:6.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uploads", type=int, default=50)
+    parser.add_argument("--size-mb", type=int, default=10)
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port)
+        return
+
+    path = os.path.join(tempfile.mkdtemp(), "upload.bin")
+    with open(path, "wb") as f:
+        f.write(os.urandom(args.size_mb * 1024 * 1024))
+    print(f"{args.uploads} concurrent uploads of {args.size_mb} MB")
+    run("buffered", args.port, path, args.uploads, args.size_mb)
+    run("streaming", args.port + 1, path, args.uploads, args.size_mb)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Check: the chat response cache (CHAT_RESPONSE_CACHE=on) in routers/chat.py.
+
+Runs generate_chat_stream against a throwaway SQLite database with a fake OpenAI client
+(each call returns "reply N") and asserts:
+  - a user with chat history asking the same standalone question twice hits the cache
+    both times (entry stored by a fresh user with the same pantry), even after a stock
+    quantity changed in between
+  - follow-ups ("what about with paneer", "make it spicier") are never served from cache
+  - a different diet/allergy profile or different stock items get their own entry
+
+Usage:
+    python check_response_cache.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/check.db"
+os.environ["CHAT_RESPONSE_CACHE"] = "on"
+os.environ.setdefault("OPENAI_API_KEY", "check")
+os.environ.pop("REDIS_URL", None)
+
+from app.db import engine, session_scope
+from app.models.base import Base
+from app.models import kitchen, chat as chat_models, meals, workspace  # noqa: F401 (register tables)
+from app.models.kitchen import KitchenStock, UserProfile
+from app.routers import chat
+
+calls = []
+
+
+class FakeStream:
+    def __init__(self, text):
+        self.parts = [text]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.parts:
+            raise StopAsyncIteration
+        delta = SimpleNamespace(content=self.parts.pop(), tool_calls=None)
+        return SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=delta)])
+
+    async def close(self):
+        pass
+
+
+class FakeCompletions:
+    async def create(self, **kwargs):
+        calls.append(kwargs["messages"][-1]["content"])
+        return FakeStream(f"reply {len(calls)}")
+
+
+async def ask(user_id, message):
+    """Returns (reply, served_from_cache)."""
+    before = len(calls)
+    frames = [frame async for frame in chat.generate_chat_stream(chat.ChatRequest(message=message, user_id=user_id))]
+    reply = "".join(frame for frame in frames if '"token"' in frame)
+    return reply, len(calls) == before
+
+
+def add_stock(user_id, item_name, quantity):
+    with session_scope() as db:
+        db.add(kitchen.User(user_id=user_id, name="Check User"))
+        db.add(KitchenStock(user_id=user_id, item_name=item_name, quantity=quantity))
+        db.commit()
+
+
+def set_quantity(user_id, quantity):
+    with session_scope() as db:
+        db.query(KitchenStock).filter(KitchenStock.user_id == user_id).first().quantity = quantity
+        db.commit()
+
+
+async def main():
+    failures = []
+
+    def check(label, ok):
+        print(f"{'ok  ' if ok else 'FAIL'} {label}")
+        if not ok:
+            failures.append(label)
+
+    question = "Give me a recipe for dal tadka"
+    add_stock("fresh", "Toor Dal", "1 kg")
+    add_stock("regular", "toor dal", "250 g")
+
+    _, hit = await ask("fresh", question)
+    check("first ask by a fresh user is a miss", not hit)
+
+    # Build up history for the regular user (these turns are never cached)
+    await ask("regular", "I made paneer butter masala yesterday")
+    await ask("regular", "how long does it keep?")
+
+    _, hit = await ask("regular", question)
+    check("user with history: standalone question hits", hit)
+    await ask("regular", "what about with paneer")
+    set_quantity("regular", "100 g")
+    _, hit = await ask("regular", question)
+    check("user with history: same question again hits (after a quantity change)", hit)
+
+    for follow_up in ("what about with paneer", "make it spicier", "and for four people?"):
+        _, hit = await ask("regular", follow_up)
+        check(f"follow-up not served from cache: {follow_up!r}", not hit)
+
+    with session_scope() as db:
+        db.add(UserProfile(user_id="allergic", allergies="peanuts"))
+        db.commit()
+    add_stock("allergic", "Toor Dal", "1 kg")
+    _, hit = await ask("allergic", question)
+    check("different allergies get their own entry", not hit)
+
+    add_stock("other", "Moong Dal", "1 kg")
+    _, hit = await ask("other", question)
+    check("different stock items get their own entry", not hit)
+
+    print(f"model calls: {len(calls)}, cache: {chat.response_cache.stats()}")
+    return not failures
+
+
+if __name__ == "__main__":
+    Base.metadata.create_all(bind=engine)
+    chat.client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions()))
+    sys.exit(0 if asyncio.run(main()) else 1)
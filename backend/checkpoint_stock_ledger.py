@@ -0,0 +1,45 @@
+"""
+Maintain the stock ledger (stock_events).
+
+Writes "set" checkpoints for stock rows with many events since their last one, so
+replaying a row stays short, and optionally replays the ledger against kitchen_stock
+to check that the snapshot and the history agree.
+
+Usage:
+    python checkpoint_stock_ledger.py                # uses STOCK_CHECKPOINT_EVERY (default 50)
+    python checkpoint_stock_ledger.py --min-events 10
+    python checkpoint_stock_ledger.py --verify       # only compare snapshot and ledger
+
+Run it from cron (or set STOCK_CHECKPOINT_INTERVAL_HOURS to let the API do it).
+"""
+import argparse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.db import engine, SessionLocal
+from app.models.base import Base
+from app.models import kitchen, chat as chat_model, meals, workspace  # noqa: F401 - register tables
+from app.services.stock_ledger import checkpoint_ledger, checkpoint_missing, verify_ledger, STOCK_CHECKPOINT_EVERY
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--min-events", type=int, default=STOCK_CHECKPOINT_EVERY)
+parser.add_argument("--verify", action="store_true")
+args = parser.parse_args()
+
+Base.metadata.create_all(bind=engine)  # make sure stock_events exists
+
+db = SessionLocal()
+try:
+    if args.verify:
+        mismatches = verify_ledger(db)
+        for m in mismatches:
+            print(f"  {m['item_name'] or m['stock_id']}: snapshot {m['snapshot']!r}, ledger {m['ledger']}")
+        print(f"{len(mismatches)} stock rows differ from their ledger history")
+        raise SystemExit(1 if mismatches else 0)
+
+    seeded = checkpoint_missing(db)
+    written = checkpoint_ledger(db, min_events=args.min_events)
+    print(f"Checkpointed {written} stock rows with {args.min_events}+ events; seeded {seeded} rows without history")
+finally:
+    db.close()
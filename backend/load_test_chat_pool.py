@@ -0,0 +1,121 @@
+"""
+Load test: DB pool occupancy while many /chat/ streams are in flight.
+
+Runs N concurrent chat streams against a throwaway SQLite database with a
+fake (slow) OpenAI client and samples how many pooled connections are checked
+out while the streams are running. With scoped sessions the peak should stay
+flat (a handful at most) no matter how many chats are open.
+
+Usage:
+    python load_test_chat_pool.py
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), "chat_pool_load.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_FILE}"
+os.environ.setdefault("OPENAI_API_KEY", "load-test")
+
+from app.db import engine
+from app.models.base import Base
+from app.models import kitchen, chat as chat_model, meals, workspace  # noqa: F401 - register tables
+from app.routers import chat
+
+TOKENS_PER_REPLY = 200
+TOKEN_DELAY = 0.01  # ~2s per fake completion
+TOKEN_TEXT = "tok "
+CONCURRENCY_LEVELS = [1, 5, 15, 30, 60]
+
+
+def _chunk(content):
+    delta = SimpleNamespace(content=content, tool_calls=None)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+
+
+class FakeStream:
+    def __init__(self):
+        self._remaining = TOKENS_PER_REPLY
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._remaining <= 0:
+            raise StopAsyncIteration
+        self._remaining -= 1
+        await asyncio.sleep(TOKEN_DELAY)
+        return _chunk(TOKEN_TEXT)
+
+
+class FakeCompletions:
+    async def create(self, **kwargs):
+        return FakeStream()
+
+
+chat.client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions()))
+
+
+async def run_chat(i, streaming, finishing):
+    request = chat.ChatRequest(message="what can I cook?", user_id=f"load-user-{i}")
+    received = ""
+    async for event in chat.generate_chat_stream(request):
+        data = json.loads(event[len("data: "):])
+        if data["type"] == "token":
+            if not received:
+                streaming.release()
+            received += data["content"]
+            if len(received) == TOKENS_PER_REPLY * len(TOKEN_TEXT):
+                # Whole reply delivered, about to persist: stop counting "mid-stream" occupancy
+                finishing.set()
+
+
+async def run_level(n):
+    """Returns (peak during setup burst, peak while every stream is mid-generation)."""
+    burst_peak = 0
+    stream_peak = 0
+    streaming = asyncio.Semaphore(0)
+    finishing = asyncio.Event()
+
+    async def sampler():
+        nonlocal burst_peak, stream_peak
+        # Phase 1: chats loading history / saving the user message
+        waiter = asyncio.gather(*(streaming.acquire() for _ in range(n)))
+        while not waiter.done():
+            burst_peak = max(burst_peak, engine.pool.checkedout())
+            await asyncio.sleep(0.002)
+        # Phase 2: all n streams are open and generating tokens
+        while not finishing.is_set():
+            stream_peak = max(stream_peak, engine.pool.checkedout())
+            await asyncio.sleep(0.002)
+
+    sampler_task = asyncio.create_task(sampler())
+    await asyncio.gather(*(run_chat(i, streaming, finishing) for i in range(n)))
+    await sampler_task
+    return burst_peak, stream_peak
+
+
+async def main():
+    Base.metadata.create_all(bind=engine)
+    print(f"Pool: {engine.pool.status()}")
+    print(f"{'concurrent chats':>17} | {'peak (setup burst)':>18} | {'peak (mid-stream)':>17}")
+    print("-" * 60)
+    stream_peaks = []
+    for n in CONCURRENCY_LEVELS:
+        burst_peak, stream_peak = await run_level(n)
+        stream_peaks.append(stream_peak)
+        print(f"{n:>17} | {burst_peak:>18} | {stream_peak:>17}")
+
+    # While tokens are flowing no connection should be held, however many chats are open
+    if max(stream_peaks) > 0:
+        print("FAIL: pool occupancy grows with the number of open chats.")
+        return 1
+    print("OK: pool occupancy stays flat as concurrent chats grow.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
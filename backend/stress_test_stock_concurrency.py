@@ -0,0 +1,195 @@
+"""
+Stress test: concurrent stock deductions in one shared kitchen must not lose updates.
+
+Several threads ("kitchen members") log meals against the same stock rows at the same
+time, each through its own session, while another thread keeps restocking. At the end
+every row must equal: initial - everything deducted + everything added, and replaying
+the stock ledger (stock_events) must give the same quantities.
+
+Runs three writers:
+  naive        read, subtract in Python, write back without a version check
+               (what happened before row versioning) - expected to lose updates
+  optimistic   InventoryManager with STOCK_WRITE_MODE=optimistic (versioned writes + retry)
+  atomic       InventoryManager with STOCK_WRITE_MODE=atomic (amount = amount - x in SQL)
+
+Uses a throwaway SQLite file unless DATABASE_URL is set (point it at a scratch Postgres
+database to test row locking there).
+
+Usage:
+    python stress_test_stock_concurrency.py [--threads 8] [--meals 40]
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'stock_stress.db')}"
+
+from sqlalchemy import update
+from app.db import engine, SessionLocal
+from app.models.base import Base
+from app.models import kitchen, chat as chat_model, meals, workspace  # noqa: F401 - register tables
+from app.models.kitchen import KitchenStock, StockEvent, User
+from app.models.workspace import Kitchen
+from app.services import inventory
+from app.services.inventory import InventoryManager
+from app.services.stock_ledger import record_event, verify_ledger
+
+ITEMS = {"Rice": 100_000.0, "Toor Dal": 100_000.0, "Onion": 100_000.0, "Ghee": 100_000.0}
+USE_PER_MEAL = 10.0  # grams of each chosen ingredient
+RESTOCK = 50.0
+
+
+def reset(kitchen_id, owner_id):
+    db = SessionLocal()
+    db.query(KitchenStock).filter(KitchenStock.kitchen_id == kitchen_id).delete()
+    db.query(StockEvent).filter(StockEvent.kitchen_id == kitchen_id).delete()
+    for name, amount in ITEMS.items():
+        stock = KitchenStock(user_id=owner_id, kitchen_id=kitchen_id, item_name=name, category="other", source="manual")
+        stock.set_amount(amount, "g")
+        db.add(stock)
+        record_event(db, stock, "set")
+    db.commit()
+    db.close()
+
+
+def read_stock(kitchen_id):
+    db = SessionLocal()
+    rows = {s.item_name: s.amount for s in db.query(KitchenStock).filter(KitchenStock.kitchen_id == kitchen_id)}
+    db.close()
+    return rows
+
+
+def naive_meal(db, kitchen_id, ingredients):
+    """Old behaviour: read-modify-write with no version check."""
+    for ing in ingredients:
+        stock = db.query(KitchenStock).filter(KitchenStock.kitchen_id == kitchen_id,
+                                              KitchenStock.item_name == ing["item"]).first()
+        new_amount = stock.amount - USE_PER_MEAL
+        time.sleep(0.001)  # a little work between read and write, like parsing/conversion
+        db.execute(update(KitchenStock).where(KitchenStock.stock_id == stock.stock_id)
+                   .values(amount=new_amount, quantity=f"{new_amount} g")
+                   .execution_options(synchronize_session=False))
+    db.commit()
+
+
+def run(mode, args, kitchen_id, owner_id, members):
+    reset(kitchen_id, owner_id)
+    inventory.STOCK_WRITE_MODE = mode
+    deducted = {name: 0.0 for name in ITEMS}
+    added = {name: 0.0 for name in ITEMS}
+    tally_lock = threading.Lock()
+    errors = []
+    stop_restock = threading.Event()
+    start = threading.Barrier(args.threads + 2)  # members + restocker + main
+
+    def member(user_id, seed):
+        rng = random.Random(seed)
+        start.wait()
+        for _ in range(args.meals):
+            # Different members pick different ingredient subsets, in different orders
+            ingredients = [{"item": name, "qty": f"{USE_PER_MEAL:g} g"} for name in rng.sample(list(ITEMS), 2)]
+            db = SessionLocal()
+            try:
+                if mode == "naive":
+                    naive_meal(db, kitchen_id, ingredients)
+                else:
+                    InventoryManager(db).log_meal_and_deduct_stock(user_id, "Stress Meal", ingredients, kitchen_id=kitchen_id)
+                with tally_lock:
+                    for ing in ingredients:
+                        deducted[ing["item"]] += USE_PER_MEAL
+            except Exception as e:
+                errors.append(repr(e))
+            finally:
+                db.close()
+
+    def restocker():
+        rng = random.Random(99)
+        start.wait()
+        while not stop_restock.is_set():
+            name = rng.choice(list(ITEMS))
+            db = SessionLocal()
+            try:
+                stock = db.query(KitchenStock).filter(KitchenStock.kitchen_id == kitchen_id,
+                                                      KitchenStock.item_name == name).first()
+                if mode == "naive":
+                    stock.amount = stock.amount + RESTOCK
+                    db.execute(update(KitchenStock).where(KitchenStock.stock_id == stock.stock_id)
+                               .values(amount=stock.amount).execution_options(synchronize_session=False))
+                    db.commit()
+                else:
+                    manager = InventoryManager(db)
+                    manager._with_retry(lambda: (manager._adjust_stock(stock, RESTOCK, "g"), manager._commit()))
+                with tally_lock:
+                    added[name] += RESTOCK
+            except Exception as e:
+                errors.append(repr(e))
+            finally:
+                db.close()
+            time.sleep(0.002)
+
+    threads = [threading.Thread(target=member, args=(members[i % len(members)], i)) for i in range(args.threads)]
+    restock_thread = threading.Thread(target=restocker)
+    for t in threads + [restock_thread]:
+        t.start()
+    started = time.perf_counter()
+    start.wait()
+    for t in threads:
+        t.join()
+    stop_restock.set()
+    restock_thread.join()
+    elapsed = time.perf_counter() - started
+
+    final = read_stock(kitchen_id)
+    lost = {name: round(final[name] - (ITEMS[name] - deducted[name] + added[name]), 3) for name in ITEMS}
+    lost_total = sum(abs(v) for v in lost.values())
+    meals_done = sum(deducted.values()) / USE_PER_MEAL / 2
+    print(f"{mode:>10}: {meals_done:>5.0f} meals, {sum(added.values()) / RESTOCK:>4.0f} restocks in {elapsed:5.2f}s | "
+          f"drift per item (g): {lost} | errors: {len(errors)}")
+    for error in errors[:3]:
+        print(f"            {error}")
+    if mode != "naive":
+        # The ledger must replay to the same quantities as the snapshot
+        db = SessionLocal()
+        mismatches = verify_ledger(db)
+        db.close()
+        print(f"            ledger replay mismatches: {len(mismatches)}")
+        errors = errors + [f"ledger mismatch: {m}" for m in mismatches]
+    return lost_total, errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--meals", type=int, default=40, help="meals per thread")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    members = [f"stress-member-{i}" for i in range(4)]
+    for user_id in members:
+        if not db.query(User).filter(User.user_id == user_id).first():
+            db.add(User(user_id=user_id, name=user_id))
+    db.commit()
+    kitchen = Kitchen(name="Stress Kitchen", owner_id=members[0])
+    db.add(kitchen)
+    db.commit()
+    kitchen_id = kitchen.id
+    db.close()
+
+    print(f"{args.threads} members x {args.meals} meals on one kitchen ({engine.dialect.name}), plus a restocker\n")
+    run("naive", args, kitchen_id, members[0], members)
+    failed = False
+    for mode in ("optimistic", "atomic"):
+        lost, errors = run(mode, args, kitchen_id, members[0], members)
+        failed = failed or lost > 1e-6 or bool(errors)
+
+    print("\nFAIL: lost updates or errors with row versioning" if failed else "\nOK: no lost updates with row versioning")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Run upload OCR workers outside the API process.
+
+Each process pulls jobs from the upload queue (Redis when REDIS_URL is set, otherwise
+the local SQLite file UPLOAD_QUEUE_DB) with UPLOAD_WORKER_CONCURRENCY threads; Vision
+calls are capped at OCR_MAX_CONCURRENCY per process. Jobs that hit rate limits or
+timeouts are retried with backoff; a job whose worker dies is picked up again once its
+visibility timeout (UPLOAD_JOB_VISIBILITY_TIMEOUT) passes.
+
+Set UPLOAD_WORKER_MODE=external on the API so it only enqueues. The API reads job
+status from the job store, so workers in other processes need REDIS_URL. Jobs carry
+the path of the uploaded file, so workers also need the API's UPLOAD_SPOOL_DIR (same
+host or a shared volume).
+
+Usage:
+    python upload_worker.py                          # 1 process
+    python upload_worker.py --processes 2 --concurrency 4
+"""
+import argparse
+import multiprocessing
+import signal
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def run_worker(concurrency):
+    from app.models import kitchen, chat as chat_model, meals, workspace  # noqa: F401 - register tables
+    from app.services.upload_jobs import UploadWorker
+
+    stopped = threading.Event()
+    # SIGTERM (deploys) / Ctrl+C: finish the jobs in hand, then exit
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    signal.signal(signal.SIGINT, lambda *_: stopped.set())
+
+    worker = UploadWorker(concurrency=concurrency)
+    worker.start()
+    stopped.wait()
+    print("Upload worker stopping...", flush=True)
+    worker.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=None, help="threads per process (UPLOAD_WORKER_CONCURRENCY)")
+    args = parser.parse_args()
+
+    if args.processes == 1:
+        run_worker(args.concurrency)
+        return
+
+    processes = [multiprocessing.Process(target=run_worker, args=(args.concurrency,)) for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    # Children handle Ctrl+C themselves; SIGTERM is forwarded
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: [p.terminate() for p in processes])
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
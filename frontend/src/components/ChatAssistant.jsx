@@ -1,12 +1,50 @@
 import React, { useState, useContext, useRef, useEffect } from 'react';
 import api from '../api';
 import { UserContext } from '../context/UserContext';
-import { Bot, X, Send, User, Sparkles, Play } from 'lucide-react';
+import { Bot, X, Send, User, Sparkles, Play, ChefHat, Package } from 'lucide-react';
 import ReactMarkdown from 'react-markdown';
 import { useNavigate } from 'react-router-dom';
 
+const DraftCard = ({ draft }) => {
+    const { action, payload = {}, partial } = draft;
+    const isMeal = action === "DRAFT_MEAL";
+    const ingredients = isMeal && Array.isArray(payload.ingredients)
+        ? payload.ingredients.filter(ing => ing && ing.item)
+        : [];
+    const Icon = isMeal ? ChefHat : Package;
+    const title = isMeal ? payload.name : payload.item_name;
+
+    return (
+        <div className="mt-3 w-full min-w-[240px] p-4 rounded-2xl bg-stone-900 border border-orange-500/30 shadow-lg animate-fade-in">
+            <div className="flex items-center gap-2 text-xs font-bold uppercase tracking-wider text-orange-400">
+                <Icon size={14} />
+                {partial
+                    ? (isMeal ? "Drafting meal log..." : "Drafting stock entry...")
+                    : (isMeal ? "Meal log ready" : "Stock entry ready")}
+            </div>
+            <div className="mt-2 font-bold text-white">
+                {title || <span className="text-stone-500">...</span>}
+                {!isMeal && payload.quantity && <span className="ml-2 font-medium text-stone-400">{payload.quantity}</span>}
+            </div>
+            {ingredients.length > 0 && (
+                <ul className="mt-2 space-y-1 text-sm text-stone-300">
+                    {ingredients.map((ing, i) => (
+                        <li key={i} className="flex justify-between gap-4">
+                            <span>{ing.item}</span>
+                            <span className="text-stone-500">{ing.qty ?? "..."}</span>
+                        </li>
+                    ))}
+                </ul>
+            )}
+            {partial && (
+                <div className="mt-3 h-1 w-16 rounded-full bg-orange-500/60 animate-pulse" />
+            )}
+        </div>
+    );
+};
+
 const ChatAssistant = () => {
-    const { user, triggerStockRefresh } = useContext(UserContext);
+    const { user, triggerStockRefresh, activeKitchen } = useContext(UserContext);
     const [messages, setMessages] = useState([]);
     const navigate = useNavigate();
 
@@ -72,20 +110,38 @@ const ChatAssistant = () => {
                 },
                 body: JSON.stringify({
                     message: userMsg,
-                    user_id: user.id
+                    user_id: user.id,
+                    kitchen_id: activeKitchen?.id
                 })
             });
 
             const reader = response.body.getReader();
             const decoder = new TextDecoder();
             let assistantMessage = "";
+            // Meal/stock drafts by tool call index; partial ones fill in while the model writes them
+            let drafts = {};
+            // A read can end mid-frame or mid-character: keep the incomplete tail for the next one
+            let buffer = "";
+
+            const updateAssistant = () => {
+                setMessages(prev => {
+                    const newMsgs = [...prev];
+                    newMsgs[newMsgs.length - 1] = {
+                        role: 'assistant',
+                        content: assistantMessage,
+                        drafts: Object.values(drafts)
+                    };
+                    return newMsgs;
+                });
+            };
 
             while (true) {
                 const { done, value } = await reader.read();
                 if (done) break;
 
-                const chunk = decoder.decode(value);
-                const lines = chunk.split('\n\n');
+                buffer += decoder.decode(value, { stream: true });
+                const lines = buffer.split('\n\n');
+                buffer = lines.pop();
 
                 for (const line of lines) {
                     if (line.startsWith('data: ')) {
@@ -94,18 +150,17 @@ const ChatAssistant = () => {
 
                             if (data.type === 'token') {
                                 assistantMessage += data.content;
-                                setMessages(prev => {
-                                    const newMsgs = [...prev];
-                                    newMsgs[newMsgs.length - 1] = {
-                                        role: 'assistant',
-                                        content: assistantMessage
-                                    };
-                                    return newMsgs;
-                                });
+                                updateAssistant();
+                            } else if (data.type === 'action_partial') {
+                                drafts = { ...drafts, [data.index]: { action: data.action, payload: data.payload, partial: true } };
+                                updateAssistant();
                             } else if (data.type === 'status') {
                                 // Optional: Show a "Thinking..." toast or status line
                                 // console.log("Status:", data.content);
                             } else if (data.type === 'action') {
+                                // The finished draft replaces the partial one
+                                drafts = { ...drafts, [data.index ?? Object.keys(drafts).length]: { action: data.action, payload: data.payload, partial: false } };
+                                updateAssistant();
                                 if (data.action === "DRAFT_MEAL") {
                                     showToast("📝 Opening Meal Log...");
                                     setTimeout(() => {
@@ -206,6 +261,9 @@ const ChatAssistant = () => {
                                 )}
                             </div>
 
+                            {/* Meal / stock drafts (filled in while they stream) */}
+                            {msg.drafts?.map((draft, i) => <DraftCard key={i} draft={draft} />)}
+
                             {/* Suggestion Button inside Chat */}
                             {suggestion && (
                                 <button
@@ -83,14 +83,15 @@ const UploadBill = ({ mode = 'bill' }) => {
 
             setMessage("Analyzing image... (You can minimize this tab)");
 
-            // 2. Poll for Status
-            const pollInterval = setInterval(async () => {
+            // 2. Wait for Status (long-poll: the server answers as soon as the job changes)
+            let revision;
+            const poll = async () => {
                 try {
-                    const statusRes = await api.get(`/upload/status/${job_id}`);
+                    const statusRes = await api.get(`/upload/status/${job_id}/wait`, { params: { revision } });
                     const { status, data, error } = statusRes.data;
+                    revision = statusRes.data.revision;
 
                     if (status === 'completed') {
-                        clearInterval(pollInterval);
                         setLoading(false);
 
                         if (isMealMode) {
@@ -123,14 +124,13 @@ const UploadBill = ({ mode = 'bill' }) => {
                             navigate('/add?mode=stock', { state: { stockDrafts: drafts } });
                         }
                     } else if (status === 'error') {
-                        clearInterval(pollInterval);
                         throw new Error(error || "AI Processing Failed");
                     } else {
                         // Still processing...
                         console.log(`Job ${job_id}: ${status}`);
+                        poll();
                     }
                 } catch (err) {
-                    clearInterval(pollInterval);
                     console.error("Polling Error:", err);
                     setStatus('error');
                     // Show specific error from backend if available
@@ -138,7 +138,8 @@ const UploadBill = ({ mode = 'bill' }) => {
                     setMessage(specificError || "Failed to check status. Network issue?");
                     setLoading(false);
                 }
-            }, 2000); // Check every 2 seconds
+            };
+            poll();
 
         } catch (error) {
             console.error(error);